@@ -0,0 +1,547 @@
+import os
+import json
+import asyncio
+import logging
+from datetime import date
+from typing import AsyncIterator, Optional, Dict, Any, List, Tuple
+
+from psycopg.pq import TransactionStatus
+from psycopg_pool import AsyncConnectionPool
+
+from database import (
+    db_params,
+    ADD_PEREVAL_SQL,
+    USER_IDS,
+    SELECT_PEREVAL_SQL,
+    SELECT_IMAGES_SQL,
+    UPDATE_PEREVAL_SQL,
+    SELECT_USER_PEREVALS_SQL,
+    PEREVAL_FIELDS,
+    select_pereval_json_sql,
+    select_user_perevals_json_sql,
+    SELECT_CHANGES_SQL,
+    changes_params,
+    changes_result,
+    CLAIM_PEREVALS_SQL,
+    SET_STATUS_SQL,
+    SELECT_QUEUE_JSON_SQL,
+    SELECT_STATS_JSON_SQL,
+    EXPORT_BATCH,
+    EXPORT_CHUNK_SIZE,
+    select_export_sql,
+    export_fields,
+    export_params,
+    export_inline_images,
+    export_batch,
+    export_end,
+    MODERATION_CLAIM_TTL,
+    DEFAULT_PAGE_LIMIT,
+    update_params,
+    update_result,
+    add_pereval_params,
+    pereval_from_row,
+    image_from_row,
+    store_images,
+    BATCH_USERS_SQL,
+    RESERVE_IDS_SQL,
+    BATCH_COORDS_SQL,
+    BATCH_PEREVALS_SQL,
+    BATCH_IMAGES_SQL,
+    validate_batch,
+    batch_result,
+    item_error_result,
+    batch_users_params,
+    batch_rows_params,
+    batch_images_params,
+    ENQUEUE_SUBMISSION_SQL,
+    CLAIM_SUBMISSIONS_SQL,
+    FINISH_SUBMISSIONS_SQL,
+    RELEASE_SUBMISSIONS_SQL,
+    SELECT_SUBMISSION_SQL,
+    INGEST_MAX_ATTEMPTS,
+    INGEST_CLAIM_TTL,
+    finish_params,
+    submission_status,
+    CLAIM_IDEMPOTENCY_KEY_SQL,
+    FINISH_IDEMPOTENCY_KEY_SQL,
+    SELECT_IDEMPOTENCY_KEY_SQL,
+    claim_key_params,
+    GEO_SEARCH_SQL,
+    geo_params,
+    radius_boxes,
+    bbox_boxes,
+    geo_result_from_row,
+    SELECT_CLUSTER_TILES_SQL,
+    cluster_tiles_params,
+    SIMILAR_WORDS_SQL,
+    SEARCH_PEREVALS_SQL,
+    SEARCH_SIMILARITY,
+    SEARCH_VARIANTS_PER_WORD,
+    search_query_words,
+    build_tsquery,
+    search_params,
+    search_result_from_row,
+)
+from blobstore import BlobStore, get_blob_store
+from metrics import instrument_db
+from logs import AsyncSlowQueryCursor
+
+logger = logging.getLogger("pereval.db")
+
+
+# асинхронный пул (psycopg 3), открывается в lifespan приложения; params — другой сервер (реплика)
+def create_async_pool(params: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> AsyncConnectionPool:
+    return AsyncConnectionPool(
+        kwargs=params if params is not None else db_params(),
+        min_size=int(os.getenv("FSTR_DB_POOL_MIN", "1")),
+        max_size=int(os.getenv("FSTR_DB_POOL_MAX", "10")),
+        max_lifetime=float(os.getenv("FSTR_DB_POOL_MAX_LIFETIME", "1800")),
+        timeout=timeout if timeout is not None else float(os.getenv("FSTR_DB_POOL_TIMEOUT", "5")),
+        check=AsyncConnectionPool.check_connection,
+        open=False,
+    )
+
+
+@instrument_db("async")
+class AsyncDatabaseManager:
+    """Доступ к БД для приложения и воркеров (psycopg 3 на асинхронном пуле): запросы не блокируют event loop"""
+
+    def __init__(self, pool: AsyncConnectionPool, blob_store: Optional[BlobStore] = None,
+                 fallback: Optional[AsyncConnectionPool] = None):
+        self.pool = pool
+        # если pool — реплика: основной пул, на который уходит запрос, когда реплика недоступна
+        self.fallback = fallback
+        self.blob_store = blob_store if blob_store is not None else get_blob_store()
+        self.connection = None
+        self.cursor = None
+
+    # взять соединение из пула
+    async def connect(self):
+        try:
+            try:
+                self.connection = await self.pool.getconn()
+            except Exception:
+                if self.fallback is None:
+                    raise
+                logger.warning("Реплика недоступна, запрос идёт на основную БД")
+                self.pool, self.fallback = self.fallback, None
+                self.connection = await self.pool.getconn()
+            self.cursor = AsyncSlowQueryCursor(self.connection.cursor(), self.connection, self)
+            return True
+        except Exception:
+            logger.exception("Ошибка подключения к БД")
+            if self.connection is not None:
+                await self.disconnect()
+            return False
+
+    # вернуть соединение в пул
+    async def disconnect(self):
+        if self.cursor:
+            await self.cursor.close()
+            self.cursor = None
+        if self.connection:
+            try:
+                # чтение оставляет открытую транзакцию — закрываем её до возврата в пул; соединение
+                # с прерванным запросом (ACTIVE) пул закроет сам
+                if self.connection.info.transaction_status in (TransactionStatus.INTRANS, TransactionStatus.INERROR):
+                    await self.connection.rollback()
+            finally:
+                await self.pool.putconn(self.connection)
+                self.connection = None
+
+    # вставка перевала одним запросом без фиксации транзакции: (id перевала, id пользователя)
+    async def _insert_pereval(self, data: Dict[str, Any]) -> Tuple[int, int]:
+        # запись файлов — в потоке, чтобы не блокировать event loop
+        images = await asyncio.to_thread(store_images, self.blob_store, data["images"])
+        await self.cursor.execute(ADD_PEREVAL_SQL, add_pereval_params(data, images))
+        return await self.cursor.fetchone()
+
+    # добавление перевала
+    async def add_pereval(self, data: Dict[str, Any]) -> Optional[int]:
+        try:
+            pereval_id, user_id = await self._insert_pereval(data)
+            await self.connection.commit()
+            USER_IDS.set(data["user"]["email"], user_id)
+            return pereval_id
+
+        except Exception:
+            logger.exception("Ошибка добавления перевала")
+            await self.connection.rollback()
+            USER_IDS.delete(data["user"]["email"])
+            return None
+
+    # добавление с ключом идемпотентности: (id перевала, отпечаток создавшего его запроса, повтор ли это)
+    async def add_pereval_once(self, key: str, fingerprint: str,
+                               data: Dict[str, Any]) -> Optional[Tuple[int, str, bool]]:
+        try:
+            # ждёт, если тот же ключ занят незавершённой транзакцией
+            await self.cursor.execute(CLAIM_IDEMPOTENCY_KEY_SQL, claim_key_params(key, fingerprint))
+            if await self.cursor.fetchone() is None:
+                await self.cursor.execute(SELECT_IDEMPOTENCY_KEY_SQL, (key,))
+                stored_fingerprint, pereval_id = await self.cursor.fetchone()
+                await self.connection.commit()
+                return pereval_id, stored_fingerprint, True
+
+            pereval_id, user_id = await self._insert_pereval(data)
+            await self.cursor.execute(FINISH_IDEMPOTENCY_KEY_SQL, (pereval_id, key))
+            await self.connection.commit()
+            USER_IDS.set(data["user"]["email"], user_id)
+            return pereval_id, fingerprint, False
+
+        except Exception:
+            logger.exception("Ошибка добавления перевала")
+            await self.connection.rollback()
+            USER_IDS.delete(data["user"]["email"])
+            return None
+
+    # пакетное добавление перевалов одной транзакцией; результат по каждому элементу
+    # submission_ids — заявки очереди отложенной записи: их итог фиксируется в той же транзакции
+    async def add_perevals(self, items: List[Dict[str, Any]],
+                           submission_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        results, valid = validate_batch(items)
+        if not valid and submission_ids is None:
+            return results
+
+        try:
+            if valid:
+                await self.cursor.execute(BATCH_USERS_SQL, batch_users_params(valid))
+                user_ids = dict(await self.cursor.fetchall())
+
+                await self.cursor.execute(RESERVE_IDS_SQL, (len(valid),))
+                ids = await self.cursor.fetchall()
+
+                coords_columns, perevals_columns = batch_rows_params(valid, ids, user_ids)
+                await self.cursor.execute(BATCH_COORDS_SQL, coords_columns)
+                await self.cursor.execute(BATCH_PEREVALS_SQL, perevals_columns)
+                images_columns = await asyncio.to_thread(batch_images_params, self.blob_store, valid, ids)
+                await self.cursor.execute(BATCH_IMAGES_SQL, images_columns)
+
+                for (index, _), (_, pereval_id) in zip(valid, ids):
+                    results[index] = batch_result(index, 200, pereval_id)
+
+            if submission_ids is not None:
+                await self.cursor.execute(FINISH_SUBMISSIONS_SQL, finish_params(submission_ids, results))
+
+            await self.connection.commit()
+
+        except Exception:
+            logger.exception("Ошибка пакетного добавления перевалов")
+            await self.connection.rollback()
+            if valid:
+                await self._add_perevals_one_by_one(valid, results, submission_ids)
+
+        return results
+
+    # пачка не записалась: по одному перевалу, каждый в своей точке сохранения — ошибку получает только
+    # перевал, который отвергла БД. Итог заявок — в той же транзакции
+    async def _add_perevals_one_by_one(self, valid: List[tuple], results: List[Optional[Dict[str, Any]]],
+                                       submission_ids: Optional[List[str]]):
+        try:
+            for index, data in valid:
+                await self.cursor.execute("SAVEPOINT batch_item")
+                try:
+                    pereval_id, _ = await self._insert_pereval(data)
+                    results[index] = batch_result(index, 200, pereval_id)
+                except Exception as e:
+                    logger.warning("Перевал %d пакета не добавлен: %s", index, e)
+                    await self.cursor.execute("ROLLBACK TO SAVEPOINT batch_item")
+                    USER_IDS.delete(data["user"]["email"])
+                    results[index] = item_error_result(index, e)
+                await self.cursor.execute("RELEASE SAVEPOINT batch_item")
+
+            if submission_ids is not None:
+                await self.cursor.execute(FINISH_SUBMISSIONS_SQL, finish_params(submission_ids, results))
+
+            await self.connection.commit()
+
+        except Exception:
+            logger.exception("Ошибка пакетного добавления перевалов по одному")
+            await self.connection.rollback()
+            for index, _ in valid:
+                results[index] = batch_result(index, 500, message="Ошибка при добавлении данных в БД")
+
+    # поставить заявку в очередь отложенной записи
+    async def enqueue_submission(self, tracking_id: str, data: Dict[str, Any]) -> bool:
+        try:
+            await self.cursor.execute(ENQUEUE_SUBMISSION_SQL, (tracking_id, json.dumps(data, ensure_ascii=False)))
+            await self.connection.commit()
+            return True
+
+        except Exception:
+            logger.exception("Ошибка постановки заявки в очередь")
+            await self.connection.rollback()
+            return False
+
+    # взять до limit заявок на запись: [(tracking_id, данные перевала)]
+    async def claim_submissions(self, limit: int) -> List[Tuple[str, Dict[str, Any]]]:
+        try:
+            await self.cursor.execute(CLAIM_SUBMISSIONS_SQL, {"limit": limit, "claim_ttl": INGEST_CLAIM_TTL})
+            claimed = [(r[0], r[1]) for r in await self.cursor.fetchall()]
+            await self.connection.commit()
+            return claimed
+
+        except Exception:
+            logger.exception("Ошибка выдачи заявок на запись")
+            await self.connection.rollback()
+            return []
+
+    # вернуть незаписанные заявки в очередь (или в failed после INGEST_MAX_ATTEMPTS попыток)
+    async def release_submissions(self, tracking_ids: List[str], message: str):
+        try:
+            await self.cursor.execute(RELEASE_SUBMISSIONS_SQL, {
+                "ids": tracking_ids, "message": message, "max_attempts": INGEST_MAX_ATTEMPTS
+            })
+            await self.connection.commit()
+
+        except Exception:
+            logger.exception("Ошибка возврата заявок в очередь")
+            await self.connection.rollback()
+
+    # состояние заявки; None — заявки нет
+    async def get_submission(self, tracking_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            await self.cursor.execute(SELECT_SUBMISSION_SQL, (tracking_id,))
+            row = await self.cursor.fetchone()
+            return submission_status(tracking_id, *row) if row else None
+
+        except Exception:
+            logger.exception("Ошибка получения заявки")
+            return None
+
+    # получение одного перевала
+    async def get_pereval(self, pereval_id: int) -> Optional[Dict[str, Any]]:
+        try:
+            await self.cursor.execute(SELECT_PEREVAL_SQL, (pereval_id,))
+            row = await self.cursor.fetchone()
+
+            if not row:
+                return None
+
+            await self.cursor.execute(SELECT_IMAGES_SQL, (pereval_id,))
+            images = [image_from_row(r) for r in await self.cursor.fetchall()]
+
+            return pereval_from_row(row, images)
+
+        except Exception:
+            logger.exception("Ошибка получения перевала")
+            return None
+
+    # перевалы в радиусе radius_km от точки, по возрастанию расстояния
+    async def get_perevals_near(self, lat: float, lon: float, radius_km: float, limit: int = DEFAULT_PAGE_LIMIT,
+                                after: Optional[Tuple[float, int]] = None) -> List[Dict[str, Any]]:
+        try:
+            params = geo_params(lat, lon, radius_boxes(lat, lon, radius_km), radius_km, limit, after)
+            await self.cursor.execute(GEO_SEARCH_SQL, params)
+            return [geo_result_from_row(r) for r in await self.cursor.fetchall()]
+
+        except Exception:
+            logger.exception("Ошибка поиска перевалов рядом")
+            return []
+
+    # перевалы в области просмотра карты, по удалению от точки (lat, lon)
+    async def get_perevals_in_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                                   lat: float, lon: float, limit: int = DEFAULT_PAGE_LIMIT,
+                                   after: Optional[Tuple[float, int]] = None) -> List[Dict[str, Any]]:
+        try:
+            boxes = bbox_boxes(min_lat, min_lon, max_lat, max_lon)
+            await self.cursor.execute(GEO_SEARCH_SQL, geo_params(lat, lon, boxes, None, limit, after))
+            return [geo_result_from_row(r) for r in await self.cursor.fetchall()]
+
+        except Exception:
+            logger.exception("Ошибка поиска перевалов в области")
+            return []
+
+    # кластеры тайлов уровня zoom: {(x, y): фрагмент JSON-массива}; None — ошибка
+    async def get_cluster_tiles(self, zoom: int,
+                                tiles: List[Tuple[int, int]]) -> Optional[Dict[Tuple[int, int], bytes]]:
+        try:
+            await self.cursor.execute(SELECT_CLUSTER_TILES_SQL, cluster_tiles_params(zoom, tiles))
+            return {(x, y): body.encode("utf-8") for x, y, body in await self.cursor.fetchall()}
+
+        except Exception:
+            logger.exception("Ошибка получения кластеров")
+            return None
+
+    # поиск по названиям с учётом опечаток, по убыванию релевантности
+    async def search_perevals(self, query: str, limit: int = DEFAULT_PAGE_LIMIT,
+                              after: Optional[Tuple[float, int]] = None) -> List[Dict[str, Any]]:
+        try:
+            words = search_query_words(query)
+            if not words:
+                return []
+
+            await self.cursor.execute(SIMILAR_WORDS_SQL, {
+                "words": words, "threshold": SEARCH_SIMILARITY, "per_word": SEARCH_VARIANTS_PER_WORD
+            })
+            similar: Dict[str, List[str]] = {}
+            for word, variant in await self.cursor.fetchall():
+                similar.setdefault(word, []).append(variant)
+
+            await self.cursor.execute(SEARCH_PEREVALS_SQL, search_params(build_tsquery(words, similar), limit, after))
+            return [search_result_from_row(r) for r in await self.cursor.fetchall()]
+
+        except Exception:
+            logger.exception("Ошибка поиска перевалов")
+            await self.connection.rollback()
+            return []
+
+    # обновление перевала одним оператором; version — ожидаемая версия (оптимистичная блокировка)
+    async def update_pereval(self, pereval_id: int, data: Dict[str, Any],
+                             version: Optional[int] = None) -> Dict[str, Any]:
+        try:
+            images = None
+            if data.get("images") is not None:
+                images = await asyncio.to_thread(store_images, self.blob_store, data["images"])
+
+            await self.cursor.execute(UPDATE_PEREVAL_SQL, update_params(pereval_id, data, images, version))
+            result = update_result(await self.cursor.fetchone())
+
+            await self.connection.commit()
+            return result
+
+        except Exception as e:
+            logger.exception("Ошибка обновления")
+            await self.connection.rollback()
+            return {"state": 0, "message": str(e)}
+
+    # готовый JSON перевала (собран в Postgres); None — перевала нет
+    async def get_pereval_json(self, pereval_id: int, fields: Tuple[str, ...] = PEREVAL_FIELDS) -> Optional[bytes]:
+        try:
+            await self.cursor.execute(select_pereval_json_sql(fields), (pereval_id,))
+            row = await self.cursor.fetchone()
+            return row[0].encode("utf-8") if row else None
+
+        except Exception:
+            logger.exception("Ошибка получения перевала")
+            return None
+
+    # страница списка перевалов пользователя готовым JSON и id для курсора следующей страницы
+    async def get_user_perevals_json(self, email: str, limit: int = DEFAULT_PAGE_LIMIT, after_id: int = 0,
+                                     fields: Tuple[str, ...] = PEREVAL_FIELDS) -> Tuple[bytes, Optional[int]]:
+        try:
+            await self.cursor.execute(
+                select_user_perevals_json_sql(fields), {"email": email, "after_id": after_id, "limit": limit}
+            )
+            body, next_id = await self.cursor.fetchone()
+            return body.encode("utf-8"), next_id
+
+        except Exception:
+            logger.exception("Ошибка получения списка перевалов")
+            return b"[]", None
+
+    # изменения перевалов пользователя после курсора для синхронизации; None — ошибка
+    async def get_changes(self, email: str, after: Tuple[int, int] = (0, 0),
+                          limit: int = DEFAULT_PAGE_LIMIT) -> Optional[Tuple[bytes, List[int], Tuple[int, int], bool]]:
+        try:
+            await self.cursor.execute(SELECT_CHANGES_SQL, changes_params(email, after, limit))
+            return changes_result(await self.cursor.fetchone(), after)
+
+        except Exception:
+            logger.exception("Ошибка получения изменений перевалов")
+            return None
+
+    # взять на модерацию до limit перевалов; JSON-массив взятых перевалов и их id
+    async def claim_perevals(self, moderator: str, limit: int) -> Tuple[bytes, List[int]]:
+        try:
+            await self.cursor.execute(CLAIM_PEREVALS_SQL, {
+                "moderator": moderator, "limit": limit, "claim_ttl": MODERATION_CLAIM_TTL
+            })
+            body, ids = await self.cursor.fetchone()
+            await self.connection.commit()
+            return body.encode("utf-8"), ids
+
+        except Exception:
+            logger.exception("Ошибка выдачи перевалов на модерацию")
+            await self.connection.rollback()
+            return b"[]", []
+
+    # перевести взятые модератором перевалы в status; изменённые и пропущенные id
+    async def set_status(self, ids: List[int], status: str, moderator: str) -> Dict[str, List[int]]:
+        try:
+            await self.cursor.execute(SET_STATUS_SQL, {"ids": ids, "status": status, "moderator": moderator})
+            updated = sorted(r[0] for r in await self.cursor.fetchall())
+            await self.connection.commit()
+            return {"updated": updated, "skipped": sorted(set(ids) - set(updated))}
+
+        except Exception:
+            logger.exception("Ошибка смены статуса")
+            await self.connection.rollback()
+            return {"updated": [], "skipped": sorted(set(ids))}
+
+    # очередь модерации: страница новых перевалов и id для курсора следующей страницы
+    async def get_moderation_queue(self, limit: int = DEFAULT_PAGE_LIMIT,
+                                   after_id: int = 0) -> Tuple[bytes, Optional[int]]:
+        try:
+            await self.cursor.execute(SELECT_QUEUE_JSON_SQL, {"after_id": after_id, "limit": limit})
+            body, next_id = await self.cursor.fetchone()
+            return body.encode("utf-8"), next_id
+
+        except Exception:
+            logger.exception("Ошибка получения очереди модерации")
+            return b"[]", None
+
+    # сводная статистика готовым JSON; None — ошибка
+    async def get_stats_json(self, days: int = 30, top: int = 10) -> Optional[bytes]:
+        try:
+            await self.cursor.execute(SELECT_STATS_JSON_SQL, {"days": days, "top": top})
+            return (await self.cursor.fetchone())[0].encode("utf-8")
+
+        except Exception:
+            logger.exception("Ошибка получения статистики")
+            return None
+
+    # выгрузка каталога частями: JSON — по EXPORT_BATCH перевалов, CSV — от EXPORT_CHUNK_SIZE байт.
+    # Ошибка посреди выгрузки пробрасывается: поток обрывается, а не выглядит законченным
+    async def export_perevals(self, fmt: str = "ndjson", fields: Tuple[str, ...] = PEREVAL_FIELDS,
+                              status: Optional[str] = None, since: Optional[date] = None,
+                              until: Optional[date] = None, images: str = "refs") -> AsyncIterator[bytes]:
+        fields = export_fields(fields, images)
+        sql, params = select_export_sql(fmt, fields), export_params(status, since, until)
+        try:
+            # свои курсоры, без журнала медленных запросов: выгрузка долгая по определению
+            if fmt == "csv":
+                async with self.connection.cursor() as cursor:
+                    async with cursor.copy(sql, params) as copy:
+                        chunk = bytearray()
+                        async for data in copy:
+                            chunk += data
+                            if len(chunk) >= EXPORT_CHUNK_SIZE:
+                                yield bytes(chunk)
+                                chunk.clear()
+                        if chunk:
+                            yield bytes(chunk)
+                return
+
+            async with self.connection.cursor(name="pereval_export") as cursor:
+                await cursor.execute(sql, params)
+                first = True
+                while True:
+                    docs = [row[0] for row in await cursor.fetchmany(EXPORT_BATCH)]
+                    if not docs:
+                        break
+                    if images == "inline":
+                        docs = await asyncio.to_thread(
+                            lambda: [export_inline_images(doc, self.blob_store) for doc in docs]
+                        )
+                    yield export_batch(fmt, docs, first)
+                    first = False
+                yield export_end(fmt, first)
+
+        except Exception:
+            logger.exception("Ошибка выгрузки каталога")
+            raise
+
+    # список перевалов пользователя: страница из limit записей с id больше after_id
+    async def get_user_perevals(
+        self, email: str, limit: int = DEFAULT_PAGE_LIMIT, after_id: int = 0
+    ) -> List[Dict[str, Any]]:
+        try:
+            await self.cursor.execute(SELECT_USER_PEREVALS_SQL, (email, after_id, limit))
+            return [
+                pereval_from_row(r[:21], [image_from_row(i) for i in r[21]])
+                for r in await self.cursor.fetchall()
+            ]
+
+        except Exception:
+            logger.exception("Ошибка получения списка перевалов")
+            return []
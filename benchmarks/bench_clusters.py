@@ -0,0 +1,73 @@
+"""
+Карта на уровне обзора: страница из 1000 перевалов области через GET /perevals/bbox (кластеризация на клиенте,
+и это ещё не все перевалы) против GET /perevals/clusters — из ячеек cluster_cells (тайлы не в кэше) и из кэша тайлов.
+Запросы идут через приложение целиком (ASGI, без сети).
+
+Запуск (нужна БД из .env с перевалами, например после bench_geo.py --seed 300000):
+    python benchmarks/bench_clusters.py --rounds 50
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import main as api
+
+# область просмотра (Приэльбрусье) на уровнях обзора
+AREA = {"min_lat": 43.0, "min_lon": 42.0, "max_lat": 44.0, "max_lon": 43.5}
+ZOOMS = [6, 8, 10]
+
+
+async def bbox_page(client: httpx.AsyncClient, zoom: int) -> int:
+    response = await client.get("/perevals/bbox", params=dict(AREA, limit=1000))
+    response.raise_for_status()
+    return len(response.content)
+
+
+async def clusters(client: httpx.AsyncClient, zoom: int) -> int:
+    response = await client.get("/perevals/clusters", params=dict(AREA, zoom=zoom))
+    response.raise_for_status()
+    return len(response.content)
+
+
+async def clusters_cold(client: httpx.AsyncClient, zoom: int) -> int:
+    api.app.state.clusters.clear()
+    return await clusters(client, zoom)
+
+
+async def measure(func, client: httpx.AsyncClient, zoom: int, rounds: int) -> dict:
+    wall, size = [], 0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        size = await func(client, zoom)
+        wall.append((time.perf_counter() - started) * 1000)
+    return {"wall": statistics.median(wall), "bytes": size}
+
+
+async def run(args):
+    async with api.lifespan(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            response = await client.get("/perevals/clusters", params=dict(AREA, zoom=ZOOMS[0]))
+            print(f"перевалов в тайлах z{ZOOMS[0]}: {sum(c['count'] for c in response.json())}")
+            print(f"{'':28}{'wall p50, ms':>14}{'bytes':>12}")
+            await measure(bbox_page, client, 0, 3)  # прогрев
+            r = await measure(bbox_page, client, 0, args.rounds)
+            print(f"{'bbox, 1000 перевалов':28}{r['wall']:>14.2f}{r['bytes']:>12}")
+            for zoom in ZOOMS:
+                for name, func in ((f"clusters z{zoom}", clusters_cold), (f"clusters z{zoom} / кэш", clusters)):
+                    await measure(func, client, zoom, 3)  # прогрев
+                    r = await measure(func, client, zoom, args.rounds)
+                    print(f"{name:28}{r['wall']:>14.2f}{r['bytes']:>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=50)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,118 @@
+"""
+Пропускная способность GET /submitData/{id} при конкурентных запросах:
+до (синхронный DatabaseManager со своим соединением внутри async-обработчика, блокирует event loop)
+и после (AsyncDatabaseManager на асинхронном пуле).
+
+Запуск (нужна тестовая БД из .env):
+    python benchmarks/bench_concurrency.py --requests 500 --concurrency 50 --slow-ms 20
+
+--slow-ms добавляет к каждому запросу SELECT pg_sleep(...) — имитация медленного запроса.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import FastAPI, HTTPException
+
+from database import DatabaseManager
+from async_database import AsyncDatabaseManager, create_async_pool
+
+SAMPLE = {
+    "beauty_title": "пер.", "title": "Бенчмарк", "other_titles": "", "connect": "",
+    "add_time": "2023-12-07 12:00:00",
+    "user": {"email": "bench@example.com", "fam": "Бенч", "name": "Марк", "otc": "", "phone": ""},
+    "coords": {"latitude": 45.38, "longitude": 7.15, "height": 1200},
+    "level": {"winter": "", "summer": "1А", "autumn": "1А", "spring": ""},
+    "images": [{"data": "x" * 1024, "title": "фото"}],
+}
+
+
+def sync_app(slow_ms: int) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/submitData/{pereval_id}")
+    async def get_pereval(pereval_id: int):
+        db_manager = DatabaseManager()
+        if not db_manager.connect():
+            raise HTTPException(status_code=500)
+        if slow_ms:
+            db_manager.cursor.execute("SELECT pg_sleep(%s)", (slow_ms / 1000,))
+        pereval = db_manager.get_pereval(pereval_id)
+        db_manager.disconnect()
+        return pereval
+
+    return app
+
+
+def async_app(pool, slow_ms: int) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/submitData/{pereval_id}")
+    async def get_pereval(pereval_id: int):
+        db_manager = AsyncDatabaseManager(pool)
+        if not await db_manager.connect():
+            raise HTTPException(status_code=500)
+        if slow_ms:
+            await db_manager.cursor.execute("SELECT pg_sleep(%s)", (slow_ms / 1000,))
+        pereval = await db_manager.get_pereval(pereval_id)
+        await db_manager.disconnect()
+        return pereval
+
+    return app
+
+
+async def drive(app: FastAPI, pereval_id: int, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(f"/submitData/{pereval_id}")
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+async def main(args):
+    apool = create_async_pool()
+    await apool.open()
+    db = AsyncDatabaseManager(apool)
+    if not await db.connect():
+        sys.exit("Нет подключения к БД")
+    pereval_id = await db.add_pereval(SAMPLE)
+    await db.disconnect()
+
+    before = await drive(sync_app(args.slow_ms), pereval_id, args.requests, args.concurrency)
+    after = await drive(async_app(apool, args.slow_ms), pereval_id, args.requests, args.concurrency)
+    await apool.close()
+
+    print(f"requests={args.requests} concurrency={args.concurrency} slow_ms={args.slow_ms}")
+    print(f"{'':8}{'req/s':>10}{'p50, ms':>10}{'p95, ms':>10}")
+    for name, r in (("before", before), ("after", after)):
+        print(f"{name:8}{r['rps']:>10.1f}{r['p50']:>10.1f}{r['p95']:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--slow-ms", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,88 @@
+"""
+Выгрузка всего каталога: все документы одним запросом (fetchall, как при сборе через списки)
+против потоковой GET /export в NDJSON, CSV и GeoJSON. Для каждого — время, размер и пик памяти Python
+(tracemalloc); размер — на проводе, до распаковки. Запросы идут через приложение целиком (ASGI, без сети и без буфера клиента).
+
+Запуск (нужна БД из .env с перевалами, например после bench_geo.py --seed 300000):
+    python benchmarks/bench_export.py
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as api
+from database import PEREVAL_DOC_SQL
+
+FETCHALL_SQL = f"SELECT {PEREVAL_DOC_SQL}::text FROM pereval_added p JOIN users u ON p.user_id = u.id " \
+               f"JOIN coords c ON p.coord_id = c.id ORDER BY p.id"
+
+
+async def fetchall() -> int:
+    db = api.get_db_manager()
+    assert await db.connect()
+    try:
+        await db.cursor.execute(FETCHALL_SQL)
+        return sum(len(doc) for doc, in await db.cursor.fetchall())
+    finally:
+        await db.disconnect()
+
+
+# ASGI-вызов напрямую: httpx.ASGITransport собирает весь ответ в памяти
+async def stream(fmt: str, encoding: str) -> int:
+    size, requested, done = 0, False, asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal size
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200, message["status"]
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/export", "raw_path": b"/export", "root_path": "", "query_string": f"format={fmt}".encode(),
+        "headers": [(b"host", b"bench"), (b"accept-encoding", encoding.encode())],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    await api.app(scope, receive, send)
+    done.set()
+    return size
+
+
+async def measure(name: str, coro):
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = await coro
+    wall = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:26}{wall:>10.1f}{size / 2 ** 20:>12.1f}{peak / 2 ** 20:>14.1f}")
+
+
+async def run(args):
+    async with api.lifespan(api.app):
+        print(f"{'':26}{'wall, s':>10}{'MB':>12}{'peak MB':>14}")
+        if not args.skip_fetchall:
+            await measure("fetchall", fetchall())
+        for fmt in ("ndjson", "csv", "geojson"):
+            for encoding in ("identity", "gzip"):
+                await measure(f"export {fmt} / {encoding}", stream(fmt, encoding))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--skip-fetchall", action="store_true", help="не загружать весь каталог в память")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,58 @@
+"""
+Размер и время страницы GET /submitData/?user__email=... : все поля или только нужные списку (fields=),
+без сжатия, gzip и br. Запросы идут через приложение целиком (ASGI, без сети), со всеми middleware.
+
+Запуск (нужна БД из .env с перевалами пользователя --email, например после bench_load.py):
+    python benchmarks/bench_fields.py --email load-bench-2@example.com --limit 50 --rounds 200
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import main as api
+
+FIELDS = [None, "title,coords,status,images"]
+ENCODINGS = ["identity", "gzip", "br"]
+
+
+async def measure(client: httpx.AsyncClient, params: dict, encoding: str, rounds: int) -> dict:
+    wall, size = [], 0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        response = await client.get("/submitData/", params=params, headers={"Accept-Encoding": encoding})
+        wall.append((time.perf_counter() - started) * 1000)
+        response.raise_for_status()
+        # размер на проводе — до распаковки
+        size = int(response.headers.get("content-length", len(response.content)))
+    return {"wall": statistics.median(wall), "bytes": size}
+
+
+async def run(args):
+    async with api.lifespan(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            print(f"{'':42}{'wall p50, ms':>14}{'bytes':>10}")
+            for fields in FIELDS:
+                params = {"user__email": args.email, "limit": args.limit}
+                if fields:
+                    params["fields"] = fields
+                for encoding in ENCODINGS:
+                    await measure(client, params, encoding, 5)  # прогрев
+                    r = await measure(client, params, encoding, args.rounds)
+                    name = f"{fields or 'все поля'} / {encoding}"
+                    print(f"{name:42}{r['wall']:>14.2f}{r['bytes']:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--email", default="load-bench-2@example.com")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=200)
+    asyncio.run(run(parser.parse_args()))
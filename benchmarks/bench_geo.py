@@ -0,0 +1,100 @@
+"""
+Поиск перевалов рядом с точкой на большом каталоге: GiST-индекс coords.geo против полного просмотра.
+
+Запуск (отдельная БД для бенчмарков, данные добавляются в неё):
+    python benchmarks/bench_geo.py --seed 300000 --queries 200
+
+--seed 0 повторно использует уже засеянные данные.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_database import AsyncDatabaseManager, create_async_pool
+from migrations import migrate_database
+
+# Кавказ, Алтай, Памир — чтобы точки были неравномерными, как в каталоге
+REGIONS = [(43.3, 42.5, 1.5), (49.8, 86.6, 2.0), (38.9, 72.0, 2.0)]
+
+
+async def seed(db: AsyncDatabaseManager, count: int, batch: int = 5000):
+    rnd = random.Random(48)
+    base = {
+        "beauty_title": "пер.", "other_titles": "", "connect": "", "add_time": None,
+        "level": {"winter": "", "summer": "1А", "autumn": "", "spring": ""}, "images": [],
+    }
+    for start in range(0, count, batch):
+        items = []
+        for i in range(start, min(start + batch, count)):
+            lat, lon, spread = rnd.choice(REGIONS)
+            items.append(dict(
+                base,
+                title=f"Бенч {i}",
+                user={"email": f"geo-bench-{i % 1000}@example.com", "fam": "", "name": "", "otc": "", "phone": ""},
+                coords={"latitude": rnd.gauss(lat, spread), "longitude": rnd.gauss(lon, spread), "height": 3000},
+            ))
+        await db.add_perevals(items)
+    await db.cursor.execute("ANALYZE coords; ANALYZE pereval_added")
+    await db.connection.commit()
+
+
+async def measure(db: AsyncDatabaseManager, queries: int, radius_km: float, use_index: bool) -> dict:
+    rnd = random.Random(7)
+    flag = "on" if use_index else "off"
+    await db.cursor.execute(f"SET enable_indexscan = {flag}; SET enable_bitmapscan = {flag}")
+
+    latencies, found = [], 0
+    for _ in range(queries):
+        lat, lon, spread = rnd.choice(REGIONS)
+        started = time.perf_counter()
+        found += len(await db.get_perevals_near(rnd.gauss(lat, spread), rnd.gauss(lon, spread), radius_km, limit=50))
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    await db.cursor.execute("RESET enable_indexscan; RESET enable_bitmapscan")
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "avg_found": found / queries,
+    }
+
+
+async def main(args):
+    migrate_database()
+    pool = create_async_pool()
+    await pool.open()
+    db = AsyncDatabaseManager(pool)
+    if not await db.connect():
+        sys.exit("Нет подключения к БД")
+
+    if args.seed:
+        started = time.perf_counter()
+        await seed(db, args.seed)
+        print(f"засеяно {args.seed} перевалов за {time.perf_counter() - started:.1f} с")
+
+    await db.cursor.execute("SELECT count(*) FROM coords")
+    total = (await db.cursor.fetchone())[0]
+    await db.connection.rollback()
+
+    print(f"coords={total} queries={args.queries} radius_km={args.radius_km} limit=50")
+    print(f"{'':12}{'p50, ms':>10}{'p95, ms':>10}{'найдено':>10}")
+    for name, use_index in (("seq scan", False), ("gist index", True)):
+        r = await measure(db, args.queries, args.radius_km, use_index)
+        print(f"{name:12}{r['p50']:>10.2f}{r['p95']:>10.2f}{r['avg_found']:>10.1f}")
+
+    await db.disconnect()
+    await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=300000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--radius-km", type=float, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,90 @@
+"""
+Сериализация ответов GET /submitData/{id} и списка перевалов пользователя:
+до (строки -> словари в Python -> валидация response_model -> json.dumps)
+и после (документ собирает Postgres, ответ — готовые байты).
+
+Запуск (нужна БД из .env с перевалами пользователя --email, например после bench_load.py):
+    python benchmarks/bench_json.py --email load-bench-1@example.com --limit 100 --rounds 200
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from async_database import AsyncDatabaseManager, create_async_pool
+
+ONE_FIELD = create_response_field("response", Dict[str, Any])
+LIST_FIELD = create_response_field("response", List[Dict[str, Any]])
+
+
+# прежний путь: словари из строк, затем то, что FastAPI делает с response_model
+async def before_one(db: AsyncDatabaseManager, pereval_id: int) -> bytes:
+    content = await serialize_response(field=ONE_FIELD, response_content=await db.get_pereval(pereval_id))
+    return JSONResponse(content).body
+
+
+async def before_list(db: AsyncDatabaseManager, email: str, limit: int) -> bytes:
+    content = await serialize_response(field=LIST_FIELD, response_content=await db.get_user_perevals(email, limit))
+    return JSONResponse(content).body
+
+
+async def after_one(db: AsyncDatabaseManager, pereval_id: int) -> bytes:
+    return await db.get_pereval_json(pereval_id)
+
+
+async def after_list(db: AsyncDatabaseManager, email: str, limit: int) -> bytes:
+    return (await db.get_user_perevals_json(email, limit))[0]
+
+
+async def measure(func, rounds: int, *args) -> dict:
+    wall, cpu = [], []
+    for _ in range(rounds):
+        started, started_cpu = time.perf_counter(), time.process_time()
+        body = await func(*args)
+        wall.append((time.perf_counter() - started) * 1000)
+        cpu.append((time.process_time() - started_cpu) * 1000)
+    return {"wall": statistics.median(wall), "cpu": statistics.median(cpu), "bytes": len(body)}
+
+
+async def main(args):
+    pool = create_async_pool()
+    await pool.open()
+    db = AsyncDatabaseManager(pool)
+    if not await db.connect():
+        sys.exit("Нет подключения к БД")
+
+    page = await db.get_user_perevals(args.email, args.limit)
+    if not page:
+        sys.exit(f"У {args.email} нет перевалов")
+    pereval_id = page[0]["id"]
+
+    cases = [
+        ("one before", before_one, (db, pereval_id)),
+        ("one after", after_one, (db, pereval_id)),
+        (f"list({len(page)}) before", before_list, (db, args.email, args.limit)),
+        (f"list({len(page)}) after", after_list, (db, args.email, args.limit)),
+    ]
+    print(f"{'':18}{'wall p50, ms':>14}{'cpu p50, ms':>14}{'bytes':>10}")
+    for name, func, func_args in cases:
+        await measure(func, 5, *func_args)  # прогрев
+        r = await measure(func, args.rounds, *func_args)
+        print(f"{name:18}{r['wall']:>14.2f}{r['cpu']:>14.2f}{r['bytes']:>10}")
+    await db.disconnect()
+    await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--email", default="load-bench-1@example.com")
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,261 @@
+"""
+Нагрузочный тест API: POST/GET/PATCH /submitData и список перевалов пользователя.
+
+Засевает БД пользователями с перевалами и картинками, затем гоняет каждый сценарий через
+приложение из main.py с заданной конкурентностью. Для каждого сценария — req/s, p50/p95/p99
+и число обращений к БД на запрос. Результат сохраняется в benchmarks/results/ и может
+сравниваться с прошлым прогоном.
+
+Запуск (отдельная БД для бенчмарков, данные добавляются в неё):
+    python benchmarks/bench_load.py --users 200 --per-user 50 --requests 2000 --concurrency 50
+    python benchmarks/bench_load.py --users 0 --baseline benchmarks/results/load-....json
+
+--users 0 повторно использует уже засеянные данные.
+--baseline отмечает сценарии, где p95 вырос или req/s упал больше чем на --tolerance процентов.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import psycopg
+
+from async_database import AsyncDatabaseManager, create_async_pool
+from migrations import migrate_database
+from ingest import INGEST_MODE
+import main
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+SCENARIOS = ["post", "get", "patch", "list"]
+EMAIL_PATTERN = "load-bench-%@example.com"
+
+
+def user_email(i: int) -> str:
+    return f"load-bench-{i}@example.com"
+
+
+def make_pereval(rnd: random.Random, email: str, images: int) -> dict:
+    return {
+        "beauty_title": "пер.", "title": f"Нагрузка {rnd.randrange(10 ** 6)}", "other_titles": "", "connect": "",
+        "add_time": "2023-12-07 12:00:00",
+        "user": {"email": email, "fam": "Нагрузка", "name": "Тест", "otc": "", "phone": ""},
+        "coords": {"latitude": rnd.uniform(40, 50), "longitude": rnd.uniform(40, 50), "height": rnd.randint(500, 5000)},
+        "level": {"winter": "2А", "summer": "1Б", "autumn": "1Б", "spring": ""},
+        "images": [{"data": rnd.randbytes(2048).hex(), "title": f"фото {i}"} for i in range(images)],
+    }
+
+
+async def seed(db: AsyncDatabaseManager, users: int, per_user: int, images: int, batch: int = 2000):
+    rnd = random.Random(48)
+    items = [make_pereval(rnd, user_email(u), images) for u in range(users) for _ in range(per_user)]
+    for start in range(0, len(items), batch):
+        await db.add_perevals(items[start:start + batch])
+    await db.cursor.execute("ANALYZE users; ANALYZE pereval_added; ANALYZE images; ANALYZE coords")
+    await db.connection.commit()
+
+
+# засеянные перевалы (id и email) — цели для GET, PATCH и списка
+async def seeded(db: AsyncDatabaseManager):
+    await db.cursor.execute(
+        """
+        SELECT p.id, u.email FROM pereval_added p JOIN users u ON u.id = p.user_id
+        WHERE u.email LIKE %s AND p.status = 'new'
+        """,
+        (EMAIL_PATTERN,)
+    )
+    rows = await db.cursor.fetchall()
+    await db.connection.commit()
+    return [r[0] for r in rows], sorted({r[1] for r in rows})
+
+
+class RoundTrips:
+    """Счётчик обращений к БД: запросы курсоров и commit/rollback соединений psycopg 3"""
+
+    def __init__(self):
+        self.count = 0
+
+    def install(self):
+        counter = self
+
+        def counted(cls, name):
+            original = getattr(cls, name)
+
+            async def wrapper(self, *args, **kwargs):
+                counter.count += 1
+                return await original(self, *args, **kwargs)
+
+            setattr(cls, name, wrapper)
+
+        for name in ("execute", "executemany"):
+            counted(psycopg.AsyncCursor, name)
+        for name in ("commit", "rollback"):
+            counted(psycopg.AsyncConnection, name)
+
+
+def percentile(sorted_values, p: float) -> float:
+    index = max(int(round(p / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def make_request(scenario: str, rnd: random.Random, ids, emails, images: int):
+    if scenario == "post":
+        return "POST", "/submitData", {"json": make_pereval(rnd, rnd.choice(emails), images)}
+    if scenario == "get":
+        return "GET", f"/submitData/{rnd.choice(ids)}", {}
+    if scenario == "patch":
+        return "PATCH", f"/submitData/{rnd.choice(ids)}", {"json": {"connect": f"правка {rnd.randrange(10 ** 6)}"}}
+    return "GET", "/submitData/", {"params": {"user__email": rnd.choice(emails), "limit": 20}}
+
+
+async def run_scenario(client, scenario: str, requests: int, concurrency: int, round_trips: RoundTrips,
+                       ids, emails, images: int) -> dict:
+    rnd = random.Random(scenario)
+    planned = [make_request(scenario, rnd, ids, emails, images) for _ in range(requests)]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(method, url, kwargs):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400 or (scenario == "post" and response.json().get("status") not in (200, 202)):
+                errors += 1
+
+    round_trips.count = 0
+    started = time.perf_counter()
+    await asyncio.gather(*(one(*r) for r in planned))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "db_round_trips": round(round_trips.count / requests, 2),
+    }
+
+
+async def drive(args, ids, emails) -> dict:
+    round_trips = RoundTrips()
+    round_trips.install()
+
+    results = {}
+    # ASGITransport не запускает lifespan — пул, кэш и воркеры отложенной записи поднимаем сами
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            # прогрев: соединения пула и кэш планов
+            for scenario in ("get", "list"):
+                await run_scenario(client, scenario, min(args.concurrency, 50), args.concurrency,
+                                   round_trips, ids, emails, args.images)
+            for scenario in args.scenarios:
+                results[scenario] = await run_scenario(client, scenario, args.requests, args.concurrency,
+                                                       round_trips, ids, emails, args.images)
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# сценарии, которые заметно хуже базового прогона
+def regressions(results: dict, baseline: dict, tolerance: float):
+    found = []
+    for scenario, r in results.items():
+        base = baseline.get("results", {}).get(scenario)
+        if not base:
+            continue
+        if r["p95_ms"] > base["p95_ms"] * (1 + tolerance / 100):
+            found.append(f"{scenario}: p95 {base['p95_ms']} -> {r['p95_ms']} ms")
+        if r["rps"] < base["rps"] * (1 - tolerance / 100):
+            found.append(f"{scenario}: req/s {base['rps']} -> {r['rps']}")
+        # доля попаданий в кэш немного плавает, поэтому лишний запрос к БД — это +0.5 в среднем
+        if r["db_round_trips"] > base["db_round_trips"] + 0.5:
+            found.append(f"{scenario}: обращений к БД {base['db_round_trips']} -> {r['db_round_trips']}")
+    return found
+
+
+async def prepare(args):
+    pool = create_async_pool()
+    await pool.open()
+    db = AsyncDatabaseManager(pool)
+    try:
+        if not await db.connect():
+            sys.exit("Нет подключения к БД")
+        if args.users:
+            await seed(db, args.users, args.per_user, args.images)
+        return await seeded(db)
+    finally:
+        await db.disconnect()
+        await pool.close()
+
+
+def main_cli(args):
+    migrate_database()
+    ids, emails = asyncio.run(prepare(args))
+    if not ids:
+        sys.exit("Нет засеянных данных: запустите с --users")
+
+    results = asyncio.run(drive(args, ids, emails))
+
+    report = {
+        "revision": git_revision(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "params": {"requests": args.requests, "concurrency": args.concurrency, "images": args.images,
+                   "ingest_mode": INGEST_MODE,
+                   "perevals": len(ids), "users": len(emails)},
+        "results": results,
+    }
+
+    print(f"perevals={len(ids)} users={len(emails)} requests={args.requests} concurrency={args.concurrency} "
+          f"ingest={INGEST_MODE}")
+    print(f"{'':8}{'req/s':>10}{'p50, ms':>10}{'p95, ms':>10}{'p99, ms':>10}{'db/req':>8}{'errors':>8}")
+    for scenario, r in results.items():
+        print(f"{scenario:8}{r['rps']:>10.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+              f"{r['db_round_trips']:>8.1f}{r['errors']:>8}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = args.output or os.path.join(
+        RESULTS_DIR, f"load-{datetime.now():%Y%m%d-%H%M%S}-{report['revision']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результат: {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f"Регрессия: {line}")
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="сколько пользователей засеять (0 - не засевать)")
+    parser.add_argument("--per-user", type=int, default=50, help="перевалов на пользователя")
+    parser.add_argument("--images", type=int, default=2, help="картинок на перевал")
+    parser.add_argument("--requests", type=int, default=2000, help="запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--output", help="файл результата (по умолчанию benchmarks/results/load-*.json)")
+    parser.add_argument("--baseline", help="прошлый результат для сравнения")
+    parser.add_argument("--tolerance", type=float, default=20.0, help="допустимое ухудшение, %%")
+    sys.exit(main_cli(parser.parse_args()))
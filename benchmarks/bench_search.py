@@ -0,0 +1,118 @@
+"""
+Поиск перевалов по названиям на большом каталоге.
+
+Запуск (отдельная БД для бенчмарков, данные добавляются в неё):
+    python benchmarks/bench_search.py --seed 300000 --queries 100
+
+--seed 0 повторно использует уже засеянные данные.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_database import AsyncDatabaseManager, create_async_pool
+from migrations import migrate_database
+
+SYLLABLES = ["ка", "ра", "ту", "чим", "тар", "га", "бе", "лу", "ха", "ор", "ду", "ши", "мал", "кёль", "ак", "су",
+             "ел", "бас", "тау", "джан", "ке", "зар", "ном", "пхи", "я", "ой", "ун", "гор", "ыр", "ан"]
+DESCRIPTIONS = ["северный", "южный", "восточный", "западный", "седловина", "ледник", "гребень", "кулуар"]
+
+
+def make_name(rnd: random.Random) -> str:
+    return "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))).capitalize()
+
+
+async def seed(db: AsyncDatabaseManager, count: int, batch: int = 5000):
+    rnd = random.Random(48)
+    names = [make_name(rnd) for _ in range(max(count // 5, 1))]
+    base = {
+        "beauty_title": "пер.", "connect": "", "add_time": None,
+        "coords": {"latitude": 43.3, "longitude": 42.5, "height": 3000},
+        "level": {"winter": "", "summer": "1А", "autumn": "", "spring": ""}, "images": [],
+    }
+    for start in range(0, count, batch):
+        items = []
+        for i in range(start, min(start + batch, count)):
+            items.append(dict(
+                base,
+                title=f"{rnd.choice(names)} {rnd.choice(DESCRIPTIONS)}",
+                other_titles=rnd.choice(names),
+                user={"email": f"search-bench-{i % 1000}@example.com", "fam": "", "name": "", "otc": "", "phone": ""},
+            ))
+        await db.add_perevals(items)
+    await db.cursor.execute("ANALYZE pereval_added; ANALYZE search_words; ANALYZE search_word_trigrams")
+    await db.connection.commit()
+    return names
+
+
+# опечатка: пропущенная или переставленная буква
+def misspell(word: str, rnd: random.Random) -> str:
+    i = rnd.randrange(1, len(word) - 1)
+    if rnd.random() < 0.5:
+        return word[:i] + word[i + 1:]
+    return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+
+
+async def measure(db: AsyncDatabaseManager, queries) -> dict:
+    latencies, found = [], 0
+    for q in queries:
+        started = time.perf_counter()
+        found += len(await db.search_perevals(q, limit=20))
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "avg_found": found / len(queries),
+    }
+
+
+async def main(args):
+    migrate_database()
+    pool = create_async_pool()
+    await pool.open()
+    db = AsyncDatabaseManager(pool)
+    if not await db.connect():
+        sys.exit("Нет подключения к БД")
+
+    if args.seed:
+        started = time.perf_counter()
+        await seed(db, args.seed)
+        print(f"засеяно {args.seed} перевалов за {time.perf_counter() - started:.1f} с")
+
+    await db.cursor.execute("SELECT count(*) FROM pereval_added")
+    total = (await db.cursor.fetchone())[0]
+    await db.cursor.execute("SELECT word FROM search_words WHERE length(word) >= 6 ORDER BY word")
+    words = [r[0] for r in await db.cursor.fetchall()]
+    await db.connection.rollback()
+
+    rnd = random.Random(7)
+    sample = [rnd.choice(words) for _ in range(args.queries)]
+    cases = [
+        ("точное слово", sample),
+        ("префикс", [w[:4] for w in sample]),
+        ("опечатка", [misspell(w, rnd) for w in sample]),
+        ("два слова", [f"{w} {rnd.choice(DESCRIPTIONS)}" for w in sample]),
+    ]
+
+    print(f"pereval_added={total} словарь={len(words)}+ queries={args.queries} limit=20")
+    print(f"{'':14}{'p50, ms':>10}{'p95, ms':>10}{'найдено':>10}")
+    for name, queries in cases:
+        r = await measure(db, queries)
+        print(f"{name:14}{r['p50']:>10.2f}{r['p95']:>10.2f}{r['avg_found']:>10.1f}")
+
+    await db.disconnect()
+    await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=300000)
+    parser.add_argument("--queries", type=int, default=100)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,78 @@
+"""
+Сводная статистика GET /stats: подсчёт по всей таблице pereval_added (как считали для дашбордов раньше)
+против счётчиков stats_counters/user_stats, которые обновляются триггерами при каждой записи.
+
+Запуск (нужна БД из .env с перевалами, например после bench_search.py --seed 300000):
+    python benchmarks/bench_stats.py --rounds 200
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_database import AsyncDatabaseManager, create_async_pool
+
+FULL_SCAN_SQL = """
+    SELECT
+        (SELECT json_object_agg(status, n) FROM (SELECT status, count(*) AS n FROM pereval_added GROUP BY status) s),
+        (SELECT json_agg(s) FROM (
+            SELECT level_winter, level_summer, level_autumn, level_spring, count(*) FROM pereval_added
+            GROUP BY GROUPING SETS ((level_winter), (level_summer), (level_autumn), (level_spring))
+        ) s),
+        (SELECT json_agg(s) FROM (
+            SELECT add_time::date, count(*) FROM pereval_added
+            WHERE add_time >= current_date - 30 GROUP BY add_time::date
+        ) s),
+        (SELECT json_agg(s) FROM (
+            SELECT u.email, count(*) AS n FROM pereval_added p JOIN users u ON u.id = p.user_id
+            GROUP BY u.email ORDER BY n DESC LIMIT 10
+        ) s)
+"""
+
+
+async def full_scan(db: AsyncDatabaseManager):
+    await db.cursor.execute(FULL_SCAN_SQL)
+    await db.cursor.fetchone()
+    await db.connection.rollback()
+
+
+async def counters(db: AsyncDatabaseManager):
+    await db.get_stats_json(days=30, top=10)
+
+
+async def measure(func, rounds: int, db: AsyncDatabaseManager) -> float:
+    wall = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        await func(db)
+        wall.append((time.perf_counter() - started) * 1000)
+    return statistics.median(wall)
+
+
+async def main(args):
+    pool = create_async_pool()
+    await pool.open()
+    db = AsyncDatabaseManager(pool)
+    if not await db.connect():
+        sys.exit("Нет подключения к БД")
+
+    await db.cursor.execute("SELECT count(*) FROM pereval_added")
+    print(f"перевалов: {(await db.cursor.fetchone())[0]}")
+    await db.connection.rollback()
+
+    print(f"{'':14}{'wall p50, ms':>14}")
+    for name, func, rounds in (("full scan", full_scan, max(args.rounds // 20, 3)), ("counters", counters, args.rounds)):
+        await measure(func, 2, db)  # прогрев
+        print(f"{name:14}{await measure(func, rounds, db):>14.2f}")
+    await db.disconnect()
+    await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,199 @@
+"""
+Хранилище содержимого картинок вне БД.
+
+Файлы адресуются SHA-256 содержимого, поэтому одинаковые загрузки хранятся один раз,
+а в таблице images остаются только метаданные и ключ. Производные файлы (уменьшенные копии)
+хранятся под ключом оригинала в отдельном пространстве: derived(name).
+
+Перенос картинок, сохранённых раньше в images.data:
+    python blobstore.py backfill
+"""
+import os
+import sys
+import base64
+import binascii
+import hashlib
+import argparse
+import tempfile
+from typing import BinaryIO, Callable, Iterator, List, Optional
+
+KEY_LENGTH = 64  # sha256 hex
+
+
+class BlobStore:
+    """Интерфейс хранилища: реализации кладут байты и отдают их по ключу"""
+
+    def put(self, data: bytes) -> str:
+        raise NotImplementedError
+
+    # запись под заданным ключом (производные файлы)
+    def put_at(self, key: str, data: bytes):
+        raise NotImplementedError
+
+    # хранилище производных файлов name (например, уменьшенных копий) с ключами оригиналов
+    def derived(self, name: str) -> "BlobStore":
+        raise NotImplementedError
+
+    def open(self, key: str) -> BinaryIO:
+        raise NotImplementedError
+
+    def size(self, key: str) -> Optional[int]:
+        raise NotImplementedError
+
+    # чтение диапазона [start, end] кусками, для отдачи с Range
+    def iter_range(self, key: str, start: int, end: int, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        with self.open(key) as f:
+            f.seek(start)
+            left = end - start + 1
+            while left > 0:
+                chunk = f.read(min(chunk_size, left))
+                if not chunk:
+                    break
+                left -= len(chunk)
+                yield chunk
+
+
+class LocalBlobStore(BlobStore):
+    """Файлы в локальном каталоге: root/ab/cd/abcd..."""
+
+    def __init__(self, root: str):
+        self.root = root
+        # вызываются после записи нового содержимого: listener(key, data)
+        self.listeners: List[Callable[[str, bytes], None]] = []
+
+    # в процессы пула передаётся только каталог
+    def __getstate__(self):
+        return {"root": self.root}
+
+    def __setstate__(self, state):
+        self.__init__(state["root"])
+
+    def _path(self, key: str) -> str:
+        if not is_blob_key(key):
+            raise ValueError(f"Неверный ключ: {key}")
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, data: bytes) -> str:
+        key = hashlib.sha256(data).hexdigest()
+        if os.path.exists(self._path(key)):
+            return key
+
+        self.put_at(key, data)
+        for listener in self.listeners:
+            listener(key, data)
+        return key
+
+    def put_at(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # пишем во временный файл и атомарно переименовываем
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def derived(self, name: str) -> "LocalBlobStore":
+        return LocalBlobStore(os.path.join(self.root, "derived", name))
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self._path(key), "rb")
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self._path(key))
+        except (OSError, ValueError):
+            return None
+
+
+def is_blob_key(key: str) -> bool:
+    return len(key) == KEY_LENGTH and all(c in "0123456789abcdef" for c in key)
+
+
+# Image.data приходит строкой: base64, иначе берём саму строку
+def image_bytes(data: str) -> bytes:
+    try:
+        return base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError):
+        return data.encode("utf-8")
+
+
+# тип содержимого по сигнатуре файла
+def sniff_content_type(head: bytes) -> str:
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+_store: Optional[BlobStore] = None
+
+
+# хранилище по настройкам из .env, одно на процесс
+def get_blob_store() -> BlobStore:
+    global _store
+    if _store is None:
+        backend = os.getenv("FSTR_BLOB_BACKEND", "local")
+        if backend != "local":
+            raise ValueError(f"Неизвестное хранилище картинок: {backend}")
+        _store = LocalBlobStore(os.getenv("FSTR_BLOB_DIR", "blobs"))
+    return _store
+
+
+# перенос images.data в хранилище пачками; возвращает число перенесённых строк
+def backfill(connection, store: BlobStore, batch_size: int = 500) -> int:
+    moved = 0
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute(
+                """
+                SELECT id, data FROM images
+                WHERE blob_key IS NULL AND data IS NOT NULL
+                ORDER BY id LIMIT %s
+                """,
+                (batch_size,)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            for image_id, data in rows:
+                content = image_bytes(data)
+                cursor.execute(
+                    "UPDATE images SET blob_key=%s, size=%s, content_type=%s, data=NULL WHERE id=%s",
+                    (store.put(content), len(content), sniff_content_type(content[:16]), image_id)
+                )
+            connection.commit()
+            moved += len(rows)
+    return moved
+
+
+def main(argv=None):
+    import psycopg2
+    from database import db_params
+
+    parser = argparse.ArgumentParser(description="Хранилище картинок перевалов")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    connection = psycopg2.connect(**db_params())
+    try:
+        moved = backfill(connection, get_blob_store(), args.batch_size)
+    finally:
+        connection.close()
+    print(f"Перенесено картинок: {moved}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+Кэш ответов GET /submitData/{id}.
+
+Два уровня: LRU в памяти процесса (размер и TTL ограничены) и необязательный общий бэкенд
+для нескольких процессов. Общий бэкенд задаётся FSTR_CACHE_SHARED_URL:
+    memory://        — локальная замена общего кэша (разработка, тесты)
+    redis://host/0   — Redis, нужен пакет redis
+Запись сбрасывается при изменении перевала; в других процессах локальная копия живёт не дольше TTL.
+"""
+import os
+import json
+import logging
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger("pereval.cache")
+
+
+class LRUCache:
+    """LRU-словарь с ограничением по числу записей и времени жизни"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class SharedBackend:
+    """Общий для процессов кэш строк с TTL"""
+
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: float):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+
+class MemorySharedBackend(SharedBackend):
+    """Локальная замена общего кэша: тот же интерфейс, данные в памяти"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[float, str]] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        return item[1]
+
+    async def set(self, key: str, value: str, ttl: float):
+        self._data[key] = (time.monotonic() + ttl, value)
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+
+
+class RedisSharedBackend(SharedBackend):
+    def __init__(self, url: str):
+        try:
+            from redis import asyncio as redis
+        except ImportError:
+            raise RuntimeError("Для FSTR_CACHE_SHARED_URL=redis://... нужен пакет redis")
+        self._redis = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self._redis.get(key)
+        return value.decode("utf-8") if value is not None else None
+
+    async def set(self, key: str, value: str, ttl: float):
+        await self._redis.set(key, value, px=int(ttl * 1000))
+
+    async def delete(self, key: str):
+        await self._redis.delete(key)
+
+
+class CachedPereval:
+    """Готовое тело ответа и его ETag"""
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# компактный JSON в UTF-8; orjson, если установлен
+def encode_json(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class PerevalCache:
+    """Read-through кэш перевалов: сначала LRU процесса, затем общий бэкенд"""
+
+    def __init__(self, local: LRUCache, shared: Optional[SharedBackend] = None, shared_ttl: float = 300.0):
+        self.local = local
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+
+    @staticmethod
+    def _key(pereval_id: int) -> str:
+        return f"pereval:{pereval_id}"
+
+    async def get(self, pereval_id: int) -> Optional[CachedPereval]:
+        cached = self.local.get(pereval_id)
+        if cached is not None or self.shared is None:
+            return cached
+
+        try:
+            body = await self.shared.get(self._key(pereval_id))
+        except Exception:
+            logger.exception("Ошибка общего кэша")
+            return None
+        if body is None:
+            return None
+
+        cached = CachedPereval(body.encode("utf-8"))
+        self.local.set(pereval_id, cached)
+        return cached
+
+    async def set(self, pereval_id: int, pereval: Dict[str, Any]) -> CachedPereval:
+        return await self.set_body(pereval_id, encode_json(pereval))
+
+    # запись уже готового JSON (например, собранного в Postgres)
+    async def set_body(self, pereval_id: int, body: bytes) -> CachedPereval:
+        cached = CachedPereval(body)
+        self.local.set(pereval_id, cached)
+        if self.shared is not None:
+            try:
+                await self.shared.set(self._key(pereval_id), cached.body.decode("utf-8"), self.shared_ttl)
+            except Exception:
+                logger.exception("Ошибка общего кэша")
+        return cached
+
+    # сброс после изменения перевала или его статуса
+    async def invalidate(self, pereval_id: int):
+        self.local.delete(pereval_id)
+        if self.shared is not None:
+            try:
+                await self.shared.delete(self._key(pereval_id))
+            except Exception:
+                logger.exception("Ошибка общего кэша")
+
+
+# кэш по настройкам из .env
+def create_pereval_cache() -> PerevalCache:
+    local = LRUCache(
+        max_size=int(os.getenv("FSTR_CACHE_SIZE", "1024")),
+        ttl=float(os.getenv("FSTR_CACHE_TTL", "60")),
+    )
+
+    url = os.getenv("FSTR_CACHE_SHARED_URL", "")
+    if not url:
+        shared = None
+    elif url.startswith("memory://"):
+        shared = MemorySharedBackend()
+    elif url.startswith(("redis://", "rediss://")):
+        shared = RedisSharedBackend(url)
+    else:
+        raise ValueError(f"Неизвестный общий кэш: {url}")
+
+    return PerevalCache(local, shared, shared_ttl=float(os.getenv("FSTR_CACHE_SHARED_TTL", "300")))
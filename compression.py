@@ -0,0 +1,166 @@
+"""
+Сжатие ответов по Accept-Encoding: br (если установлен пакет brotli), иначе gzip.
+
+Сжимаются JSON и текст от FSTR_COMPRESS_MIN байт (по умолчанию 1024); картинки, ответы с Content-Encoding
+и частичные ответы (206) отдаются как есть. Потоковый ответ сжимается по частям: каждая часть
+отправляется сразу, клиент не ждёт конца ответа. JSON и текст всегда получают Vary: Accept-Encoding,
+а ETag сжатого ответа становится слабым (W/"...").
+"""
+import os
+import zlib
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("FSTR_COMPRESS_MIN", "1024"))
+GZIP_LEVEL = int(os.getenv("FSTR_GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("FSTR_BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/geo+json", "text/")
+
+
+# q-значения из Accept-Encoding: {"gzip": 1.0, "br": 0.5}
+def _accepted(header: str) -> Dict[str, float]:
+    accepted = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    return accepted
+
+
+# кодировка ответа: br, затем gzip; None — без сжатия
+def choose_encoding(header: Optional[str]) -> Optional[str]:
+    if not header:
+        return None
+    accepted = _accepted(header)
+    for encoding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class _GzipCompressor:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, more: bool) -> bytes:
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_SYNC_FLUSH if more else zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes, more: bool) -> bytes:
+        out = self._compressor.process(data)
+        return out + (self._compressor.flush() if more else self._compressor.finish())
+
+
+# JSON и текст без своего Content-Encoding: ответ зависит от Accept-Encoding, даже если сжат не будет
+def _negotiated(start: dict) -> bool:
+    content_type = b""
+    for name, value in start.get("headers", ()):
+        if name == b"content-encoding":
+            return False
+        if name == b"content-type":
+            content_type = value
+    return content_type.decode("latin-1").startswith(COMPRESSIBLE_TYPES)
+
+
+def _compressible(start: dict) -> bool:
+    if start["status"] < 200 or start["status"] in (204, 206, 304):
+        return False
+    return _negotiated(start)
+
+
+def _add_vary(headers: list) -> list:
+    for i, (name, value) in enumerate(headers):
+        if name == b"vary":
+            if b"accept-encoding" not in value.lower() and value.strip() != b"*":
+                headers[i] = (name, value + b", Accept-Encoding")
+            return headers
+    headers.append((b"vary", b"Accept-Encoding"))
+    return headers
+
+
+def _set_vary(start: dict) -> dict:
+    return dict(start, headers=_add_vary(list(start.get("headers", ()))))
+
+
+# сжатое тело побайтно отличается от исходного: сильный ETag становится слабым (RFC 9110, 8.8.1)
+def _weak_etag(value: bytes) -> bytes:
+    return value if value.startswith(b"W/") else b"W/" + value
+
+
+def _set_headers(start: dict, encoding: str, length: Optional[int]) -> dict:
+    headers = []
+    for name, value in start.get("headers", ()):
+        if name == b"content-length":
+            continue
+        headers.append((name, _weak_etag(value) if name == b"etag" else value))
+    headers.append((b"content-encoding", encoding.encode("latin-1")))
+    _add_vary(headers)
+    if length is not None:
+        headers.append((b"content-length", str(length).encode("latin-1")))
+    return dict(start, headers=headers)
+
+
+class CompressionMiddleware:
+    """ASGI-middleware: сжатие ответов по Accept-Encoding"""
+
+    def __init__(self, app, min_size: int = COMPRESS_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        encoding = None
+        for name, value in scope.get("headers", ()):
+            if name == b"accept-encoding":
+                encoding = choose_encoding(value.decode("latin-1"))
+                break
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                # заголовки отправляются вместе с первой частью тела, когда ясен её размер
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if compressor is None:
+                if encoding is None or not _compressible(start) or (not more and len(body) < self.min_size):
+                    passthrough = True
+                    await send(_set_vary(start) if _negotiated(start) else start)
+                    return await send(message)
+
+                compressor = _BrotliCompressor() if encoding == "br" else _GzipCompressor()
+                if not more:
+                    data = compressor.compress(body, more=False)
+                    await send(_set_headers(start, encoding, len(data)))
+                    return await send({"type": "http.response.body", "body": data})
+                await send(_set_headers(start, encoding, None))
+
+            await send({"type": "http.response.body", "body": compressor.compress(body, more), "more_body": more})
+
+        await self.app(scope, receive, send_wrapper)
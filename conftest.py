@@ -0,0 +1,14 @@
+import os
+import tempfile
+import pytest
+
+# Всегда используем тестовую БД и временный каталог для картинок
+os.environ["FSTR_DB_NAME"] = "pereval_test"
+os.environ["FSTR_BLOB_DIR"] = tempfile.mkdtemp(prefix="pereval-blobs-")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def migrated_database():
+    """Схема тестовой БД создаётся миграциями один раз на сессию"""
+    from migrations import migrate_database
+    migrate_database()
@@ -1,302 +1,1209 @@
 import os
+import re
+import json
+import base64
+import logging
+import math
+from functools import lru_cache
 import psycopg2
-from typing import Optional, Dict, Any, List
+from datetime import date, datetime
+from typing import BinaryIO, Optional, Dict, Any, List, Tuple
 from dotenv import load_dotenv
+from blobstore import BlobStore, get_blob_store, image_bytes, sniff_content_type
+from metrics import instrument_db
+from logs import SlowQueryCursor
+from cache import LRUCache
 load_dotenv()
 
+logger = logging.getLogger("pereval.db")
 
 
+# параметры подключения читаем из .env
+def db_params() -> Dict[str, Any]:
+    return {
+        "host": os.getenv("FSTR_DB_HOST", "localhost"),
+        "port": os.getenv("FSTR_DB_PORT", "5432"),
+        "user": os.getenv("FSTR_DB_LOGIN", "postgres"),
+        "password": os.getenv("FSTR_DB_PASS", ""),
+        "dbname": os.getenv("FSTR_DB_NAME", "pereval_db"),
+    }
+
+
+# реплики для чтения: FSTR_DB_REPLICA_HOSTS — host или host:port через запятую, остальное — как у основной БД
+def replica_params() -> List[Dict[str, Any]]:
+    replicas = []
+    for item in os.getenv("FSTR_DB_REPLICA_HOSTS", "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, sep, port = item.rpartition(":")
+        if not sep:
+            host, port = item, os.getenv("FSTR_DB_PORT", "5432")
+        replicas.append(dict(db_params(), host=host, port=port))
+    return replicas
+
+
+# SQL общий для синхронного и асинхронного менеджеров (psycopg2 и psycopg 3 используют %s)
+# перевал одним запросом: пользователь, координаты, перевал и все картинки.
+# Пользователь — по id из кэша USER_IDS, иначе по email; новый создаётся в том же запросе (ON CONFLICT:
+# пользователь, созданный параллельным запросом, не ошибка, его данные не меняются). Ошибка на любом
+# шаге откатывает всё, пользователь без перевала не остаётся. Колонки: id перевала, id пользователя.
+ADD_PEREVAL_SQL = """
+    WITH known_user AS (
+        SELECT %(user_id)s::int AS id WHERE %(user_id)s::int IS NOT NULL
+        UNION ALL
+        SELECT id FROM users WHERE %(user_id)s::int IS NULL AND email = %(email)s
+    ),
+    new_user AS (
+        INSERT INTO users (email, fam, name, otc, phone)
+        SELECT %(email)s, %(fam)s, %(name)s, %(otc)s, %(phone)s
+        WHERE NOT EXISTS (SELECT 1 FROM known_user)
+        ON CONFLICT (email) DO UPDATE SET email = EXCLUDED.email
+        RETURNING id
+    ),
+    coords_inserted AS (
+        INSERT INTO coords (latitude, longitude, height)
+        VALUES (%(latitude)s, %(longitude)s, %(height)s)
+        RETURNING id
+    ),
+    inserted AS (
+        INSERT INTO pereval_added (
+            beauty_title, title, other_titles, connect, add_time,
+            user_id, coord_id,
+            level_winter, level_summer, level_autumn, level_spring
+        )
+        SELECT
+            %(beauty_title)s, %(title)s, %(other_titles)s, %(connect)s, %(add_time)s::timestamp,
+            u.id, c.id,
+            %(level_winter)s, %(level_summer)s, %(level_autumn)s, %(level_spring)s
+        FROM (SELECT id FROM known_user UNION ALL SELECT id FROM new_user) u, coords_inserted c
+        RETURNING id, user_id
+    ),
+    images_inserted AS (
+        INSERT INTO images (pereval_id, title, blob_key, size, content_type)
+        SELECT p.id, x.title, x.blob_key, x.size, x.content_type
+        FROM inserted p,
+             unnest(%(image_titles)s::text[], %(image_keys)s::text[], %(image_sizes)s::int[],
+                    %(image_types)s::text[]) WITH ORDINALITY AS x(title, blob_key, size, content_type, n)
+        ORDER BY x.n
+    )
+    SELECT id, user_id FROM inserted
+"""
+
+# email -> id пользователя: повторные отправки не ищут пользователя по email.
+# Пользователи не удаляются, поэтому id не устаревает; запись попадает сюда только после фиксации транзакции
+USER_IDS = LRUCache(
+    max_size=int(os.getenv("FSTR_USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("FSTR_USER_CACHE_TTL", "3600")),
+)
+
+SELECT_PEREVAL_SQL = """
+    SELECT
+        p.id, p.beauty_title, p.title, p.other_titles, p.connect,
+        p.add_time,
+        p.level_winter, p.level_summer, p.level_autumn, p.level_spring,
+        p.status,
+        u.email, u.fam, u.name, u.otc, u.phone,
+        c.latitude, c.longitude, c.height,
+        p.version, to_json(p.updated_at) #>> '{}'
+    FROM pereval_added p
+    JOIN users u ON p.user_id = u.id
+    JOIN coords c ON p.coord_id = c.id
+    WHERE p.id = %s
+"""
+
+SELECT_IMAGES_SQL = "SELECT id, title, blob_key, size, content_type FROM images WHERE pereval_id=%s ORDER BY id"
+
+# PATCH одним оператором: условие status='new' (и версия, если передана) проверяется
+# в самом UPDATE, координаты и картинки меняются в тех же CTE только при его успехе.
+# Возвращает текущие статус и версию (NULL — перевала нет) и новую версию (NULL — отказ).
+UPDATE_PEREVAL_SQL = """
+    WITH updated AS (
+        UPDATE pereval_added p SET
+            beauty_title = CASE WHEN %(set_beauty_title)s THEN %(beauty_title)s ELSE p.beauty_title END,
+            title = CASE WHEN %(set_title)s THEN %(title)s ELSE p.title END,
+            other_titles = CASE WHEN %(set_other_titles)s THEN %(other_titles)s ELSE p.other_titles END,
+            connect = CASE WHEN %(set_connect)s THEN %(connect)s ELSE p.connect END,
+            add_time = CASE WHEN %(set_add_time)s THEN %(add_time)s::timestamp ELSE p.add_time END,
+            level_winter = CASE WHEN %(set_level_winter)s THEN %(level_winter)s ELSE p.level_winter END,
+            level_summer = CASE WHEN %(set_level_summer)s THEN %(level_summer)s ELSE p.level_summer END,
+            level_autumn = CASE WHEN %(set_level_autumn)s THEN %(level_autumn)s ELSE p.level_autumn END,
+            level_spring = CASE WHEN %(set_level_spring)s THEN %(level_spring)s ELSE p.level_spring END,
+            version = p.version + 1,
+            updated_at = now(),
+            change_xid = pg_current_xact_id()
+        WHERE p.id = %(id)s
+          AND p.status = 'new'
+          AND (%(version)s::int IS NULL OR p.version = %(version)s::int)
+        RETURNING p.id, p.coord_id, p.version
+    ),
+    coords_updated AS (
+        UPDATE coords c
+        SET latitude = %(latitude)s, longitude = %(longitude)s, height = %(height)s, updated_at = now()
+        FROM updated u
+        WHERE c.id = u.coord_id AND %(set_coords)s
+    ),
+    images_deleted AS (
+        DELETE FROM images i
+        USING updated u
+        WHERE i.pereval_id = u.id AND %(set_images)s
+    ),
+    images_inserted AS (
+        INSERT INTO images (pereval_id, title, blob_key, size, content_type)
+        SELECT u.id, x.title, x.blob_key, x.size, x.content_type
+        FROM updated u,
+             unnest(%(image_titles)s::text[], %(image_keys)s::text[], %(image_sizes)s::int[],
+                    %(image_types)s::text[]) AS x(title, blob_key, size, content_type)
+        WHERE %(set_images)s
+    )
+    SELECT cur.status, cur.version, u.version
+    FROM (SELECT %(id)s::int AS id) k
+    LEFT JOIN pereval_added cur ON cur.id = k.id
+    LEFT JOIN updated u ON u.id = k.id
+"""
+
+# перевалы пользователя одним запросом: картинки агрегируются в JSON,
+# страницы по ключу (id > курсора), индекс pereval_added (user_id, id)
+SELECT_USER_PEREVALS_SQL = """
+    SELECT
+        p.id, p.beauty_title, p.title, p.other_titles, p.connect,
+        p.add_time,
+        p.level_winter, p.level_summer, p.level_autumn, p.level_spring,
+        p.status,
+        u.email, u.fam, u.name, u.otc, u.phone,
+        c.latitude, c.longitude, c.height,
+        p.version, to_json(p.updated_at) #>> '{}',
+        COALESCE(
+            (SELECT json_agg(json_build_array(i.id, i.title, i.blob_key, i.size, i.content_type) ORDER BY i.id)
+             FROM images i WHERE i.pereval_id = p.id),
+            '[]'
+        )
+    FROM users u
+    JOIN pereval_added p ON p.user_id = u.id
+    JOIN coords c ON p.coord_id = c.id
+    WHERE u.email = %s AND p.id > %s
+    ORDER BY p.id
+    LIMIT %s
+"""
+
+# поля документа перевала на стороне Postgres — в том же виде, что pereval_from_row.
+# Параметр fields= в GET выбирает часть из них: в SQL попадают только нужные выражения,
+# а соединения с users и coords и подзапрос картинок — только если нужны их поля
+PEREVAL_DOC_FIELDS = {
+    "id": "p.id",
+    "beauty_title": "p.beauty_title",
+    "title": "p.title",
+    "other_titles": "p.other_titles",
+    "connect": "p.connect",
+    "add_time": "p.add_time",
+    "level": """json_build_object(
+            'winter', p.level_winter, 'summer', p.level_summer,
+            'autumn', p.level_autumn, 'spring', p.level_spring
+        )""",
+    "status": "p.status",
+    "user": "json_build_object('email', u.email, 'fam', u.fam, 'name', u.name, 'otc', u.otc, 'phone', u.phone)",
+    "coords": "json_build_object('latitude', c.latitude, 'longitude', c.longitude, 'height', c.height)",
+    "version": "p.version",
+    "updated_at": "p.updated_at",
+    "images": """COALESCE(
+            (SELECT json_agg(json_build_object(
+                        'id', i.id, 'title', i.title, 'url', '/images/' || i.blob_key,
+                        'size', i.size, 'content_type', i.content_type
+                    ) ORDER BY i.id)
+             FROM images i WHERE i.pereval_id = p.id),
+            '[]'
+        )""",
+}
+PEREVAL_FIELDS = tuple(PEREVAL_DOC_FIELDS)
+
+
+def pereval_doc_sql(fields: Tuple[str, ...] = PEREVAL_FIELDS) -> str:
+    pairs = ",\n        ".join(f"'{name}', {PEREVAL_DOC_FIELDS[name]}" for name in fields)
+    return f"json_build_object(\n        {pairs}\n    )"
+
+
+# соединения для полей fields; users в списке пользователя нужен всегда — по нему фильтр
+def _doc_joins(fields: Tuple[str, ...], users: bool = False, indent: str = "    ") -> str:
+    joins = []
+    if users or "user" in fields:
+        joins.append("JOIN users u ON p.user_id = u.id")
+    if "coords" in fields:
+        joins.append("JOIN coords c ON p.coord_id = c.id")
+    return ("\n" + indent).join(joins)
+
+
+# разбор fields=title,coords: поля в порядке документа, id — всегда; None — все поля
+def parse_fields(value: Optional[str]) -> Tuple[str, ...]:
+    if not value:
+        return PEREVAL_FIELDS
+    requested = {name.strip() for name in value.split(",") if name.strip()}
+    unknown = requested - set(PEREVAL_DOC_FIELDS)
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(sorted(unknown))}")
+    return tuple(name for name in PEREVAL_FIELDS if name in requested or name == "id")
+
+
+PEREVAL_DOC_SQL = pereval_doc_sql()
+
+
+@lru_cache(maxsize=256)
+def select_pereval_json_sql(fields: Tuple[str, ...] = PEREVAL_FIELDS) -> str:
+    return f"""
+    SELECT {pereval_doc_sql(fields)}::text
+    FROM pereval_added p
+    {_doc_joins(fields)}
+    WHERE p.id = %s
+"""
+
+
+# страница списка одним JSON-массивом; вторая колонка — id последнего перевала, если есть следующая страница
+@lru_cache(maxsize=256)
+def select_user_perevals_json_sql(fields: Tuple[str, ...] = PEREVAL_FIELDS) -> str:
+    return f"""
+    WITH page AS (
+        SELECT p.id, row_number() OVER (ORDER BY p.id) AS n, {pereval_doc_sql(fields)} AS doc
+        FROM pereval_added p
+        {_doc_joins(fields, users=True, indent=" " * 8)}
+        WHERE u.email = %(email)s AND p.id > %(after_id)s
+        ORDER BY p.id
+        LIMIT %(limit)s + 1
+    )
+    SELECT
+        COALESCE(json_agg(doc ORDER BY id) FILTER (WHERE n <= %(limit)s), '[]')::text,
+        CASE WHEN count(*) > %(limit)s THEN max(id) FILTER (WHERE n <= %(limit)s) END
+    FROM page
+"""
+
+
+# изменения перевалов пользователя после курсора (change_xid, id): новые, изменённые (в том числе статус)
+# и удалённые (pereval_tombstones) одним потоком. Отдаются только изменения транзакций старше
+# pg_snapshot_xmin — все они уже зафиксированы, поэтому транзакция, начатая раньше, но зафиксированная
+# позже, не окажется за курсором. Колонки: документы, id удалённых, ключ последнего изменения на
+# странице, есть ли ещё изменения, граница xmin.
+SELECT_CHANGES_SQL = f"""
+    WITH owner AS (
+        SELECT id FROM users WHERE email = %(email)s
+    ),
+    horizon AS (
+        SELECT pg_snapshot_xmin(pg_current_snapshot()) AS xid
+    ),
+    changes AS (
+        SELECT change_xid, id, deleted, row_number() OVER (ORDER BY change_xid, id) AS n
+        FROM (
+            (SELECT p.change_xid, p.id, false AS deleted
+             FROM owner o, horizon h, pereval_added p
+             WHERE p.user_id = o.id AND p.change_xid < h.xid
+               AND (p.change_xid, p.id) > (%(after_xid)s::text::xid8, %(after_id)s)
+             ORDER BY p.change_xid, p.id
+             LIMIT %(limit)s + 1)
+            UNION ALL
+            (SELECT t.change_xid, t.pereval_id, true
+             FROM owner o, horizon h, pereval_tombstones t
+             WHERE t.user_id = o.id AND t.change_xid < h.xid
+               AND (t.change_xid, t.pereval_id) > (%(after_xid)s::text::xid8, %(after_id)s)
+             ORDER BY t.change_xid, t.pereval_id
+             LIMIT %(limit)s + 1)
+        ) both_kinds
+        ORDER BY change_xid, id
+        LIMIT %(limit)s + 1
+    )
+    SELECT
+        COALESCE(json_agg({PEREVAL_DOC_SQL} ORDER BY k.n)
+                 FILTER (WHERE NOT k.deleted AND k.n <= %(limit)s), '[]')::text,
+        COALESCE(array_agg(k.id ORDER BY k.n) FILTER (WHERE k.deleted AND k.n <= %(limit)s), '{{}}'),
+        (array_agg(k.change_xid::text ORDER BY k.n DESC) FILTER (WHERE k.n <= %(limit)s))[1],
+        (array_agg(k.id ORDER BY k.n DESC) FILTER (WHERE k.n <= %(limit)s))[1],
+        count(*) > %(limit)s,
+        (SELECT xid FROM horizon)::text
+    FROM changes k
+    LEFT JOIN pereval_added p ON p.id = k.id AND NOT k.deleted
+    LEFT JOIN users u ON u.id = p.user_id
+    LEFT JOIN coords c ON c.id = p.coord_id
+"""
+
+
+def changes_params(email: str, after: Tuple[int, int], limit: int) -> Dict[str, Any]:
+    return {"email": email, "after_xid": str(after[0]), "after_id": after[1], "limit": limit}
+
+
+# итог SELECT_CHANGES_SQL: (документы JSON, id удалённых, курсор следующего запроса, есть ли ещё изменения).
+# На последней странице курсор — граница xmin: всё, что младше, клиент получит в следующий раз
+def changes_result(row: tuple, after: Tuple[int, int]) -> Tuple[bytes, List[int], Tuple[int, int], bool]:
+    docs, deleted, last_xid, last_id, more, horizon = row
+    if more:
+        cursor = (int(last_xid), last_id)
+    else:
+        cursor = max(after, (int(horizon), 0))
+    return docs.encode("utf-8"), list(deleted), cursor, more
+
+
+MODERATION_STATUSES = ("accepted", "rejected", "new")
+MODERATION_CLAIM_TTL = float(os.getenv("FSTR_MODERATION_CLAIM_TTL", "1800"))
+
+# взять до limit перевалов: сначала брошенные (взяты дольше claim_ttl назад), затем новые по id.
+# SKIP LOCKED: строки, которые в этот момент берёт другой модератор, пропускаются без ожидания
+CLAIM_PEREVALS_SQL = f"""
+    WITH expired AS (
+        SELECT id FROM pereval_added
+        WHERE status = 'pending' AND claimed_at < now() - make_interval(secs => %(claim_ttl)s)
+        ORDER BY claimed_at
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    fresh AS (
+        SELECT id FROM pereval_added
+        WHERE status = 'new'
+        ORDER BY id
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    picked AS (
+        SELECT id FROM (SELECT id FROM expired UNION ALL SELECT id FROM fresh) ids LIMIT %(limit)s
+    ),
+    claimed AS (
+        UPDATE pereval_added p
+        SET status = 'pending', claimed_by = %(moderator)s, claimed_at = now(), version = p.version + 1,
+            updated_at = now(), change_xid = pg_current_xact_id()
+        FROM picked
+        WHERE p.id = picked.id
+        RETURNING p.*
+    )
+    SELECT COALESCE(json_agg({PEREVAL_DOC_SQL} ORDER BY p.id), '[]')::text, COALESCE(array_agg(p.id), '{{}}')
+    FROM claimed p
+    JOIN users u ON p.user_id = u.id
+    JOIN coords c ON p.coord_id = c.id
+"""
+
+# решение по взятым перевалам одним оператором; чужие и уже обработанные не меняются
+SET_STATUS_SQL = """
+    UPDATE pereval_added
+    SET status = %(status)s, claimed_by = NULL, claimed_at = NULL, version = version + 1,
+        updated_at = now(), change_xid = pg_current_xact_id()
+    WHERE id = ANY(%(ids)s::int[]) AND status = 'pending' AND claimed_by = %(moderator)s
+    RETURNING id
+"""
+
+# очередь модерации (новые перевалы) по id; та же схема курсора, что у списка пользователя
+SELECT_QUEUE_JSON_SQL = f"""
+    WITH page AS (
+        SELECT p.id, row_number() OVER (ORDER BY p.id) AS n, {PEREVAL_DOC_SQL} AS doc
+        FROM pereval_added p
+        JOIN users u ON p.user_id = u.id
+        JOIN coords c ON p.coord_id = c.id
+        WHERE p.status = 'new' AND p.id > %(after_id)s
+        ORDER BY p.id
+        LIMIT %(limit)s + 1
+    )
+    SELECT
+        COALESCE(json_agg(doc ORDER BY id) FILTER (WHERE n <= %(limit)s), '[]')::text,
+        CASE WHEN count(*) > %(limit)s THEN max(id) FILTER (WHERE n <= %(limit)s) END
+    FROM page
+"""
+
+# сводная статистика из счётчиков (миграция 12): число строк зависит от числа статусов, уровней и дней,
+# а не от числа перевалов. Части одного счётчика (shard) суммируются; дни — за последние days дней
+STATS_SEASONS = ("winter", "summer", "autumn", "spring")
+
+SELECT_STATS_JSON_SQL = f"""
+    WITH counters AS (
+        SELECT metric, key, sum(n) AS n
+        FROM stats_counters
+        WHERE metric IN ('status', {", ".join(f"'level_{season}'" for season in STATS_SEASONS)})
+           OR (metric = 'day' AND key >= (current_date - %(days)s::int + 1)::text)
+        GROUP BY metric, key
+        HAVING sum(n) > 0
+    ),
+    top AS (
+        SELECT user_id, perevals FROM user_stats
+        WHERE perevals > 0
+        ORDER BY perevals DESC, user_id
+        LIMIT %(top)s
+    )
+    SELECT json_build_object(
+        'by_status', (SELECT COALESCE(json_object_agg(key, n ORDER BY key), '{{}}') FROM counters
+                      WHERE metric = 'status'),
+        'by_level', json_build_object({", ".join(
+            f"'{season}', (SELECT COALESCE(json_object_agg(key, n ORDER BY key), '{{}}') FROM counters "
+            f"WHERE metric = 'level_{season}')" for season in STATS_SEASONS)}),
+        'per_day', (SELECT COALESCE(json_agg(json_build_object('day', key, 'count', n) ORDER BY key), '[]')
+                    FROM counters WHERE metric = 'day'),
+        'top_contributors', (
+            SELECT COALESCE(json_agg(json_build_object(
+                'email', u.email, 'fam', u.fam, 'name', u.name, 'perevals', t.perevals
+            ) ORDER BY t.perevals DESC, t.user_id), '[]')
+            FROM top t JOIN users u ON u.id = t.user_id
+        )
+    )::text
+"""
+
+# выгрузка каталога (GET /export, python export.py): перевалы по возрастанию id с фильтром по статусу и дате
+# add_time. JSON-форматы читаются курсором на стороне сервера пачками по EXPORT_BATCH строк, CSV отдаёт COPY —
+# память не зависит от размера каталога
+EXPORT_FORMATS = ("ndjson", "csv", "geojson")
+EXPORT_STATUSES = ("new", "pending", "accepted", "rejected")
+# картинки: ссылки (url), без картинок или содержимое в base64 (только JSON-форматы)
+EXPORT_IMAGES = ("refs", "none", "inline")
+EXPORT_BATCH = int(os.getenv("FSTR_EXPORT_BATCH", "1000"))
+# части потока CSV собираются до этого размера
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+EXPORT_WHERE = """
+    WHERE (%(status)s::text IS NULL OR p.status = %(status)s::text)
+      AND (%(since)s::date IS NULL OR p.add_time >= %(since)s::date)
+      AND (%(until)s::date IS NULL OR p.add_time < %(until)s::date + 1)
+    ORDER BY p.id"""
+
+# колонки CSV по полям документа: вложенные объекты разворачиваются, картинки — ссылки через пробел
+EXPORT_CSV_COLUMNS = {
+    **{name: [(name, expr)] for name, expr in PEREVAL_DOC_FIELDS.items()},
+    "level": [(f"level_{season}", f"p.level_{season}") for season in STATS_SEASONS],
+    "user": [(f"user_{key}", f"u.{key}") for key in ("email", "fam", "name", "otc", "phone")],
+    "coords": [(key, f"c.{key}") for key in ("latitude", "longitude", "height")],
+    "images": [("images", "(SELECT string_agg('/images/' || i.blob_key, ' ' ORDER BY i.id) "
+                          "FROM images i WHERE i.pereval_id = p.id)")],
+}
+
+GEOJSON_HEAD = '{"type": "FeatureCollection", "features": [\n'
+
+
+@lru_cache(maxsize=256)
+def select_export_sql(fmt: str, fields: Tuple[str, ...] = PEREVAL_FIELDS) -> str:
+    if fmt == "csv":
+        columns = ", ".join(f'{expr} AS "{column}"' for name in fields for column, expr in EXPORT_CSV_COLUMNS[name])
+        return f"""
+    COPY (
+        SELECT {columns}
+        FROM pereval_added p
+        {_doc_joins(fields)}
+        {EXPORT_WHERE}
+    ) TO STDOUT WITH (FORMAT csv, HEADER)
+"""
+    doc, joins = pereval_doc_sql(fields), _doc_joins(fields)
+    if fmt == "geojson":
+        # точка — из coords, даже если их нет среди полей properties
+        doc = f"""json_build_object(
+        'type', 'Feature', 'id', p.id,
+        'geometry', CASE WHEN c.latitude IS NOT NULL AND c.longitude IS NOT NULL
+            THEN json_build_object('type', 'Point', 'coordinates', json_build_array(c.longitude, c.latitude)) END,
+        'properties', {doc}
+    )"""
+        joins = _doc_joins(fields + ("coords",))
+    return f"""
+    SELECT {doc}::text
+    FROM pereval_added p
+    {joins}
+    {EXPORT_WHERE}
+"""
+
+
+# поля выгрузки: images=none — без картинок
+def export_fields(fields: Tuple[str, ...], images: str) -> Tuple[str, ...]:
+    return tuple(name for name in fields if name != "images") if images == "none" else fields
+
+
+def export_params(status: Optional[str], since: Optional[date], until: Optional[date]) -> Dict[str, Any]:
+    return {"status": status, "since": since, "until": until}
+
+
+# документ с содержимым картинок: data — base64 из хранилища, как в POST /submitData;
+# нет файла в хранилище — data null, выгрузка продолжается
+def export_inline_images(doc: str, store: BlobStore) -> str:
+    data = json.loads(doc)
+    for image in data.get("properties", data).get("images", []):
+        key = image["url"].rsplit("/", 1)[-1]
+        try:
+            with store.open(key) as f:
+                image["data"] = base64.b64encode(f.read()).decode("ascii")
+        except OSError:
+            logger.warning("Нет картинки %s в хранилище", key)
+            image["data"] = None
+    return json.dumps(data, ensure_ascii=False)
+
+
+# часть JSON-выгрузки из пачки документов; first — первая пачка
+def export_batch(fmt: str, docs: List[str], first: bool) -> bytes:
+    if fmt == "ndjson":
+        return "".join(doc + "\n" for doc in docs).encode("utf-8")
+    return ((GEOJSON_HEAD if first else ",\n") + ",\n".join(docs)).encode("utf-8")
+
+
+# конец JSON-выгрузки; empty — не было ни одной пачки
+def export_end(fmt: str, empty: bool) -> bytes:
+    if fmt == "ndjson":
+        return b""
+    return ((GEOJSON_HEAD if empty else "") + "\n]}\n").encode("utf-8")
+
+
+# ограничение страницы списка перевалов
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+# поля перевала, которые можно менять через PATCH (кроме координат, уровней и картинок)
+UPDATABLE_FIELDS = ["beauty_title", "title", "other_titles", "connect", "add_time"]
+
+# пакетная вставка: каждая таблица — один запрос с массивами параметров (unnest)
+BATCH_USERS_SQL = """
+    WITH new_users AS (
+        INSERT INTO users (email, fam, name, otc, phone)
+        SELECT * FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[], %s::text[])
+        ON CONFLICT (email) DO NOTHING
+        RETURNING email, id
+    )
+    SELECT email, id FROM new_users
+    UNION ALL
+    SELECT email, id FROM users WHERE email = ANY(%s::text[])
+"""
+
+# id заранее берём из последовательностей, чтобы связать строки без RETURNING по порядку
+RESERVE_IDS_SQL = """
+    SELECT nextval(pg_get_serial_sequence('coords', 'id')),
+           nextval(pg_get_serial_sequence('pereval_added', 'id'))
+    FROM generate_series(1, %s)
+"""
+
+BATCH_COORDS_SQL = """
+    INSERT INTO coords (id, latitude, longitude, height)
+    SELECT * FROM unnest(%s::int[], %s::float8[], %s::float8[], %s::int[])
+"""
+
+BATCH_PEREVALS_SQL = """
+    INSERT INTO pereval_added (
+        id, beauty_title, title, other_titles, connect, add_time,
+        user_id, coord_id,
+        level_winter, level_summer, level_autumn, level_spring
+    )
+    SELECT * FROM unnest(
+        %s::int[], %s::text[], %s::text[], %s::text[], %s::text[], %s::timestamp[],
+        %s::int[], %s::int[],
+        %s::text[], %s::text[], %s::text[], %s::text[]
+    )
+"""
+
+BATCH_IMAGES_SQL = """
+    INSERT INTO images (pereval_id, title, blob_key, size, content_type)
+    SELECT * FROM unnest(%s::int[], %s::text[], %s::text[], %s::int[], %s::text[])
+"""
+
+# максимальный размер пакета в POST /submitData/batch
+MAX_BATCH_SIZE = int(os.getenv("FSTR_BATCH_MAX", "5000"))
+
+# отложенная запись (FSTR_INGEST_MODE=postgres): заявки ждут в submissions, воркеры разбирают их пачками
+INGEST_MAX_ATTEMPTS = int(os.getenv("FSTR_INGEST_ATTEMPTS", "5"))
+INGEST_CLAIM_TTL = float(os.getenv("FSTR_INGEST_CLAIM_TTL", "300"))
+
+ENQUEUE_SUBMISSION_SQL = "INSERT INTO submissions (id, payload) VALUES (%s, %s::jsonb)"
+
+# как в CLAIM_PEREVALS_SQL: сначала зависшие у упавшего воркера, затем новые; SKIP LOCKED между воркерами
+CLAIM_SUBMISSIONS_SQL = """
+    WITH expired AS (
+        SELECT id FROM submissions
+        WHERE state = 'processing' AND claimed_at < now() - make_interval(secs => %(claim_ttl)s)
+        ORDER BY claimed_at
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    fresh AS (
+        SELECT id FROM submissions
+        WHERE state = 'queued'
+        ORDER BY created_at
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    picked AS (
+        SELECT id FROM (SELECT id FROM expired UNION ALL SELECT id FROM fresh) ids LIMIT %(limit)s
+    )
+    UPDATE submissions s
+    SET state = 'processing', claimed_at = now(), attempts = s.attempts + 1
+    FROM picked
+    WHERE s.id = picked.id
+    RETURNING s.id, s.payload
+"""
+
+# итог по заявкам — в той же транзакции, что и вставка перевалов. Записанные — done, отвергнутые
+# проверкой или БД — failed; сбой записи (retry) — как в RELEASE_SUBMISSIONS_SQL: обратно в очередь
+# с данными, после INGEST_MAX_ATTEMPTS попыток — failed
+FINISH_SUBMISSIONS_SQL = """
+    UPDATE submissions s
+    SET state = CASE
+            WHEN r.state <> 'retry' THEN r.state
+            WHEN s.attempts >= %(max_attempts)s THEN 'failed'
+            ELSE 'queued'
+        END,
+        pereval_id = r.pereval_id,
+        message = r.message,
+        payload = CASE WHEN r.state = 'retry' THEN s.payload END,
+        claimed_at = CASE WHEN r.state = 'retry' THEN NULL ELSE s.claimed_at END,
+        finished_at = CASE WHEN r.state <> 'retry' OR s.attempts >= %(max_attempts)s THEN now() END
+    FROM unnest(%(ids)s::text[], %(states)s::text[], %(pereval_ids)s::int[], %(messages)s::text[])
+        AS r(id, state, pereval_id, message)
+    WHERE s.id = r.id
+"""
+
+# пачка не записалась: обратно в очередь, после INGEST_MAX_ATTEMPTS попыток — failed (данные сохраняются)
+RELEASE_SUBMISSIONS_SQL = """
+    UPDATE submissions
+    SET state = CASE WHEN attempts >= %(max_attempts)s THEN 'failed' ELSE 'queued' END,
+        message = %(message)s,
+        claimed_at = NULL,
+        finished_at = CASE WHEN attempts >= %(max_attempts)s THEN now() END
+    WHERE id = ANY(%(ids)s::text[]) AND state = 'processing'
+"""
+
+SELECT_SUBMISSION_SQL = "SELECT state, pereval_id, message FROM submissions WHERE id = %s"
+
+
+# параметры FINISH_SUBMISSIONS_SQL по результатам add_perevals
+def finish_params(submission_ids: List[str], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    states = {200: "done", 500: "retry"}
+    return {
+        "ids": submission_ids,
+        "states": [states.get(r["status"], "failed") for r in results],
+        "pereval_ids": [r["id"] for r in results],
+        "messages": [r["message"] for r in results],
+        "max_attempts": INGEST_MAX_ATTEMPTS,
+    }
+
+
+def submission_status(tracking_id: str, state: str, pereval_id: Optional[int],
+                      message: Optional[str]) -> Dict[str, Any]:
+    return {"tracking_id": tracking_id, "state": state, "id": pereval_id, "message": message}
+
+
+# ключи идемпотентности POST /submitData: ключ занимается в транзакции вставки перевала, поэтому
+# параллельный дубль ждёт на его строке итога первого запроса; истёкшие ключи (FSTR_IDEMPOTENCY_TTL)
+# занимаются заново и понемногу удаляются при каждой новой записи
+IDEMPOTENCY_TTL = float(os.getenv("FSTR_IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+CLAIM_IDEMPOTENCY_KEY_SQL = """
+    WITH expired AS (
+        DELETE FROM idempotency_keys WHERE key IN (
+            SELECT key FROM idempotency_keys
+            WHERE created_at < now() - make_interval(secs => %(ttl)s) AND key <> %(key)s
+            ORDER BY created_at
+            LIMIT 10
+            FOR UPDATE SKIP LOCKED
+        )
+    )
+    INSERT INTO idempotency_keys (key, fingerprint) VALUES (%(key)s, %(fingerprint)s)
+    ON CONFLICT (key) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, pereval_id = NULL, created_at = now()
+        WHERE idempotency_keys.created_at < now() - make_interval(secs => %(ttl)s)
+    RETURNING key
+"""
+
+FINISH_IDEMPOTENCY_KEY_SQL = "UPDATE idempotency_keys SET pereval_id = %s WHERE key = %s"
+
+SELECT_IDEMPOTENCY_KEY_SQL = "SELECT fingerprint, pereval_id FROM idempotency_keys WHERE key = %s"
+
+
+def claim_key_params(key: str, fingerprint: str) -> Dict[str, Any]:
+    return {"key": key, "fingerprint": fingerprint, "ttl": IDEMPOTENCY_TTL}
+
+
+# поиск по местности: GiST-индекс coords.geo отбирает точки в прямоугольнике(ах),
+# затем точное расстояние по гаверсинусу; страницы по ключу (distance_km, id)
+GEO_SEARCH_SQL = """
+    SELECT * FROM (
+        SELECT
+            p.id, p.beauty_title, p.title, p.status,
+            c.latitude, c.longitude, c.height,
+            2 * 6371.0 * asin(sqrt(
+                power(sin(radians(c.latitude - %(lat)s) / 2), 2)
+                + cos(radians(%(lat)s)) * cos(radians(c.latitude))
+                * power(sin(radians(c.longitude - %(lon)s) / 2), 2)
+            )) AS distance_km
+        FROM coords c
+        JOIN pereval_added p ON p.coord_id = c.id
+        WHERE c.geo <@ %(box1)s::box OR c.geo <@ %(box2)s::box
+    ) found
+    WHERE (%(radius)s::float8 IS NULL OR distance_km <= %(radius)s::float8)
+      AND (distance_km, id) > (%(after_distance)s::float8, %(after_id)s::int)
+    ORDER BY distance_km, id
+    LIMIT %(limit)s
+"""
+
+EARTH_KM_PER_DEGREE = 111.32
+
+# кластеры для карты (миграция 13): тайл Web Mercator уровня zoom делится на 8 x 8 ячеек, в cluster_cells —
+# число перевалов и сумма координат по ячейкам. Кластер — непустая ячейка: центр тяжести, число перевалов
+# и до CLUSTER_SAMPLE id (ищутся по GiST-индексу в границах ячейки). Тайл отдаётся фрагментом JSON-массива
+CLUSTER_MAX_ZOOM = 14
+CLUSTER_CELLS_PER_TILE = 8
+CLUSTER_SAMPLE = 3
+# тайлов на запрос; больше — область слишком велика для этого zoom
+CLUSTER_MAX_TILES = int(os.getenv("FSTR_CLUSTER_MAX_TILES", "64"))
+CLUSTER_CACHE_SIZE = int(os.getenv("FSTR_CLUSTER_CACHE_SIZE", "4096"))
+CLUSTER_CACHE_TTL = float(os.getenv("FSTR_CLUSTER_CACHE_TTL", "30"))
+
+SELECT_CLUSTER_TILES_SQL = """
+    WITH tiles AS (
+        SELECT x, y FROM unnest(%(tx)s::int[], %(ty)s::int[]) AS t(x, y)
+    ),
+    cells AS (
+        SELECT t.x, t.y, c.cx, c.cy, sum(c.n) AS n,
+               sum(c.sum_lat) / sum(c.n) AS lat, sum(c.sum_lon) / sum(c.n) AS lon,
+               2 ^ (%(zoom)s + 3) AS side
+        FROM tiles t
+        JOIN cluster_cells c
+          ON c.zoom = %(zoom)s
+         AND c.cx BETWEEN t.x * 8 AND t.x * 8 + 7
+         AND c.cy BETWEEN t.y * 8 AND t.y * 8 + 7
+        GROUP BY t.x, t.y, c.cx, c.cy
+        HAVING sum(c.n) > 0
+    ),
+    clusters AS (
+        SELECT c.x, c.y, c.cx, c.cy, json_build_object(
+            'lat', round(c.lat::numeric, 6), 'lon', round(c.lon::numeric, 6), 'count', c.n,
+            'sample_ids', COALESCE(s.ids, '{}')
+        ) AS cluster
+        FROM cells c
+        LEFT JOIN LATERAL (
+            SELECT array_agg(p.id) AS ids FROM (
+                SELECT p.id
+                FROM coords g
+                JOIN pereval_added p ON p.coord_id = g.id
+                WHERE g.geo <@ box(
+                    point(c.cx / c.side * 360 - 180, degrees(atan(sinh(pi() * (1 - 2 * (c.cy + 1) / c.side))))),
+                    point((c.cx + 1) / c.side * 360 - 180, degrees(atan(sinh(pi() * (1 - 2 * c.cy / c.side)))))
+                )
+                LIMIT %(sample)s
+            ) p
+        ) s ON true
+    )
+    SELECT t.x, t.y, COALESCE(string_agg(c.cluster::text, ',' ORDER BY c.cy, c.cx), '')
+    FROM tiles t
+    LEFT JOIN clusters c ON c.x = t.x AND c.y = t.y
+    GROUP BY t.x, t.y
+"""
+
+
+# тайлы Web Mercator уровня zoom, покрывающие область; через 180-й меридиан (min_lon > max_lon) — с переходом
+def cluster_tiles(min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                  zoom: int) -> List[Tuple[int, int]]:
+    side = 2 ** zoom
+
+    def tile_x(lon: float) -> int:
+        return min(max(int((lon + 180) / 360 * side), 0), side - 1)
+
+    def tile_y(lat: float) -> int:
+        lat = math.radians(min(max(lat, -85.0511), 85.0511))
+        y = (1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2
+        return min(max(int(y * side), 0), side - 1)
+
+    x0, x1 = tile_x(min_lon), tile_x(max_lon)
+    xs = list(range(x0, x1 + 1)) if min_lon <= max_lon else list(range(x0, side)) + list(range(0, x1 + 1))
+    # y растёт к югу
+    ys = range(tile_y(max_lat), tile_y(min_lat) + 1)
+    return [(x, y) for y in ys for x in xs]
+
+
+def cluster_tiles_params(zoom: int, tiles: List[Tuple[int, int]]) -> Dict[str, Any]:
+    return {"zoom": zoom, "tx": [x for x, _ in tiles], "ty": [y for _, y in tiles], "sample": CLUSTER_SAMPLE}
+
+
+# ответ из фрагментов тайлов: JSON-массив кластеров
+def join_cluster_tiles(fragments: List[bytes]) -> bytes:
+    return b"[" + b",".join(f for f in fragments if f) + b"]"
+
+# слова словаря, похожие на слова запроса (доля общих триграмм, как similarity в pg_trgm)
+SIMILAR_WORDS_SQL = """
+    SELECT q.word, m.word
+    FROM unnest(%(words)s::text[]) AS q(word)
+    CROSS JOIN LATERAL (SELECT count(*) AS n FROM search_trigrams(q.word)) qt
+    CROSS JOIN LATERAL (
+        SELECT swt.word, count(*)::float8 / (qt.n + swt.trigram_count - count(*)) AS similarity
+        FROM search_trigrams(q.word) t
+        JOIN search_word_trigrams swt
+          ON swt.trigram = t
+         -- при similarity >= threshold число триграмм слова не дальше n*threshold..n/threshold
+         AND swt.trigram_count BETWEEN floor(qt.n * %(threshold)s::float8)::int
+                                   AND ceil(qt.n / %(threshold)s::float8)::int
+        GROUP BY swt.word, swt.trigram_count
+        HAVING count(*)::float8 / (qt.n + swt.trigram_count - count(*)) >= %(threshold)s
+        ORDER BY similarity DESC
+        LIMIT %(per_word)s
+    ) m
+"""
+
+# поиск по названиям через GIN-индекс search_tsv; страницы по ключу (rank, id) по убыванию
+SEARCH_PEREVALS_SQL = """
+    SELECT * FROM (
+        SELECT
+            p.id, p.beauty_title, p.title, p.other_titles, p.status,
+            c.latitude, c.longitude, c.height,
+            ts_rank(p.search_tsv, query)::float8 AS rank
+        FROM to_tsquery('russian', %(query)s) query
+        JOIN pereval_added p ON p.search_tsv @@ query
+        JOIN coords c ON c.id = p.coord_id
+    ) found
+    WHERE (rank, id) < (%(after_rank)s::float8, %(after_id)s::int)
+    ORDER BY rank DESC, id DESC
+    LIMIT %(limit)s
+"""
+
+# насколько слово может отличаться от слова из словаря, чтобы считаться опечаткой
+SEARCH_SIMILARITY = float(os.getenv("FSTR_SEARCH_SIMILARITY", "0.3"))
+SEARCH_VARIANTS_PER_WORD = 5
+
+
+# параметры ADD_PEREVAL_SQL из словаря PerevalData; images — результат store_images
+def add_pereval_params(data: Dict[str, Any], images: List[tuple]) -> Dict[str, Any]:
+    user = data["user"]
+    params = {key: data[key] for key in ("beauty_title", "title", "other_titles", "connect")}
+    params["add_time"] = data["add_time"] or None
+    params.update({key: user[key] for key in ("email", "fam", "name", "otc", "phone")})
+    params["user_id"] = USER_IDS.get(user["email"])
+    for season in ("winter", "summer", "autumn", "spring"):
+        params["level_" + season] = data["level"][season]
+
+    latitude, longitude, height = coords_params(data["coords"])
+    params.update(latitude=latitude, longitude=longitude, height=height)
+
+    titles, keys, sizes, types = (list(col) for col in zip(*images)) if images else ([], [], [], [])
+    params.update(image_titles=titles, image_keys=keys, image_sizes=sizes, image_types=types)
+    return params
+
+
+def coords_params(c: Dict[str, Any]) -> tuple:
+    return float(c["latitude"]), float(c["longitude"]), int(c["height"])
+
+
+# сохранение картинок в хранилище; возвращает (title, blob_key, size, content_type)
+def store_images(store: BlobStore, images: List[Dict[str, Any]]) -> List[tuple]:
+    stored = []
+    for img in images:
+        content = image_bytes(img["data"])
+        stored.append((img["title"], store.put(content), len(content), sniff_content_type(content[:16])))
+    return stored
+
+
+# описание картинки в ответе: ссылка на содержимое вместо самих данных
+def image_from_row(row) -> Dict[str, Any]:
+    image_id, title, blob_key, size, content_type = row
+    return {
+        "id": image_id,
+        "title": title,
+        "url": f"/images/{blob_key}" if blob_key else None,
+        "size": size,
+        "content_type": content_type,
+    }
+
+
+# прямоугольник в SQL-формате box
+def _box(min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> str:
+    return f"(({min_lon},{min_lat}),({max_lon},{max_lat}))"
+
+
+# прямоугольники области просмотра; через 180-й меридиан (min_lon > max_lon) — два
+def bbox_boxes(min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> Tuple[str, str]:
+    if min_lon <= max_lon:
+        box = _box(min_lat, min_lon, max_lat, max_lon)
+        return box, box
+    return _box(min_lat, min_lon, max_lat, 180.0), _box(min_lat, -180.0, max_lat, max_lon)
+
+
+# прямоугольники, покрывающие круг радиуса radius_km вокруг точки
+def radius_boxes(lat: float, lon: float, radius_km: float) -> Tuple[str, str]:
+    dlat = radius_km / EARTH_KM_PER_DEGREE
+    min_lat, max_lat = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+
+    cos_lat = min(math.cos(math.radians(min_lat)), math.cos(math.radians(max_lat)))
+    if cos_lat <= 0 or radius_km / (EARTH_KM_PER_DEGREE * cos_lat) >= 180:
+        return bbox_boxes(min_lat, -180.0, max_lat, 180.0)
+
+    dlon = radius_km / (EARTH_KM_PER_DEGREE * cos_lat)
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180:
+        min_lon += 360
+    if max_lon > 180:
+        max_lon -= 360
+    return bbox_boxes(min_lat, min_lon, max_lat, max_lon)
+
+
+# параметры GEO_SEARCH_SQL; after — (distance_km, id) последней записи предыдущей страницы
+def geo_params(lat: float, lon: float, boxes: Tuple[str, str], radius_km: Optional[float],
+               limit: int, after: Optional[Tuple[float, int]]) -> Dict[str, Any]:
+    after_distance, after_id = after if after else (-1.0, 0)
+    return {
+        "lat": lat, "lon": lon,
+        "box1": boxes[0], "box2": boxes[1],
+        "radius": radius_km,
+        "after_distance": after_distance, "after_id": after_id,
+        "limit": limit,
+    }
+
+
+def geo_result_from_row(row: tuple) -> Dict[str, Any]:
+    return {
+        "id": row[0],
+        "beauty_title": row[1],
+        "title": row[2],
+        "status": row[3],
+        "coords": {"latitude": row[4], "longitude": row[5], "height": row[6]},
+        "distance_km": row[7],
+    }
+
+
+# слова запроса в том же виде, что в словаре search_words
+def search_query_words(query: str) -> List[str]:
+    words = re.split(r"[\W_]+", query.lower().replace("ё", "е"))
+    return list(dict.fromkeys(w for w in words if w))
+
+
+# tsquery: каждое слово запроса как префикс или одно из похожих слов словаря; слова через И
+def build_tsquery(words: List[str], similar: Dict[str, List[str]]) -> str:
+    parts = []
+    for word in words:
+        variants = [f"'{word}':*"] + [f"'{v}'" for v in similar.get(word, []) if v != word]
+        parts.append("(" + " | ".join(variants) + ")")
+    return " & ".join(parts)
+
+
+def search_params(query: str, limit: int, after: Optional[Tuple[float, int]]) -> Dict[str, Any]:
+    after_rank, after_id = after if after else (float("inf"), 0)
+    return {"query": query, "after_rank": after_rank, "after_id": after_id, "limit": limit}
+
+
+def search_result_from_row(row: tuple) -> Dict[str, Any]:
+    return {
+        "id": row[0],
+        "beauty_title": row[1],
+        "title": row[2],
+        "other_titles": row[3],
+        "status": row[4],
+        "coords": {"latitude": row[5], "longitude": row[6], "height": row[7]},
+        "rank": row[8],
+    }
+
+
+# параметры UPDATE_PEREVAL_SQL: set_* — передано ли поле; images — результат store_images
+def update_params(pereval_id: int, data: Dict[str, Any], images: Optional[List[tuple]],
+                  version: Optional[int]) -> Dict[str, Any]:
+    params: Dict[str, Any] = {"id": pereval_id, "version": version}
+
+    for key in UPDATABLE_FIELDS:
+        params["set_" + key] = key in data
+        params[key] = data.get(key)
+
+    level = data.get("level") or {}
+    for season in ("winter", "summer", "autumn", "spring"):
+        params["set_level_" + season] = season in level
+        params["level_" + season] = level.get(season)
+
+    params["set_coords"] = "coords" in data
+    latitude, longitude, height = coords_params(data["coords"]) if "coords" in data else (None, None, None)
+    params.update(latitude=latitude, longitude=longitude, height=height)
+
+    params["set_images"] = images is not None
+    titles, keys, sizes, types = (list(col) for col in zip(*images)) if images else ([], [], [], [])
+    params.update(image_titles=titles, image_keys=keys, image_sizes=sizes, image_types=types)
+    return params
+
+
+# ответ update_pereval по строке UPDATE_PEREVAL_SQL
+def update_result(row: tuple) -> Dict[str, Any]:
+    status, version, new_version = row
+    if status is None:
+        return {"state": 0, "message": "Перевал не найден"}
+    if new_version is not None:
+        return {"state": 1, "message": "Успешно обновлено", "version": new_version}
+    if status != "new":
+        return {"state": 0, "message": f"Редактирование запрещено, статус: {status}"}
+    return {
+        "state": 0,
+        "message": f"Перевал уже изменён, текущая версия: {version}",
+        "version": version,
+        "conflict": True,
+    }
+
+
+# сборка ответа по строке SELECT_PEREVAL_SQL
+def pereval_from_row(row: tuple, images: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "id": row[0],
+        "beauty_title": row[1],
+        "title": row[2],
+        "other_titles": row[3],
+        "connect": row[4],
+        "add_time": row[5].isoformat() if row[5] else None,
+        "level": {
+            "winter": row[6],
+            "summer": row[7],
+            "autumn": row[8],
+            "spring": row[9]
+        },
+        "status": row[10],
+        "user": {
+            "email": row[11],
+            "fam": row[12],
+            "name": row[13],
+            "otc": row[14],
+            "phone": row[15]
+        },
+        "coords": {
+            "latitude": row[16],
+            "longitude": row[17],
+            "height": row[18]
+        },
+        "version": row[19],
+        "updated_at": row[20],
+        "images": images
+    }
+
+
+# ошибка в данных, которую отвергла БД (классы SQLSTATE 22 и 23: значение вне диапазона, нарушение ограничения):
+# 400 с текстом ошибки, иначе 500. Коды у psycopg2 — pgcode, у psycopg 3 — sqlstate
+def item_error_result(index: int, error: Exception) -> Dict[str, Any]:
+    code = getattr(error, "pgcode", None) or getattr(error, "sqlstate", None) or ""
+    if code[:2] in ("22", "23"):
+        diag = getattr(error, "diag", None)
+        detail = getattr(diag, "message_primary", None) or str(error)
+        return batch_result(index, 400, message=f"Данные отклонены БД: {detail}")
+    return batch_result(index, 500, message="Ошибка при добавлении данных в БД")
+
+
+def batch_result(index: int, status: int, pereval_id: Optional[int] = None,
+                 message: Optional[str] = None) -> Dict[str, Any]:
+    return {"index": index, "status": status, "id": pereval_id, "message": message}
+
+
+# проверка элементов пакета; результаты с ошибками и список пригодных (индекс, данные)
+def validate_batch(items: List[Dict[str, Any]]) -> Tuple[List[Optional[Dict[str, Any]]], List[tuple]]:
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    valid = []
+    for index, data in enumerate(items):
+        if not data.get("title") or not data["user"].get("email"):
+            results[index] = batch_result(index, 400, message="Не хватает обязательных полей (title или email)")
+            continue
+        if data.get("add_time"):
+            try:
+                datetime.fromisoformat(data["add_time"])
+            except ValueError:
+                results[index] = batch_result(index, 400, message=f"Неверный формат add_time: {data['add_time']}")
+                continue
+        valid.append((index, data))
+    return results, valid
+
+
+# параметры BATCH_USERS_SQL: уникальные email, данные первого вхождения
+def batch_users_params(valid: List[tuple]) -> tuple:
+    users = {}
+    for _, data in valid:
+        users.setdefault(data["user"]["email"], data["user"])
+    columns = [[u[key] for u in users.values()] for key in ("email", "fam", "name", "otc", "phone")]
+    return (*columns, columns[0])
+
+
+# параметры вставки координат и перевалов по зарезервированным id
+def batch_rows_params(valid: List[tuple], ids: List[tuple], user_ids: Dict[str, int]) -> Tuple[tuple, tuple]:
+    coords = [coords_params(data["coords"]) for _, data in valid]
+    coord_ids = [c for c, _ in ids]
+    pereval_ids = [p for _, p in ids]
+
+    coords_columns = (coord_ids, *(list(col) for col in zip(*coords)))
+    perevals_columns = (
+        pereval_ids,
+        [d["beauty_title"] for _, d in valid],
+        [d["title"] for _, d in valid],
+        [d["other_titles"] for _, d in valid],
+        [d["connect"] for _, d in valid],
+        [d["add_time"] or None for _, d in valid],
+        [user_ids[d["user"]["email"]] for _, d in valid],
+        coord_ids,
+        *([d["level"][season] for _, d in valid] for season in ("winter", "summer", "autumn", "spring")),
+    )
+    return coords_columns, perevals_columns
+
+
+# сохранение картинок пакета; параметры BATCH_IMAGES_SQL
+def batch_images_params(store: BlobStore, valid: List[tuple], ids: List[tuple]) -> tuple:
+    columns = ([], [], [], [], [])
+    for (_, data), (_, pereval_id) in zip(valid, ids):
+        for image in store_images(store, data["images"]):
+            for column, value in zip(columns, (pereval_id, *image)):
+                column.append(value)
+    return columns
+
+
+@instrument_db("sync")
 class DatabaseManager:
-    def __init__(self):
-        # параметры подключения читаем из .env
-        self.db_host = os.getenv("FSTR_DB_HOST", "localhost")
-        self.db_port = os.getenv("FSTR_DB_PORT", "5432")
-        self.db_login = os.getenv("FSTR_DB_LOGIN", "postgres")
-        self.db_pass = os.getenv("FSTR_DB_PASS", "")
-        self.db_name = os.getenv("FSTR_DB_NAME", "pereval_db")
+    """Синхронный доступ к БД (psycopg2) для CLI и бенчмарков: выгрузка каталога в файл (export.py)
+    и прежний блокирующий путь в bench_concurrency.py. Приложение и воркеры работают через AsyncDatabaseManager"""
 
+    def __init__(self, blob_store: Optional[BlobStore] = None):
+        self.blob_store = blob_store if blob_store is not None else get_blob_store()
         self.connection = None
         self.cursor = None
 
     # подключение к БД
     def connect(self):
         try:
-            self.connection = psycopg2.connect(
-                host=self.db_host,
-                port=self.db_port,
-                user=self.db_login,
-                password=self.db_pass,
-                database=self.db_name
-            )
-            self.cursor = self.connection.cursor()
-            self._create_tables()
+            self.connection = psycopg2.connect(**db_params())
+            # курсор с журналом медленных запросов (FSTR_SLOW_QUERY_MS)
+            self.cursor = SlowQueryCursor(self.connection.cursor(), self.connection, self)
             return True
-        except Exception as e:
-            print(f"Ошибка подключения к БД: {e}")
+        except Exception:
+            logger.exception("Ошибка подключения к БД")
+            if self.connection is not None:
+                self.disconnect()
             return False
 
     # отключение от БД
     def disconnect(self):
         if self.cursor:
             self.cursor.close()
+            self.cursor = None
         if self.connection:
             self.connection.close()
-
-    # создание таблиц, если их нет
-    def _create_tables(self):
-        try:
-            self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    email TEXT UNIQUE NOT NULL,
-                    fam TEXT,
-                    name TEXT,
-                    otc TEXT,
-                    phone TEXT
-                );
-
-                CREATE TABLE IF NOT EXISTS coords (
-                    id SERIAL PRIMARY KEY,
-                    latitude DOUBLE PRECISION,
-                    longitude DOUBLE PRECISION,
-                    height INTEGER
-                );
-
-                CREATE TABLE IF NOT EXISTS pereval_added (
-                    id SERIAL PRIMARY KEY,
-                    beauty_title TEXT,
-                    title TEXT,
-                    other_titles TEXT,
-                    connect TEXT,
-                    add_time TIMESTAMP,
-                    user_id INTEGER REFERENCES users(id),
-                    coord_id INTEGER REFERENCES coords(id),
-                    level_winter TEXT,
-                    level_summer TEXT,
-                    level_autumn TEXT,
-                    level_spring TEXT,
-                    status TEXT DEFAULT 'new'
-                );
-
-                CREATE TABLE IF NOT EXISTS images (
-                    id SERIAL PRIMARY KEY,
-                    pereval_id INTEGER REFERENCES pereval_added(id) ON DELETE CASCADE,
-                    data TEXT,
-                    title TEXT
-                );
-            """)
-            self.connection.commit()
-        except Exception as e:
-            print(f"Ошибка создания таблиц: {e}")
-            self.connection.rollback()
-
-    # получение или создание пользователя
-    def _add_or_get_user(self, data: Dict[str, str]) -> Optional[int]:
-        try:
-            self.cursor.execute("SELECT id FROM users WHERE email=%s", (data["email"],))
-            row = self.cursor.fetchone()
-
-            if row:
-                return row[0]
-
-            self.cursor.execute(
-                """
-                INSERT INTO users (email, fam, name, otc, phone)
-                VALUES (%s, %s, %s, %s, %s) RETURNING id
-                """,
-                (data["email"], data["fam"], data["name"], data["otc"], data["phone"])
-            )
-            user_id = self.cursor.fetchone()[0]
-            self.connection.commit()
-            return user_id
-
-        except Exception as e:
-            print(f"Ошибка работы с пользователем: {e}")
-            self.connection.rollback()
-            return None
-
-    # добавление перевала
-    def add_pereval(self, data: Dict[str, Any]) -> Optional[int]:
-        try:
-            user_id = self._add_or_get_user(data["user"])
-            if not user_id:
-                return None
-
-            self.cursor.execute(
-                "INSERT INTO coords (latitude, longitude, height) VALUES (%s, %s, %s) RETURNING id",
-                (
-                    float(data["coords"]["latitude"]),
-                    float(data["coords"]["longitude"]),
-                    int(data["coords"]["height"])
-                )
-            )
-            coord_id = self.cursor.fetchone()[0]
-
-            self.cursor.execute(
-                """
-                INSERT INTO pereval_added (
-                    beauty_title, title, other_titles, connect, add_time,
-                    user_id, coord_id,
-                    level_winter, level_summer, level_autumn, level_spring
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
-                """,
-                (
-                    data["beauty_title"],
-                    data["title"],
-                    data["other_titles"],
-                    data["connect"],
-                    data["add_time"],
-                    user_id,
-                    coord_id,
-                    data["level"]["winter"],
-                    data["level"]["summer"],
-                    data["level"]["autumn"],
-                    data["level"]["spring"]
-                )
-            )
-            pereval_id = self.cursor.fetchone()[0]
-
-            for img in data["images"]:
-                self.cursor.execute(
-                    "INSERT INTO images (pereval_id, data, title) VALUES (%s, %s, %s)",
-                    (pereval_id, img["data"], img["title"])
-                )
-
-            self.connection.commit()
-            return pereval_id
-
-        except Exception as e:
-            print(f"Ошибка добавления перевала: {e}")
-            self.connection.rollback()
-            return None
+            self.connection = None
 
     # получение одного перевала
     def get_pereval(self, pereval_id: int) -> Optional[Dict[str, Any]]:
         try:
-            self.cursor.execute(
-                """
-                SELECT
-                    p.id, p.beauty_title, p.title, p.other_titles, p.connect,
-                    p.add_time,
-                    p.level_winter, p.level_summer, p.level_autumn, p.level_spring,
-                    p.status,
-                    u.email, u.fam, u.name, u.otc, u.phone,
-                    c.latitude, c.longitude, c.height
-                FROM pereval_added p
-                JOIN users u ON p.user_id = u.id
-                JOIN coords c ON p.coord_id = c.id
-                WHERE p.id = %s
-                """,
-                (pereval_id,)
-            )
+            self.cursor.execute(SELECT_PEREVAL_SQL, (pereval_id,))
             row = self.cursor.fetchone()
 
             if not row:
                 return None
 
-            self.cursor.execute(
-                "SELECT data, title FROM images WHERE pereval_id=%s",
-                (pereval_id,)
-            )
-            images = [{"data": r[0], "title": r[1]} for r in self.cursor.fetchall()]
-
-            return {
-                "id": row[0],
-                "beauty_title": row[1],
-                "title": row[2],
-                "other_titles": row[3],
-                "connect": row[4],
-                "add_time": row[5].isoformat() if row[5] else None,
-                "level": {
-                    "winter": row[6],
-                    "summer": row[7],
-                    "autumn": row[8],
-                    "spring": row[9]
-                },
-                "status": row[10],
-                "user": {
-                    "email": row[11],
-                    "fam": row[12],
-                    "name": row[13],
-                    "otc": row[14],
-                    "phone": row[15]
-                },
-                "coords": {
-                    "latitude": row[16],
-                    "longitude": row[17],
-                    "height": row[18]
-                },
-                "images": images
-            }
-
-        except Exception as e:
-            print(f"Ошибка получения перевала: {e}")
-            return None
-
-    # обновление перевала
-    def update_pereval(self, pereval_id: int, data: Dict[str, Any]) -> Dict[str, Any]:
-        try:
-            self.cursor.execute("SELECT status FROM pereval_added WHERE id=%s", (pereval_id,))
-            row = self.cursor.fetchone()
+            self.cursor.execute(SELECT_IMAGES_SQL, (pereval_id,))
+            images = [image_from_row(r) for r in self.cursor.fetchall()]
 
-            if not row:
-                return {"state": 0, "message": "Перевал не найден"}
-
-            if row[0] != "new":
-                return {"state": 0, "message": f"Редактирование запрещено, статус: {row[0]}"}
-
-            if "coords" in data:
-                c = data["coords"]
-                self.cursor.execute(
-                    """
-                    UPDATE coords
-                    SET latitude=%s, longitude=%s, height=%s
-                    WHERE id = (SELECT coord_id FROM pereval_added WHERE id=%s)
-                    """,
-                    (
-                        float(c["latitude"]),
-                        float(c["longitude"]),
-                        int(c["height"]),
-                        pereval_id
-                    )
-                )
+            return pereval_from_row(row, images)
 
-            allowed = ["beauty_title", "title", "other_titles", "connect"]
-            for key in allowed:
-                if key in data:
-                    self.cursor.execute(
-                        f"UPDATE pereval_added SET {key}=%s WHERE id=%s",
-                        (data[key], pereval_id)
-                    )
-
-            self.connection.commit()
-            return {"state": 1, "message": "Успешно обновлено"}
-
-        except Exception as e:
-            print(f"Ошибка обновления: {e}")
-            self.connection.rollback()
-            return {"state": 0, "message": str(e)}
+        except Exception:
+            logger.exception("Ошибка получения перевала")
+            return None
 
-    # список всех перевалов пользователя
-    def get_user_perevals(self, email: str) -> List[Dict[str, Any]]:
+    # выгрузка каталога в двоичный файл out; число перевалов или None — ошибка
+    def export_perevals(self, out: BinaryIO, fmt: str = "ndjson", fields: Tuple[str, ...] = PEREVAL_FIELDS,
+                        status: Optional[str] = None, since: Optional[date] = None, until: Optional[date] = None,
+                        images: str = "refs") -> Optional[int]:
+        fields = export_fields(fields, images)
+        sql, params = select_export_sql(fmt, fields), export_params(status, since, until)
         try:
-            self.cursor.execute("SELECT id FROM users WHERE email=%s", (email,))
-            row = self.cursor.fetchone()
+            # свои курсоры, без журнала медленных запросов: выгрузка долгая по определению
+            if fmt == "csv":
+                with self.connection.cursor() as cursor:
+                    cursor.copy_expert(cursor.mogrify(sql, params).decode("utf-8"), out)
+                    return cursor.rowcount
 
-            if not row:
-                return []
-
-            self.cursor.execute(
-                "SELECT id FROM pereval_added WHERE user_id=%s",
-                (row[0],)
-            )
-            ids = [r[0] for r in self.cursor.fetchall()]
-
-            return [self.get_pereval(pid) for pid in ids]
-
-        except Exception as e:
-            print(f"Ошибка получения списка перевалов: {e}")
-            return []
+            with self.connection.cursor(name="pereval_export") as cursor:
+                cursor.execute(sql, params)
+                count = 0
+                while True:
+                    docs = [row[0] for row in cursor.fetchmany(EXPORT_BATCH)]
+                    if not docs:
+                        break
+                    if images == "inline":
+                        docs = [export_inline_images(doc, self.blob_store) for doc in docs]
+                    out.write(export_batch(fmt, docs, first=count == 0))
+                    count += len(docs)
+                out.write(export_end(fmt, empty=count == 0))
+                return count
 
+        except Exception:
+            logger.exception("Ошибка выгрузки каталога")
+            return None
+        finally:
+            self.connection.rollback()
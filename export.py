@@ -0,0 +1,66 @@
+"""
+Выгрузка каталога перевалов: NDJSON (документ на строку), CSV или GeoJSON (FeatureCollection).
+
+    python export.py --format ndjson --status accepted --since 2024-01-01 > perevals.ndjson
+    python export.py --format geojson --images none -o perevals.geojson
+
+То же по HTTP: GET /export?format=...&status=...&since=...&until=...&images=...&fields=...
+Документы — как в GET /submitData/{id}, fields= выбирает поля. Картинки: refs — ссылки url (по умолчанию),
+none — без картинок, inline — ещё и содержимое в data (base64, только JSON-форматы).
+Одновременно идёт не больше FSTR_EXPORT_MAX (2) выгрузок по HTTP, остальные получают 503.
+"""
+import os
+import sys
+import argparse
+from datetime import date
+
+from database import (
+    DatabaseManager, EXPORT_FORMATS, EXPORT_IMAGES, EXPORT_STATUSES, PEREVAL_FIELDS, parse_fields,
+)
+
+EXPORT_MAX_RUNNING = int(os.getenv("FSTR_EXPORT_MAX", "2"))
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "geojson": "application/geo+json",
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Выгрузка каталога перевалов")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--status", choices=EXPORT_STATUSES)
+    parser.add_argument("--since", type=date.fromisoformat, help="add_time не раньше даты (YYYY-MM-DD)")
+    parser.add_argument("--until", type=date.fromisoformat, help="add_time не позже даты (YYYY-MM-DD)")
+    parser.add_argument("--images", choices=EXPORT_IMAGES, default="refs")
+    parser.add_argument("--fields", help="поля через запятую, по умолчанию все")
+    parser.add_argument("-o", "--output", help="файл, по умолчанию stdout")
+    args = parser.parse_args(argv)
+
+    if args.images == "inline" and args.format == "csv":
+        parser.error("--images inline только для ndjson и geojson")
+    try:
+        fields = parse_fields(args.fields) if args.fields else PEREVAL_FIELDS
+    except ValueError as e:
+        parser.error(str(e))
+
+    db = DatabaseManager()
+    if not db.connect():
+        return 1
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        count = db.export_perevals(out, args.format, fields, args.status, args.since, args.until, args.images)
+    finally:
+        if args.output:
+            out.close()
+        db.disconnect()
+
+    if count is None:
+        return 1
+    print(f"Выгружено перевалов: {count}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Idempotency-Key для POST /submitData.
+
+Мобильные клиенты повторяют запрос при обрыве связи; с одинаковым ключом перевал записывается один раз,
+повтор получает первый ответ. Два уровня:
+    LRU процесса  — ответы по ключу (размер FSTR_IDEMPOTENCY_CACHE_SIZE, время жизни FSTR_IDEMPOTENCY_TTL);
+                    повтор в тот же процесс не обращается к БД, параллельный дубль ждёт первый запрос
+    idempotency_keys в БД — ключ занимается в транзакции вставки перевала, поэтому дубли из разных
+                    процессов тоже не создают второй перевал (см. add_pereval_once)
+Ошибки не запоминаются: повтор после 500 выполняет запись заново.
+"""
+import os
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+from cache import LRUCache, encode_json
+from database import IDEMPOTENCY_TTL
+
+
+class StoredResponse:
+    """Первый ответ на запрос с ключом и отпечаток его тела"""
+
+    __slots__ = ("fingerprint", "status_code", "content", "headers")
+
+    def __init__(self, fingerprint: str, status_code: int, content: Dict[str, Any],
+                 headers: Optional[Dict[str, str]] = None):
+        self.fingerprint = fingerprint
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class _KeyLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+# отпечаток тела запроса: тот же ключ с другими данными — ошибка клиента
+def request_fingerprint(data: Dict[str, Any]) -> str:
+    return hashlib.sha256(encode_json(data)).hexdigest()
+
+
+class IdempotencyStore:
+    """Ответы по Idempotency-Key в памяти процесса и блокировка ключа на время записи"""
+
+    def __init__(self, local: LRUCache):
+        self.local = local
+        self._locks: Dict[str, _KeyLock] = {}
+
+    def get(self, key: str) -> Optional[StoredResponse]:
+        return self.local.get(key)
+
+    def set(self, key: str, stored: StoredResponse):
+        self.local.set(key, stored)
+
+    # запросы с одним ключом выполняются по очереди; блокировка удаляется с последним из них
+    @asynccontextmanager
+    async def lock(self, key: str):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = _KeyLock()
+        entry.users += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.users -= 1
+            if not entry.users:
+                del self._locks[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.local.stats(), in_progress=len(self._locks))
+
+
+def create_idempotency_store() -> IdempotencyStore:
+    return IdempotencyStore(LRUCache(
+        max_size=int(os.getenv("FSTR_IDEMPOTENCY_CACHE_SIZE", "10000")),
+        ttl=IDEMPOTENCY_TTL,
+    ))
@@ -0,0 +1,272 @@
+"""
+Отложенная запись POST /submitData (write-behind).
+
+При FSTR_INGEST_MODE=postgres или local обработчик только проверяет данные, надёжно ставит заявку
+в очередь и отвечает 202 с tracking_id; перевалы записывают фоновые воркеры пачками через
+add_perevals. Состояние заявки: GET /submitData/status/{tracking_id}.
+
+    postgres — таблица submissions; итог заявки фиксируется в одной транзакции со вставкой перевалов,
+               воркеры нескольких процессов и машин разбирают очередь с SKIP LOCKED
+    local    — каталог FSTR_INGEST_DIR на диске (запись с fsync и атомарным переименованием);
+               приём не зависит от доступности БД, но очередь видна только процессам этой машины,
+               а при падении между вставкой и отметкой заявка будет записана повторно
+    sync     — (по умолчанию) запись в обработчике, как раньше
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from async_database import AsyncDatabaseManager
+from database import INGEST_MAX_ATTEMPTS, INGEST_CLAIM_TTL, submission_status
+
+logger = logging.getLogger("pereval.ingest")
+
+INGEST_MODE = os.getenv("FSTR_INGEST_MODE", "sync")
+INGEST_WORKERS = int(os.getenv("FSTR_INGEST_WORKERS", "2"))
+INGEST_BATCH = int(os.getenv("FSTR_INGEST_BATCH", "100"))
+INGEST_POLL = float(os.getenv("FSTR_INGEST_POLL", "0.2"))
+
+BATCH_FAILED_MESSAGE = "Ошибка при добавлении данных в БД"
+
+
+def new_tracking_id() -> str:
+    # время в начале — имена файлов локальной очереди сортируются в порядке поступления
+    return f"{time.time_ns():016x}{uuid.uuid4().hex[:16]}"
+
+
+class SubmissionQueue:
+    """Очередь заявок: постановка, выдача воркеру, запись пачки и состояние заявки"""
+
+    async def enqueue(self, data: Dict[str, Any]) -> Optional[str]:
+        raise NotImplementedError
+
+    async def claim(self, limit: int) -> List[Tuple[str, Dict[str, Any]]]:
+        raise NotImplementedError
+
+    async def process(self, claimed: List[Tuple[str, Dict[str, Any]]]):
+        raise NotImplementedError
+
+    async def status(self, tracking_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class PostgresSubmissionQueue(SubmissionQueue):
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def _run(self, method: str, *args, default=None):
+        db_manager = AsyncDatabaseManager(self.pool)
+        if not await db_manager.connect():
+            return default
+        try:
+            return await getattr(db_manager, method)(*args)
+        finally:
+            await db_manager.disconnect()
+
+    async def enqueue(self, data: Dict[str, Any]) -> Optional[str]:
+        tracking_id = new_tracking_id()
+        if await self._run("enqueue_submission", tracking_id, data, default=False):
+            return tracking_id
+        return None
+
+    async def claim(self, limit: int) -> List[Tuple[str, Dict[str, Any]]]:
+        return await self._run("claim_submissions", limit, default=[])
+
+    async def process(self, claimed: List[Tuple[str, Dict[str, Any]]]):
+        ids = [tracking_id for tracking_id, _ in claimed]
+        results = await self._run("add_perevals", [data for _, data in claimed], ids, default=None)
+        if results is None or all(r["status"] == 500 for r in results):
+            # итог не записан (пачка откатилась целиком) — заявки снова в очереди (зависшие вернёт
+            # INGEST_CLAIM_TTL); сбои отдельных перевалов возвращает в очередь FINISH_SUBMISSIONS_SQL
+            await self._run("release_submissions", ids, BATCH_FAILED_MESSAGE)
+
+    async def status(self, tracking_id: str) -> Optional[Dict[str, Any]]:
+        return await self._run("get_submission", tracking_id)
+
+
+class LocalSubmissionQueue(SubmissionQueue):
+    """Каталоги queued/ -> processing/ -> finished/, по файлу на заявку"""
+
+    def __init__(self, pool, root: str):
+        self.pool = pool
+        self.root = root
+        for name in ("queued", "processing", "finished"):
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+
+    def _path(self, state: str, tracking_id: str) -> str:
+        if not tracking_id.isalnum():
+            raise ValueError(f"Неверный tracking_id: {tracking_id}")
+        return os.path.join(self.root, state, tracking_id + ".json")
+
+    # запись с fsync файла и каталога: после ответа 202 заявка переживёт падение процесса
+    def _write(self, state: str, tracking_id: str, record: Dict[str, Any]):
+        path = self._path(state, tracking_id)
+        tmp = os.path.join(self.root, state, "." + tracking_id + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        fd = os.open(os.path.dirname(path), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _read(self, state: str, tracking_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(state, tracking_id), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _enqueue(self, data: Dict[str, Any]) -> str:
+        tracking_id = new_tracking_id()
+        self._write("queued", tracking_id, {"attempts": 0, "data": data})
+        return tracking_id
+
+    # переименование атомарно: заявку получает только один воркер
+    def _claim(self, limit: int) -> List[Tuple[str, Dict[str, Any]]]:
+        self._requeue_expired()
+        claimed = []
+        for name in sorted(os.listdir(os.path.join(self.root, "queued"))):
+            if len(claimed) >= limit:
+                break
+            if not name.endswith(".json"):
+                continue
+            tracking_id = name[:-5]
+            try:
+                os.rename(self._path("queued", tracking_id), self._path("processing", tracking_id))
+                # переименование сохраняет mtime постановки: обновляем сразу, иначе _requeue_expired
+                # другого воркера вернёт только что взятую заявку в очередь
+                os.utime(self._path("processing", tracking_id))
+            except FileNotFoundError:
+                continue
+            record = self._read("processing", tracking_id)
+            if record is None:
+                # заявку успели вернуть в очередь — её возьмёт другой воркер
+                continue
+            record["attempts"] += 1
+            self._write("processing", tracking_id, record)
+            claimed.append((tracking_id, record["data"]))
+        return claimed
+
+    # заявки, взятые дольше INGEST_CLAIM_TTL назад (воркер упал), — обратно в очередь
+    def _requeue_expired(self):
+        deadline = time.time() - INGEST_CLAIM_TTL
+        processing = os.path.join(self.root, "processing")
+        for name in os.listdir(processing):
+            path = os.path.join(processing, name)
+            try:
+                if name.endswith(".json") and os.path.getmtime(path) < deadline:
+                    os.rename(path, os.path.join(self.root, "queued", name))
+            except FileNotFoundError:
+                continue
+
+    def _finish(self, claimed: List[Tuple[str, Dict[str, Any]]], results: List[Dict[str, Any]]):
+        for (tracking_id, data), result in zip(claimed, results):
+            if result["status"] == 500:
+                record = self._read("processing", tracking_id)
+                if record is None:
+                    # заявка уже не наша (возвращена в очередь по INGEST_CLAIM_TTL)
+                    continue
+                if record["attempts"] < INGEST_MAX_ATTEMPTS:
+                    os.replace(self._path("processing", tracking_id), self._path("queued", tracking_id))
+                    continue
+                state = "failed"
+            else:
+                state = "done" if result["status"] == 200 else "failed"
+            self._write("finished", tracking_id, {"state": state, "id": result["id"], "message": result["message"]})
+            try:
+                os.unlink(self._path("processing", tracking_id))
+            except FileNotFoundError:
+                pass
+
+    async def enqueue(self, data: Dict[str, Any]) -> Optional[str]:
+        try:
+            return await asyncio.to_thread(self._enqueue, data)
+        except OSError:
+            logger.exception("Ошибка постановки заявки в очередь")
+            return None
+
+    async def claim(self, limit: int) -> List[Tuple[str, Dict[str, Any]]]:
+        return await asyncio.to_thread(self._claim, limit)
+
+    async def process(self, claimed: List[Tuple[str, Dict[str, Any]]]):
+        db_manager = AsyncDatabaseManager(self.pool)
+        if await db_manager.connect():
+            try:
+                results = await db_manager.add_perevals([data for _, data in claimed])
+            finally:
+                await db_manager.disconnect()
+        else:
+            results = [{"status": 500, "id": None, "message": BATCH_FAILED_MESSAGE} for _ in claimed]
+        await asyncio.to_thread(self._finish, claimed, results)
+
+    def _status(self, tracking_id: str) -> Optional[Dict[str, Any]]:
+        finished = self._read("finished", tracking_id)
+        if finished is not None:
+            return submission_status(tracking_id, finished["state"], finished["id"], finished["message"])
+        for state in ("processing", "queued"):
+            if os.path.exists(self._path(state, tracking_id)):
+                return submission_status(tracking_id, state, None, None)
+        return None
+
+    async def status(self, tracking_id: str) -> Optional[Dict[str, Any]]:
+        if not tracking_id.isalnum():
+            return None
+        return await asyncio.to_thread(self._status, tracking_id)
+
+
+class IngestWorkers:
+    """Фоновые воркеры: берут пачки заявок и записывают их, пока очередь не пуста"""
+
+    def __init__(self, queue: SubmissionQueue, workers: int = INGEST_WORKERS,
+                 batch_size: int = INGEST_BATCH, poll: float = INGEST_POLL):
+        self.queue = queue
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll = poll
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # одна пачка; число обработанных заявок
+    async def drain_once(self) -> int:
+        claimed = await self.queue.claim(self.batch_size)
+        if claimed:
+            await self.queue.process(claimed)
+        return len(claimed)
+
+    async def _run(self):
+        while True:
+            try:
+                if not await self.drain_once():
+                    await asyncio.sleep(self.poll)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка воркера отложенной записи")
+                await asyncio.sleep(self.poll)
+
+
+# очередь по FSTR_INGEST_MODE; None — запись в обработчике
+def create_submission_queue(pool) -> Optional[SubmissionQueue]:
+    if INGEST_MODE == "sync":
+        return None
+    if INGEST_MODE == "postgres":
+        return PostgresSubmissionQueue(pool)
+    if INGEST_MODE == "local":
+        return LocalSubmissionQueue(pool, os.getenv("FSTR_INGEST_DIR", "ingest"))
+    raise ValueError(f"Неизвестный режим записи: {INGEST_MODE}")
@@ -0,0 +1,244 @@
+"""
+Структурированные логи (одна JSON-строка на запись) и журнал медленных SQL-запросов.
+
+Каждая запись содержит время, уровень, логгер, сообщение и ID запроса (заголовок X-Request-ID
+или сгенерированный), дополнительные поля передаются через extra={"fields": {...}}.
+
+Медленные запросы: курсор DatabaseManager/AsyncDatabaseManager оборачивается, и оператор дольше
+FSTR_SLOW_QUERY_MS (по умолчанию 200, отрицательное значение отключает) пишется в логгер
+pereval.sql: текст, параметры без значений, длительность, метод слоя БД и ID запроса.
+Для доли FSTR_SLOW_QUERY_EXPLAIN_SAMPLE (0..1, по умолчанию 0) медленных операторов чтения
+дополнительно снимается EXPLAIN (ANALYZE, BUFFERS) — оператор при этом выполняется ещё раз.
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import traceback
+import contextvars
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+REQUEST_ID: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+SLOW_QUERY_MS = float(os.getenv("FSTR_SLOW_QUERY_MS", "200"))
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("FSTR_SLOW_QUERY_EXPLAIN_SAMPLE", "0"))
+
+WRITE_RE = re.compile(r"\b(insert|update|delete|nextval|setval)\b")
+
+# EXPLAIN идёт в транзакции вызывающего: точка сохранения не даёт его ошибке прервать её
+EXPLAIN_SAVEPOINT = "SAVEPOINT slow_query_explain"
+EXPLAIN_ROLLBACK = "ROLLBACK TO SAVEPOINT slow_query_explain"
+EXPLAIN_RELEASE = "RELEASE SAVEPOINT slow_query_explain"
+
+sql_logger = logging.getLogger("pereval.sql")
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной JSON-строкой"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = REQUEST_ID.get()
+        if request_id is not None:
+            entry["request_id"] = request_id
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info and record.exc_info[1] is not None:
+            exc = record.exc_info[1]
+            entry["error"] = f"{type(exc).__name__}: {exc}"
+            entry["traceback"] = "".join(traceback.format_exception(*record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# JSON-логи приложения в stderr; уровень из FSTR_LOG_LEVEL
+def configure_logging():
+    logger = logging.getLogger("pereval")
+    if any(isinstance(h.formatter, JsonFormatter) for h in logger.handlers):
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(os.getenv("FSTR_LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
+class RequestIdMiddleware:
+    """ASGI-middleware: ID запроса из X-Request-ID (или новый) — в логи и в заголовок ответа"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        if not request_id:
+            request_id = uuid.uuid4().hex
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((b"x-request-id", request_id.encode("latin-1")))
+            await send(message)
+
+        token = REQUEST_ID.set(request_id)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_ID.reset(token)
+
+
+# параметры без значений: тип и размер вместо строк (email, телефоны, картинки)
+def redact(params: Any) -> Any:
+    if params is None or isinstance(params, (bool, int, float)):
+        return params
+    if isinstance(params, dict):
+        return {k: redact(v) for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        if len(params) > 20:
+            return f"<{type(params).__name__} n={len(params)}>"
+        return [redact(v) for v in params]
+    if isinstance(params, (str, bytes)):
+        return f"<{type(params).__name__} len={len(params)}>"
+    return f"<{type(params).__name__}>"
+
+
+# EXPLAIN ANALYZE выполняет оператор, поэтому снимаем его только для чтения
+def is_read_only(sql: str) -> bool:
+    text = sql.lstrip().lower()
+    return text.startswith(("select", "with")) and not WRITE_RE.search(text)
+
+
+# метод слоя БД, из которого выполнен оператор: ближайший кадр стека с self == manager
+def calling_method(manager) -> Optional[str]:
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_locals.get("self") is manager:
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return None
+
+
+def _should_explain(sql: str) -> bool:
+    return SLOW_QUERY_EXPLAIN_SAMPLE > 0 and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE and is_read_only(sql)
+
+
+def _log_slow(manager, sql: str, params: Any, seconds: float, plan: Any = None):
+    fields = {
+        "event": "slow_query",
+        "duration_ms": round(seconds * 1000, 2),
+        "method": calling_method(manager),
+        "statement": " ".join(sql.split()),
+        "params": redact(params),
+    }
+    if plan is not None:
+        fields["plan"] = plan
+    sql_logger.warning("Медленный запрос", extra={"fields": fields})
+
+
+class SlowQueryCursor:
+    """Курсор psycopg2 с замером каждого оператора"""
+
+    def __init__(self, cursor, connection, manager):
+        self._cursor = cursor
+        self._connection = connection
+        self._manager = manager
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, sql, params=None):
+        return self._timed(self._cursor.execute, sql, params)
+
+    def executemany(self, sql, params_seq):
+        return self._timed(self._cursor.executemany, sql, params_seq)
+
+    def _timed(self, run, sql, params):
+        if SLOW_QUERY_MS < 0:
+            return run(sql, params)
+        started = time.perf_counter()
+        result = run(sql, params)
+        seconds = time.perf_counter() - started
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            _log_slow(self._manager, sql, params, seconds, self._explain(sql, params))
+        return result
+
+    def _explain(self, sql, params):
+        if not _should_explain(sql):
+            return None
+        savepoint = not self._connection.autocommit
+        try:
+            with self._connection.cursor() as cursor:
+                if savepoint:
+                    cursor.execute(EXPLAIN_SAVEPOINT)
+                try:
+                    cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+                    plan = cursor.fetchone()[0]
+                except Exception:
+                    if savepoint:
+                        cursor.execute(EXPLAIN_ROLLBACK)
+                    raise
+                if savepoint:
+                    cursor.execute(EXPLAIN_RELEASE)
+                return plan
+        except Exception:
+            sql_logger.exception("Ошибка EXPLAIN медленного запроса")
+            return None
+
+
+class AsyncSlowQueryCursor(SlowQueryCursor):
+    """Курсор psycopg 3 (async) с замером каждого оператора"""
+
+    async def execute(self, sql, params=None):
+        return await self._timed(self._cursor.execute, sql, params)
+
+    async def executemany(self, sql, params_seq):
+        return await self._timed(self._cursor.executemany, sql, params_seq)
+
+    async def _timed(self, run, sql, params):
+        if SLOW_QUERY_MS < 0:
+            return await run(sql, params)
+        started = time.perf_counter()
+        result = await run(sql, params)
+        seconds = time.perf_counter() - started
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            _log_slow(self._manager, sql, params, seconds, await self._explain(sql, params))
+        return result
+
+    async def _explain(self, sql, params):
+        if not _should_explain(sql):
+            return None
+        savepoint = not self._connection.autocommit
+        try:
+            async with self._connection.cursor() as cursor:
+                if savepoint:
+                    await cursor.execute(EXPLAIN_SAVEPOINT)
+                try:
+                    await cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+                    plan = (await cursor.fetchone())[0]
+                except Exception:
+                    if savepoint:
+                        await cursor.execute(EXPLAIN_ROLLBACK)
+                    raise
+                if savepoint:
+                    await cursor.execute(EXPLAIN_RELEASE)
+                return plan
+        except Exception:
+            sql_logger.exception("Ошибка EXPLAIN медленного запроса")
+            return None
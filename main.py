@@ -1,13 +1,163 @@
-from fastapi import FastAPI, HTTPException, Query
+import os
+import json
+import anyio
+from datetime import date
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Union
 import uvicorn
 from dotenv import load_dotenv
-from database import DatabaseManager
+from async_database import AsyncDatabaseManager, create_async_pool
+from database import (
+    DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT, MAX_BATCH_SIZE, MODERATION_STATUSES, IDEMPOTENCY_KEY_MAX_LENGTH, validate_batch,
+    PEREVAL_FIELDS, USER_IDS, parse_fields,
+    EXPORT_FORMATS, EXPORT_IMAGES, EXPORT_STATUSES,
+    CLUSTER_MAX_ZOOM, CLUSTER_MAX_TILES, CLUSTER_CACHE_SIZE, CLUSTER_CACHE_TTL, cluster_tiles, join_cluster_tiles,
+)
+from blobstore import get_blob_store, is_blob_key, sniff_content_type
+from migrations import migrate_database
+from cache import CachedPereval, LRUCache, create_pereval_cache, encode_json
+from compression import CompressionMiddleware
+from export import EXPORT_MAX_RUNNING, MEDIA_TYPES as EXPORT_MEDIA_TYPES
+from replicas import PrimaryAfterWriteMiddleware, create_replica_set
+from metrics import REGISTRY, MetricsMiddleware
+from logs import RequestIdMiddleware, configure_logging
+from ingest import IngestWorkers, create_submission_queue
+from idempotency import StoredResponse, create_idempotency_store, request_fingerprint
+from thumbnails import SIZES as THUMB_SIZES, THUMB_CONTENT_TYPE, create_thumbnail_generator
 
 load_dotenv()
+configure_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # схема БД обновляется один раз при старте, а не на каждом подключении
+    if os.getenv("FSTR_DB_MIGRATE_ON_STARTUP", "1") == "1":
+        migrate_database()
+
+    app.state.cache = create_pereval_cache()
+    # тайлы кластеров не сбрасываются при записи: новые перевалы видны на карте не позже чем через TTL
+    app.state.clusters = LRUCache(max_size=CLUSTER_CACHE_SIZE, ttl=CLUSTER_CACHE_TTL)
+    # число идущих выгрузок GET /export
+    app.state.exports = 0
+    app.state.idempotency = create_idempotency_store()
 
-app = FastAPI(title="Pereval API", description="API для мобильного приложения Перевалы")
+    # уменьшенные копии новых картинок — в пуле процессов
+    app.state.thumbnails = create_thumbnail_generator(get_blob_store())
+    if app.state.thumbnails is not None:
+        await app.state.thumbnails.start()
+
+    # один асинхронный пул соединений на процесс
+    app.state.pool = create_async_pool()
+    await app.state.pool.open()
+    # реплики для чтения (FSTR_DB_REPLICA_HOSTS)
+    app.state.replicas = create_replica_set(app.state.pool)
+    if app.state.replicas is not None:
+        await app.state.replicas.start()
+
+    # отложенная запись POST /submitData (FSTR_INGEST_MODE): очередь и фоновые воркеры
+    app.state.submissions = create_submission_queue(app.state.pool)
+    workers = None
+    if app.state.submissions is not None:
+        workers = IngestWorkers(app.state.submissions)
+        workers.start()
+
+    yield
+    if workers is not None:
+        await workers.stop()
+    if app.state.thumbnails is not None:
+        app.state.thumbnails.close()
+    if app.state.replicas is not None:
+        await app.state.replicas.close()
+    await app.state.pool.close()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON-ответ через encode_json (orjson, если установлен)"""
+
+    def render(self, content: Any) -> bytes:
+        return encode_json(content)
+
+
+app = FastAPI(
+    title="Pereval API",
+    description="API для мобильного приложения Перевалы",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
+)
+# сжатие — ближе всех к приложению: метрики видят размер ответа после сжатия
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(PrimaryAfterWriteMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
+
+
+# состояние пула и кэша на момент запроса /metrics
+def _pool_metrics() -> Dict[str, float]:
+    pool = getattr(app.state, "pool", None)
+    if pool is None:
+        return {}
+    stats = pool.get_stats()
+    return {"pereval_db_" + (key if key.startswith("pool_") else "pool_" + key): value for key, value in stats.items()}
+
+
+def _cache_metrics() -> Dict[str, float]:
+    cache = getattr(app.state, "cache", None)
+    if cache is None:
+        return {}
+    return {f"pereval_cache_{key}": value for key, value in cache.local.stats().items()}
+
+
+def _cluster_metrics() -> Dict[str, float]:
+    clusters = getattr(app.state, "clusters", None)
+    if clusters is None:
+        return {}
+    return {f"pereval_clusters_{key}": value for key, value in clusters.stats().items()}
+
+
+def _idempotency_metrics() -> Dict[str, float]:
+    store = getattr(app.state, "idempotency", None)
+    if store is None:
+        return {}
+    return {f"pereval_idempotency_{key}": value for key, value in store.stats().items()}
+
+
+def _thumbnail_metrics() -> Dict[str, float]:
+    thumbnails = getattr(app.state, "thumbnails", None)
+    if thumbnails is None:
+        return {}
+    return {f"pereval_thumbnails_{key}": value for key, value in thumbnails.stats().items()}
+
+
+def _replica_metrics() -> Dict[str, float]:
+    replicas = getattr(app.state, "replicas", None)
+    if replicas is None:
+        return {}
+    return {f"pereval_db_{key}": value for key, value in replicas.stats().items()}
+
+
+def _user_ids_metrics() -> Dict[str, float]:
+    return {f"pereval_user_ids_{key}": value for key, value in USER_IDS.stats().items()}
+
+
+REGISTRY.collectors += [_pool_metrics, _replica_metrics, _cache_metrics, _cluster_metrics, _user_ids_metrics, _idempotency_metrics, _thumbnail_metrics]
+
+
+def get_db_manager(request: Optional[Request] = None) -> AsyncDatabaseManager:
+    """
+    AsyncDatabaseManager на соединении из общего пула.
+    С request — запрос только читает: он может уйти на реплику (если клиент недавно ничего не записывал).
+    """
+    replicas = getattr(app.state, "replicas", None)
+    if request is not None and replicas is not None:
+        pool = replicas.read_pool(request.cookies)
+        if pool is not None:
+            return AsyncDatabaseManager(pool, fallback=app.state.pool)
+    return AsyncDatabaseManager(app.state.pool)
 
 
 class User(BaseModel):
@@ -58,21 +208,64 @@ class PerevalUpdate(BaseModel):
     coords: Optional[Coords] = None
     level: Optional[Level] = None
     images: Optional[List[Image]] = None
+    version: Optional[int] = None  # ожидаемая версия перевала (вместо заголовка If-Match)
 
 
 class ResponseModel(BaseModel):
     status: int
     message: Optional[str] = None
     id: Optional[int] = None
+    tracking_id: Optional[str] = None  # заявка в очереди отложенной записи (status 202)
+
+
+class SubmissionResponse(BaseModel):
+    tracking_id: str
+    state: str  # queued, processing, done, failed
+    id: Optional[int] = None
+    message: Optional[str] = None
 
 
 class UpdateResponse(BaseModel):
     state: int  # 1 - успех, 0 - ошибка
     message: Optional[str] = None
+    version: Optional[int] = None  # новая версия или текущая при конфликте
+
+
+class ClaimRequest(BaseModel):
+    moderator: str
+    limit: int = 10
+
+
+class StatusRequest(BaseModel):
+    moderator: str
+    ids: List[int]
+    status: str  # accepted, rejected или new (вернуть в очередь)
+
+
+class StatusResponse(BaseModel):
+    updated: List[int]  # перевалы, статус которых изменён
+    skipped: List[int]  # не взяты этим модератором или уже обработаны
+
+
+class SyncResponse(BaseModel):
+    perevals: List[Dict[str, Any]]  # новые и изменённые перевалы целиком
+    deleted: List[int]  # id удалённых перевалов
+    cursor: str  # курсор следующего запроса
+    more: bool  # изменения не поместились в limit — запросить ещё раз сразу
+
+
+class BatchItemResponse(ResponseModel):
+    index: int  # позиция в присланном списке
+
+
+class BatchResponse(BaseModel):
+    status: int
+    message: Optional[str] = None
+    items: List[BatchItemResponse] = []
 
 
 @app.post("/submitData", response_model=ResponseModel)
-async def submit_data(pereval: PerevalData):
+async def submit_data(pereval: PerevalData, response: Response, idempotency_key: Optional[str] = Header(None)):
     try:
         # Проверка обязательных полей
         if not pereval.title or not pereval.user.email:
@@ -82,8 +275,15 @@ async def submit_data(pereval: PerevalData):
                 id=None
             )
 
-        db_manager = DatabaseManager()
-        if not db_manager.connect():
+        if idempotency_key is not None:
+            return await submit_once(idempotency_key, pereval.dict(), response)
+
+        submissions = getattr(app.state, "submissions", None)
+        if submissions is not None:
+            return await enqueue_submission(submissions, pereval.dict(), response)
+
+        db_manager = get_db_manager()
+        if not await db_manager.connect():
             return ResponseModel(
                 status=500,
                 message="Ошибка подключения к базе данных",
@@ -91,8 +291,8 @@ async def submit_data(pereval: PerevalData):
             )
 
         data_dict = pereval.dict()
-        record_id = db_manager.add_pereval(data_dict)
-        db_manager.disconnect()
+        record_id = await db_manager.add_pereval(data_dict)
+        await db_manager.disconnect()
 
         if record_id:
             return ResponseModel(
@@ -115,28 +315,229 @@ async def submit_data(pereval: PerevalData):
         )
 
 
-@app.get("/submitData/{pereval_id}", response_model=Dict[str, Any])
-async def get_pereval(pereval_id: int):
-    """Получить перевал по ID"""
-    db_manager = DatabaseManager()
-    if not db_manager.connect():
+# режим отложенной записи: проверка, постановка в очередь и 202 с tracking_id
+async def enqueue_submission(submissions, data: Dict[str, Any], response: Response) -> ResponseModel:
+    results, _ = validate_batch([data])
+    if results[0] is not None:
+        return ResponseModel(status=400, message=results[0]["message"])
+
+    tracking_id = await submissions.enqueue(data)
+    if tracking_id is None:
+        return ResponseModel(status=500, message="Ошибка постановки в очередь")
+
+    response.status_code = 202
+    response.headers["Location"] = f"/submitData/status/{tracking_id}"
+    return ResponseModel(status=202, message="Принято в обработку", tracking_id=tracking_id)
+
+
+# запрос с Idempotency-Key: повтор получает первый ответ без записи, параллельный дубль ждёт первый запрос
+async def submit_once(key: str, data: Dict[str, Any], response: Response) -> ResponseModel:
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return ResponseModel(status=400, message="Неверный Idempotency-Key")
+
+    store = app.state.idempotency
+    fingerprint = request_fingerprint(data)
+    async with store.lock(key):
+        stored = store.get(key)
+        replayed = stored is not None
+        if stored is None:
+            result = await write_once(key, fingerprint, data, response)
+            if isinstance(result, ResponseModel):
+                return result  # ошибка не запоминается: повтор выполнит запись заново
+            stored, replayed = result
+            store.set(key, stored)
+
+    if stored.fingerprint != fingerprint:
+        response.status_code = 422
+        return ResponseModel(status=422, message="Idempotency-Key уже использован с другими данными")
+
+    response.status_code = stored.status_code
+    response.headers.update(stored.headers)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return ResponseModel(**stored.content)
+
+
+# первая запись по ключу: ответ для повторов и признак того, что ключ уже был использован (в БД)
+async def write_once(key: str, fingerprint: str, data: Dict[str, Any],
+                     response: Response) -> Union[ResponseModel, Tuple[StoredResponse, bool]]:
+    submissions = getattr(app.state, "submissions", None)
+    if submissions is not None:
+        # в очередь ключ не передаётся: повторы отсекает память процесса
+        result = await enqueue_submission(submissions, data, response)
+        if result.status != 202:
+            return result
+        return StoredResponse(fingerprint, 202, result.dict(), {"Location": response.headers["Location"]}), False
+
+    db_manager = get_db_manager()
+    if not await db_manager.connect():
+        return ResponseModel(status=500, message="Ошибка подключения к базе данных")
+    try:
+        result = await db_manager.add_pereval_once(key, fingerprint, data)
+    finally:
+        await db_manager.disconnect()
+
+    if result is None:
+        return ResponseModel(status=500, message="Ошибка при добавлении данных в БД")
+    pereval_id, stored_fingerprint, replayed = result
+    return StoredResponse(stored_fingerprint, 200, {"status": 200, "message": None, "id": pereval_id}), replayed
+
+
+@app.get("/submitData/status/{tracking_id}", response_model=SubmissionResponse)
+async def submission_status(tracking_id: str):
+    """Состояние заявки из очереди отложенной записи; при state=done в id — номер перевала"""
+    submissions = getattr(app.state, "submissions", None)
+    if submissions is None:
+        raise HTTPException(status_code=404, detail="Отложенная запись выключена")
+
+    status = await submissions.status(tracking_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Заявка не найдена")
+    return status
+
+
+@app.post("/submitData/batch", response_model=BatchResponse)
+async def submit_data_batch(perevals: List[PerevalData]):
+    """Добавить пакет перевалов одной транзакцией (синхронизация после офлайна)"""
+    if not perevals:
+        return BatchResponse(status=400, message="Пустой пакет")
+    if len(perevals) > MAX_BATCH_SIZE:
+        return BatchResponse(status=400, message=f"В пакете больше {MAX_BATCH_SIZE} перевалов")
+
+    db_manager = get_db_manager()
+    if not await db_manager.connect():
+        return BatchResponse(status=500, message="Ошибка подключения к базе данных")
+
+    results = await db_manager.add_perevals([p.dict() for p in perevals])
+    await db_manager.disconnect()
+
+    ok = all(r["status"] == 200 for r in results)
+    return BatchResponse(status=200 if ok else 207, items=results)
+
+
+def _parse_sync_cursor(cursor: Optional[str]) -> Tuple[int, int]:
+    if not cursor:
+        return 0, 0
+    try:
+        change_xid, pereval_id = cursor.split(":")
+        return int(change_xid), int(pereval_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный курсор")
+
+
+@app.get("/submitData/sync", response_model=SyncResponse)
+async def sync_user_perevals(
+    user__email: str = Query(..., alias="user__email"),
+    cursor: Optional[str] = Query(None, description="cursor из прошлого ответа; без него — все перевалы"),
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+):
+    """
+    Синхронизация мобильного клиента: перевалы пользователя, созданные, изменённые или сменившие статус
+    после курсора, и id удалённых. Объём ответа зависит от числа изменений, а не от числа перевалов.
+    """
+    after = _parse_sync_cursor(cursor)
+    db_manager = get_db_manager()
+    if not await db_manager.connect():
         raise HTTPException(status_code=500, detail="Ошибка подключения к БД")
 
-    pereval = db_manager.get_pereval(pereval_id)
-    db_manager.disconnect()
+    changes = await db_manager.get_changes(user__email, after, limit)
+    await db_manager.disconnect()
+    if changes is None:
+        raise HTTPException(status_code=500, detail="Ошибка получения изменений")
+
+    docs, deleted, next_cursor, more = changes
+    # документы уже собраны Postgres; остальное дописываем к ним без повторной сериализации
+    body = b"".join([
+        b'{"perevals":', docs,
+        b',"deleted":', encode_json(deleted),
+        b',"cursor":', encode_json(f"{next_cursor[0]}:{next_cursor[1]}"),
+        b',"more":', encode_json(more), b"}",
+    ])
+    return Response(content=body, media_type="application/json")
 
-    if not pereval:
-        raise HTTPException(status_code=404, detail="Перевал не найден")
 
-    return pereval
+FIELDS_QUERY = Query(None, description="поля через запятую (id — всегда), например title,coords; без него — все: "
+                                        + ",".join(PEREVAL_FIELDS))
+
+
+def _parse_fields(fields: Optional[str]) -> Tuple[str, ...]:
+    try:
+        return parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/submitData/{pereval_id}", response_model=Dict[str, Any])
+async def get_pereval(pereval_id: int, request: Request, fields: Optional[str] = FIELDS_QUERY):
+    """Получить перевал по ID (из кэша, с ETag; If-None-Match даёт 304)"""
+    selected = _parse_fields(fields)
+    # в кэше — только полные документы
+    cache = app.state.cache if selected == PEREVAL_FIELDS else None
+    cached = await cache.get(pereval_id) if cache is not None else None
+
+    if cached is None:
+        # кэш заполняется только с основной БД: документ с отставшей реплики жил бы в нём дольше её отставания
+        db_manager = get_db_manager(request if cache is None else None)
+        if not await db_manager.connect():
+            raise HTTPException(status_code=500, detail="Ошибка подключения к БД")
+
+        # документ собирается в Postgres и кэшируется как есть, без разбора в Python
+        body = await db_manager.get_pereval_json(pereval_id, selected)
+        await db_manager.disconnect()
+
+        if body is None:
+            raise HTTPException(status_code=404, detail="Перевал не найден")
+
+        cached = await cache.set_body(pereval_id, body) if cache is not None else CachedPereval(body)
+
+    headers = {"ETag": cached.etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=cached.body, media_type="application/json", headers=headers)
+
+
+# If-None-Match сравнивается слабо: сжатый ответ приходит клиенту с W/ перед тем же ETag
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    strong = [tag[2:] if tag.startswith("W/") else tag for tag in tags + [etag]]
+    return "*" in tags or strong[-1] in strong[:-1]
+
+
+# значение If-Match без W/ и кавычек: версия перевала (3, "3", W/"3") или ETag из GET /submitData/{id}
+def _parse_if_match(header: Optional[str]) -> Optional[str]:
+    if header is None or header.strip() == "*":
+        return None
+    value = header.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    value = value.strip('"')
+    if not value or "," in value:
+        raise HTTPException(status_code=400, detail="If-Match должен содержать версию перевала или его ETag")
+    return value
+
+
+# ожидаемая версия по If-Match и совпал ли ETag: для ETag документа — текущая версия перевала,
+# если документ не изменился с того GET (перевала нет — None, ответ даст update_pereval)
+async def _if_match_version(db_manager, pereval_id: int, tag: str) -> Tuple[Optional[int], bool]:
+    if tag.isdigit():
+        return int(tag), True
+    body = await db_manager.get_pereval_json(pereval_id)
+    if body is None:
+        return None, True
+    return json.loads(body)["version"], CachedPereval(body).etag == f'"{tag}"'
 
 
 @app.patch("/submitData/{pereval_id}", response_model=UpdateResponse)
-async def update_pereval(pereval_id: int, update_data: PerevalUpdate):
-    """Обновить перевал (только если статус 'new')"""
+async def update_pereval(pereval_id: int, update_data: PerevalUpdate, request: Request, response: Response):
+    """Обновить перевал (только если статус 'new'); версия из If-Match или поля version — 412 при конфликте"""
 
     # Получаем dict с переданными полями (без unset)
     update_dict = update_data.dict(exclude_unset=True)
+    version = update_dict.pop("version", None)
+    if_match = _parse_if_match(request.headers.get("if-match"))
 
     # Проверяем что есть хоть одно поле для обновления
     if not update_dict:
@@ -146,28 +547,432 @@ async def update_pereval(pereval_id: int, update_data: PerevalUpdate):
     if 'user' in update_dict:
         return UpdateResponse(state=0, message="Нельзя изменять данные пользователя")
 
-    db_manager = DatabaseManager()
-    if not db_manager.connect():
+    db_manager = get_db_manager()
+    if not await db_manager.connect():
         return UpdateResponse(state=0, message="Ошибка подключения к БД")
 
-    result = db_manager.update_pereval(pereval_id, update_dict)
-    db_manager.disconnect()
+    if if_match is not None:
+        # версия из документа проверяется ещё раз в самом UPDATE — изменение между чтением и записью даст 412
+        version, matches = await _if_match_version(db_manager, pereval_id, if_match)
+        if not matches:
+            await db_manager.disconnect()
+            response.status_code = 412
+            return UpdateResponse(state=0, message=f"Перевал уже изменён, текущая версия: {version}", version=version)
+
+    result = await db_manager.update_pereval(pereval_id, update_dict, version)
+    await db_manager.disconnect()
 
-    return UpdateResponse(state=result['state'], message=result['message'])
+    if result['state'] == 1:
+        await app.state.cache.invalidate(pereval_id)
+    elif result.get('conflict'):
+        response.status_code = 412
+
+    return UpdateResponse(state=result['state'], message=result['message'], version=result.get('version'))
 
 
 
 @app.get("/submitData/", response_model=List[Dict[str, Any]])
-async def get_user_perevals(user__email: str = Query(..., alias="user__email")):
-    """Получить все перевалы пользователя по email"""
-    db_manager = DatabaseManager()
-    if not db_manager.connect():
+async def get_user_perevals(
+    request: Request,
+    user__email: str = Query(..., alias="user__email"),
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: int = Query(0, ge=0, description="id последнего перевала предыдущей страницы"),
+    fields: Optional[str] = FIELDS_QUERY,
+):
+    """
+    Получить перевалы пользователя по email постранично.
+    Курсор следующей страницы возвращается в заголовке X-Next-Cursor.
+    """
+    selected = _parse_fields(fields)
+    db_manager = get_db_manager(request)
+    if not await db_manager.connect():
+        raise HTTPException(status_code=500, detail="Ошибка подключения к БД")
+
+    # страница приходит из Postgres готовым JSON — отдаём байты без валидации и повторной сериализации
+    body, next_id = await db_manager.get_user_perevals_json(user__email, limit=limit, after_id=cursor, fields=selected)
+    await db_manager.disconnect()
+
+    headers = {"X-Next-Cursor": str(next_id)} if next_id is not None else None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/moderation/queue", response_model=List[Dict[str, Any]])
+async def moderation_queue(
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: int = Query(0, ge=0, description="id последнего перевала предыдущей страницы"),
+):
+    """Новые перевалы, ожидающие модерации, по id; курсор следующей страницы — в X-Next-Cursor"""
+    db_manager = get_db_manager()
+    if not await db_manager.connect():
+        raise HTTPException(status_code=500, detail="Ошибка подключения к БД")
+
+    body, next_id = await db_manager.get_moderation_queue(limit=limit, after_id=cursor)
+    await db_manager.disconnect()
+
+    headers = {"X-Next-Cursor": str(next_id)} if next_id is not None else None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.post("/moderation/claim", response_model=List[Dict[str, Any]])
+async def moderation_claim(claim: ClaimRequest):
+    """Взять пачку перевалов на модерацию (статус pending); параллельные модераторы получают разные перевалы"""
+    if not 1 <= claim.limit <= MAX_PAGE_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit должен быть от 1 до {MAX_PAGE_LIMIT}")
+
+    db_manager = get_db_manager()
+    if not await db_manager.connect():
+        raise HTTPException(status_code=500, detail="Ошибка подключения к БД")
+
+    body, ids = await db_manager.claim_perevals(claim.moderator, claim.limit)
+    await db_manager.disconnect()
+
+    for pereval_id in ids:
+        await app.state.cache.invalidate(pereval_id)
+    return Response(content=body, media_type="application/json")
+
+
+@app.post("/moderation/status", response_model=StatusResponse)
+async def moderation_status(request: StatusRequest):
+    """Принять, отклонить или вернуть в очередь взятые модератором перевалы одним запросом"""
+    if request.status not in MODERATION_STATUSES:
+        raise HTTPException(status_code=400, detail="status: " + ", ".join(MODERATION_STATUSES))
+    if not request.ids or len(request.ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"ids: от 1 до {MAX_BATCH_SIZE} перевалов")
+
+    db_manager = get_db_manager()
+    if not await db_manager.connect():
+        raise HTTPException(status_code=500, detail="Ошибка подключения к БД")
+
+    result = await db_manager.set_status(request.ids, request.status, request.moderator)
+    await db_manager.disconnect()
+
+    for pereval_id in result["updated"]:
+        await app.state.cache.invalidate(pereval_id)
+    return StatusResponse(**result)
+
+
+# курсор геопоиска и поиска: "<distance_km или rank>:<id>" последней записи страницы
+def _parse_keyset_cursor(cursor: Optional[str]) -> Optional[Tuple[float, int]]:
+    if not cursor:
+        return None
+    try:
+        distance, pereval_id = cursor.split(":")
+        return float(distance), int(pereval_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный курсор")
+
+
+def _keyset_page(response: Response, found: List[Dict[str, Any]], limit: int, key: str) -> List[Dict[str, Any]]:
+    if len(found) > limit:
+        found = found[:limit]
+        response.headers["X-Next-Cursor"] = f"{found[-1][key]!r}:{found[-1]['id']}"
+    return found
+
+
+@app.get("/stats", response_model=Dict[str, Any])
+async def get_stats(
+    request: Request,
+    days: int = Query(30, ge=1, le=3660, description="сколько последних дней в per_day"),
+    top: int = Query(10, ge=1, le=100, description="сколько пользователей в top_contributors"),
+):
+    """
+    Сводная статистика: перевалы по статусу, по уровню сложности за каждый сезон, по дням (add_time)
+    и самые активные пользователи. Берётся из счётчиков, которые обновляются при каждой записи.
+    """
+    db_manager = get_db_manager(request)
+    if not await db_manager.connect():
+        raise HTTPException(status_code=500, detail="Ошибка подключения к БД")
+
+    body = await db_manager.get_stats_json(days=days, top=top)
+    await db_manager.disconnect()
+
+    if body is None:
+        raise HTTPException(status_code=500, detail="Ошибка получения статистики")
+    return Response(content=body, media_type="application/json")
+
+
+@app.get("/export")
+async def export_catalog(
+    format: str = Query("ndjson", description="ndjson, csv или geojson"),
+    status: Optional[str] = Query(None, description="только перевалы с этим статусом"),
+    since: Optional[date] = Query(None, description="add_time не раньше этой даты"),
+    until: Optional[date] = Query(None, description="add_time не позже этой даты"),
+    images: str = Query("refs", description="refs — ссылки, none — без картинок, inline — содержимое в base64"),
+    fields: Optional[str] = FIELDS_QUERY,
+):
+    """
+    Выгрузка каталога потоком, по возрастанию id: NDJSON, CSV или GeoJSON. Память сервера не зависит
+    от размера каталога. Ошибка посреди выгрузки обрывает ответ.
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format должен быть одним из: {', '.join(EXPORT_FORMATS)}")
+    if status is not None and status not in EXPORT_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status должен быть одним из: {', '.join(EXPORT_STATUSES)}")
+    if images not in EXPORT_IMAGES or (images == "inline" and format == "csv"):
+        raise HTTPException(status_code=400, detail="images: refs, none или inline (inline — только ndjson и geojson)")
+    selected = _parse_fields(fields)
+
+    if app.state.exports >= EXPORT_MAX_RUNNING:
+        raise HTTPException(status_code=503, detail="Слишком много выгрузок, повторите позже")
+    # место занимается до первого await, иначе параллельные запросы пройдут проверку вместе
+    app.state.exports += 1
+    # основная БД: долгое чтение на реплике прерывается конфликтами с репликацией
+    db_manager = get_db_manager()
+    connected = False
+    try:
+        connected = await db_manager.connect()
+    finally:
+        if not connected:
+            app.state.exports -= 1
+    if not connected:
+        raise HTTPException(status_code=500, detail="Ошибка подключения к БД")
+
+    async def body():
+        rows = db_manager.export_perevals(format, selected, status, since, until, images)
+        try:
+            async for chunk in rows:
+                yield chunk
+        finally:
+            app.state.exports -= 1
+            # async for не закрывает прерванный генератор: курсор выгрузки закрывается явно; отмена
+            # (клиент отключился) может прийти и сюда — закрытие и возврат соединения ей не прерываются
+            with anyio.CancelScope(shield=True):
+                try:
+                    await rows.aclose()
+                finally:
+                    await db_manager.disconnect()
+
+    # первая часть — до ответа: ошибка запроса даёт 500, а начатый поток закроется, даже если клиент
+    # отключится раньше, чем ответ начнёт отправляться
+    chunks = body()
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except Exception:
+        raise HTTPException(status_code=500, detail="Ошибка выгрузки каталога")
+
+    async def stream():
+        try:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    # отмена могла застать stream() на отправке, а не внутри генератора: тогда поток закроет фоновая задача,
+    # которую Starlette выполняет и после отключения клиента (повторный aclose ничего не делает)
+    return StreamingResponse(stream(), media_type=EXPORT_MEDIA_TYPES[format], headers={
+        "Content-Disposition": f'attachment; filename="perevals.{format}"',
+    }, background=BackgroundTask(chunks.aclose))
+
+
+@app.get("/perevals/near", response_model=List[Dict[str, Any]])
+async def get_perevals_near(
+    request: Request,
+    response: Response,
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(10, gt=0, le=1000),
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: Optional[str] = None,
+):
+    """Перевалы в радиусе radius_km от точки, ближайшие первыми; следующая страница — X-Next-Cursor"""
+    after = _parse_keyset_cursor(cursor)
+    db_manager = get_db_manager(request)
+    if not await db_manager.connect():
         raise HTTPException(status_code=500, detail="Ошибка подключения к БД")
 
-    perevals = db_manager.get_user_perevals(user__email)
-    db_manager.disconnect()
+    found = await db_manager.get_perevals_near(lat, lon, radius_km, limit=limit + 1, after=after)
+    await db_manager.disconnect()
+
+    return _keyset_page(response, found, limit, "distance_km")
+
+
+@app.get("/perevals/bbox", response_model=List[Dict[str, Any]])
+async def get_perevals_in_bbox(
+    request: Request,
+    response: Response,
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    lat: Optional[float] = Query(None, ge=-90, le=90, description="точка отсчёта расстояния, по умолчанию центр"),
+    lon: Optional[float] = Query(None, ge=-180, le=180),
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: Optional[str] = None,
+):
+    """
+    Перевалы в области просмотра карты, по удалению от точки (lat, lon).
+    Область через 180-й меридиан задаётся min_lon > max_lon.
+    """
+    if min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="min_lat больше max_lat")
+    if lat is None or lon is None:
+        span = (max_lon - min_lon) % 360
+        lat = (min_lat + max_lat) / 2
+        lon = (min_lon + span / 2 + 180) % 360 - 180
+
+    after = _parse_keyset_cursor(cursor)
+    db_manager = get_db_manager(request)
+    if not await db_manager.connect():
+        raise HTTPException(status_code=500, detail="Ошибка подключения к БД")
+
+    found = await db_manager.get_perevals_in_bbox(
+        min_lat, min_lon, max_lat, max_lon, lat, lon, limit=limit + 1, after=after
+    )
+    await db_manager.disconnect()
+
+    return _keyset_page(response, found, limit, "distance_km")
+
+
+@app.get("/perevals/clusters", response_model=List[Dict[str, Any]])
+async def get_perevals_clusters(
+    request: Request,
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    zoom: int = Query(..., ge=0, le=CLUSTER_MAX_ZOOM),
+):
+    """
+    Перевалы в области просмотра карты, собранные в кластеры: центр, число перевалов и несколько id.
+    Кластеры — ячейки тайлов zoom, покрывающих область (8 x 8 на тайл), поэтому могут выходить за её края.
+    Область через 180-й меридиан задаётся min_lon > max_lon. Отдельные перевалы — GET /perevals/bbox.
+    """
+    if min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="min_lat больше max_lat")
+    tiles = cluster_tiles(min_lat, min_lon, max_lat, max_lon, zoom)
+    if len(tiles) > CLUSTER_MAX_TILES:
+        raise HTTPException(status_code=400, detail=f"Область больше {CLUSTER_MAX_TILES} тайлов, увеличьте zoom")
+
+    cache = app.state.clusters
+    found = {tile: cache.get((zoom, *tile)) for tile in tiles}
+    missing = [tile for tile, body in found.items() if body is None]
+    if missing:
+        db_manager = get_db_manager(request)
+        if not await db_manager.connect():
+            raise HTTPException(status_code=500, detail="Ошибка подключения к БД")
+        fetched = await db_manager.get_cluster_tiles(zoom, missing)
+        await db_manager.disconnect()
+
+        if fetched is None:
+            raise HTTPException(status_code=500, detail="Ошибка получения кластеров")
+        for tile, body in fetched.items():
+            cache.set((zoom, *tile), body)
+        found.update(fetched)
+
+    return Response(content=join_cluster_tiles([found[tile] for tile in tiles]), media_type="application/json")
+
+
+@app.get("/perevals/search", response_model=List[Dict[str, Any]])
+async def search_perevals(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    cursor: Optional[str] = None,
+):
+    """Поиск перевалов по названиям (с учётом опечаток), самые релевантные первыми"""
+    after = _parse_keyset_cursor(cursor)
+    db_manager = get_db_manager(request)
+    if not await db_manager.connect():
+        raise HTTPException(status_code=500, detail="Ошибка подключения к БД")
 
-    return perevals
+    found = await db_manager.search_perevals(q, limit=limit + 1, after=after)
+    await db_manager.disconnect()
+
+    return _keyset_page(response, found, limit, "rank")
+
+
+# разбор заголовка Range (один диапазон); None — отдать файл целиком
+def _parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if start:
+            first, last = int(start), int(end) if end else size - 1
+        else:
+            # последние end байт; суффикс длиннее файла — весь файл (RFC 9110, 14.1.2), bytes=-0 — вне файла
+            first, last = max(size - int(end), 0), size - 1
+    except ValueError:
+        return None
+    if first < 0 or first >= size or last < first:
+        raise HTTPException(
+            status_code=416,
+            detail="Диапазон вне файла",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return first, min(last, size - 1)
+
+
+# отдача файла хранилища с Range и ETag
+def _send_blob(store, key: str, etag: str, request: Request, content_type: Optional[str] = None) -> Response:
+    size = store.size(key)
+    # ключ — хэш содержимого, поэтому содержимое по ссылке никогда не меняется
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if content_type is None:
+        with store.open(key) as f:
+            content_type = sniff_content_type(f.read(16))
+
+    byte_range = _parse_range(request.headers.get("range"), size)
+    if byte_range is None:
+        first, last, status_code = 0, size - 1, 200
+    else:
+        (first, last), status_code = byte_range, 206
+        headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+    headers["Content-Length"] = str(last - first + 1)
+
+    return StreamingResponse(
+        store.iter_range(key, first, last),
+        status_code=status_code,
+        media_type=content_type,
+        headers=headers
+    )
+
+
+@app.get("/images/{key}")
+async def get_image(
+    key: str,
+    request: Request,
+    size: Optional[str] = Query(None, description="уменьшенная копия: " + ", ".join(THUMB_SIZES)),
+):
+    """Содержимое картинки по ключу; поддерживает Range и кэширование по ETag"""
+    if size is not None and size not in THUMB_SIZES:
+        raise HTTPException(status_code=400, detail="Неизвестный размер")
+
+    store = get_blob_store()
+    if not is_blob_key(key) or store.size(key) is None:
+        raise HTTPException(status_code=404, detail="Картинка не найдена")
+
+    # копии нет и сделать её нельзя (не картинка, копии выключены) — отдаётся оригинал
+    thumbnails = getattr(app.state, "thumbnails", None)
+    if size is not None and thumbnails is not None and await thumbnails.ensure(key, size):
+        return _send_blob(store.derived(size), key, f'"{key}-{size}"', request, THUMB_CONTENT_TYPE)
+    return _send_blob(store, key, f'"{key}"', request)
+
+
+@app.get("/pool/stats", response_model=Dict[str, Any])
+async def pool_stats():
+    """Статистика пула соединений с БД"""
+    pool = getattr(app.state, "pool", None)
+    if pool is None:
+        raise HTTPException(status_code=503, detail="Пул соединений не создан")
+    return pool.get_stats()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,254 @@
+"""
+Метрики приложения в текстовом формате Prometheus (GET /metrics).
+
+- запросы по маршрутам: число по статусам, гистограмма времени, размеры тела запроса и ответа;
+- методы DatabaseManager/AsyncDatabaseManager: число вызовов и гистограмма времени;
+- состояние пула соединений и кэша снимается в момент запроса /metrics.
+
+Запись одного наблюдения — несколько операций со словарём и bisect, без внешних зависимостей,
+поэтому метрики можно держать включёнными под нагрузкой.
+"""
+import time
+import asyncio
+import inspect
+import logging
+import functools
+import threading
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("pereval.metrics")
+
+# границы корзин, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# границы корзин, байты
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: счётчики, сумма и общее число"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Хранилище метрик процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.request_seconds: Dict[Tuple[str, str], Histogram] = {}
+        self.request_bytes: Dict[Tuple[str, str], Histogram] = {}
+        self.response_bytes: Dict[Tuple[str, str], Histogram] = {}
+        self.in_progress = 0
+        self.db_calls: Dict[Tuple[str, str], int] = {}
+        self.db_seconds: Dict[Tuple[str, str], Histogram] = {}
+        # функции, возвращающие {имя метрики: значение} на момент запроса /metrics
+        self.collectors: List[Callable[[], Dict[str, float]]] = []
+
+    @staticmethod
+    def _histogram(table: Dict, key, buckets) -> Histogram:
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram(buckets)
+        return histogram
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float,
+                        request_size: Optional[int], response_size: int):
+        key = (method, route)
+        with self._lock:
+            self.requests[(method, route, status)] = self.requests.get((method, route, status), 0) + 1
+            self._histogram(self.request_seconds, key, LATENCY_BUCKETS).observe(seconds)
+            if request_size is not None:
+                self._histogram(self.request_bytes, key, SIZE_BUCKETS).observe(request_size)
+            self._histogram(self.response_bytes, key, SIZE_BUCKETS).observe(response_size)
+
+    def observe_db(self, manager: str, method: str, seconds: float):
+        key = (manager, method)
+        with self._lock:
+            self.db_calls[key] = self.db_calls.get(key, 0) + 1
+            self._histogram(self.db_seconds, key, LATENCY_BUCKETS).observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            for table in (self.requests, self.request_seconds, self.request_bytes, self.response_bytes,
+                          self.db_calls, self.db_seconds):
+                table.clear()
+
+    # текст для GET /metrics
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            _counter(lines, "pereval_http_requests_total", "Запросы по маршрутам и статусам",
+                     (({"method": m, "route": r, "status": s}, v) for (m, r, s), v in self.requests.items()))
+            _gauge(lines, "pereval_http_requests_in_progress", "Запросы в обработке", [({}, self.in_progress)])
+            _histograms(lines, "pereval_http_request_duration_seconds", "Время обработки запроса",
+                        ("method", "route"), self.request_seconds)
+            _histograms(lines, "pereval_http_request_size_bytes", "Размер тела запроса",
+                        ("method", "route"), self.request_bytes)
+            _histograms(lines, "pereval_http_response_size_bytes", "Размер тела ответа",
+                        ("method", "route"), self.response_bytes)
+            _counter(lines, "pereval_db_calls_total", "Вызовы методов слоя БД",
+                     (({"manager": a, "method": m}, v) for (a, m), v in self.db_calls.items()))
+            _histograms(lines, "pereval_db_call_duration_seconds", "Время вызова метода слоя БД",
+                        ("manager", "method"), self.db_seconds)
+
+        for collect in self.collectors:
+            try:
+                values = collect()
+            except Exception:
+                logger.exception("Ошибка сбора метрик")
+                continue
+            for name, value in values.items():
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _counter(lines: List[str], name: str, help_text: str, samples: Iterable):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} counter")
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+
+def _gauge(lines: List[str], name: str, help_text: str, samples: Iterable):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} gauge")
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+
+def _histograms(lines: List[str], name: str, help_text: str, label_names: Tuple[str, ...],
+                table: Dict[Tuple, Histogram]):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for key, histogram in table.items():
+        labels = dict(zip(label_names, key))
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _number(bound)
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': le})} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {_number(histogram.sum)}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+
+REGISTRY = Registry()
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: время, статус и размеры каждого HTTP-запроса по шаблону маршрута"""
+
+    def __init__(self, app, registry: Registry = REGISTRY):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+        response_size = 0
+        request_size = None
+        for name, value in scope.get("headers", ()):
+            if name == b"content-length":
+                # заголовок присылает клиент: некорректное значение — без метрики размера, а не 500
+                try:
+                    request_size = int(value)
+                except ValueError:
+                    pass
+                break
+
+        async def send_wrapper(message):
+            nonlocal status, response_size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        self.registry.in_progress += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.registry.in_progress -= 1
+            # шаблон маршрута (/submitData/{pereval_id}), а не сам путь — иначе метрик будет по числу id
+            route = scope.get("route")
+            path = route.path if route is not None else "<unmatched>"
+            self.registry.observe_request(scope["method"], path, status, time.perf_counter() - started,
+                                          request_size, response_size)
+
+
+# замер времени публичных методов класса слоя БД; manager — метка ("sync" или "async")
+def instrument_db(manager: str, registry: Registry = REGISTRY):
+    def decorate(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith("_") or not callable(method):
+                continue
+            setattr(cls, name, _timed(method, manager, name, registry))
+        return cls
+    return decorate
+
+
+def _timed(method, manager: str, name: str, registry: Registry):
+    if asyncio.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                registry.observe_db(manager, name, time.perf_counter() - started)
+        return async_wrapper
+
+    # потоковые методы (выгрузка): время — до конца потока
+    if inspect.isasyncgenfunction(method):
+        @functools.wraps(method)
+        async def async_gen_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            items = method(*args, **kwargs)
+            try:
+                async for item in items:
+                    yield item
+            finally:
+                # прерванный поток закрывается сразу, а не при сборке мусора
+                await items.aclose()
+                registry.observe_db(manager, name, time.perf_counter() - started)
+        return async_gen_wrapper
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            registry.observe_db(manager, name, time.perf_counter() - started)
+    return wrapper
@@ -0,0 +1,506 @@
+"""
+Версионированные миграции схемы БД.
+
+Применяются один раз при старте приложения (FSTR_DB_MIGRATE_ON_STARTUP=1, по умолчанию)
+или вручную:
+    python migrations.py            # применить все новые миграции
+    python migrations.py --status   # показать применённые и ожидающие
+"""
+import sys
+import argparse
+from typing import List, Tuple
+
+import psycopg2
+
+from database import db_params
+
+# рабочие процессы, стартующие одновременно, применяют миграции по очереди
+MIGRATIONS_LOCK_ID = 48_0001
+
+# (версия, описание, SQL); уже выпущенные миграции не меняем — только добавляем новые
+MIGRATIONS: List[Tuple[int, str, str]] = [
+    (1, "начальная схема", """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            email TEXT UNIQUE NOT NULL,
+            fam TEXT,
+            name TEXT,
+            otc TEXT,
+            phone TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS coords (
+            id SERIAL PRIMARY KEY,
+            latitude DOUBLE PRECISION,
+            longitude DOUBLE PRECISION,
+            height INTEGER
+        );
+
+        CREATE TABLE IF NOT EXISTS pereval_added (
+            id SERIAL PRIMARY KEY,
+            beauty_title TEXT,
+            title TEXT,
+            other_titles TEXT,
+            connect TEXT,
+            add_time TIMESTAMP,
+            user_id INTEGER REFERENCES users(id),
+            coord_id INTEGER REFERENCES coords(id),
+            level_winter TEXT,
+            level_summer TEXT,
+            level_autumn TEXT,
+            level_spring TEXT,
+            status TEXT DEFAULT 'new'
+        );
+
+        CREATE TABLE IF NOT EXISTS images (
+            id SERIAL PRIMARY KEY,
+            pereval_id INTEGER REFERENCES pereval_added(id) ON DELETE CASCADE,
+            data TEXT,
+            title TEXT
+        );
+    """),
+    (2, "индексы для списка перевалов пользователя, картинок и статуса", """
+        CREATE INDEX IF NOT EXISTS pereval_added_user_id_idx ON pereval_added (user_id);
+        CREATE INDEX IF NOT EXISTS images_pereval_id_idx ON images (pereval_id);
+        CREATE INDEX IF NOT EXISTS pereval_added_status_idx ON pereval_added (status);
+    """),
+    (3, "составной индекс для постраничного списка перевалов пользователя", """
+        CREATE INDEX IF NOT EXISTS pereval_added_user_id_id_idx ON pereval_added (user_id, id);
+        DROP INDEX IF EXISTS pereval_added_user_id_idx;
+    """),
+    (4, "метаданные картинок и ссылка на содержимое в хранилище", """
+        ALTER TABLE images
+            ADD COLUMN IF NOT EXISTS blob_key TEXT,
+            ADD COLUMN IF NOT EXISTS size INTEGER,
+            ADD COLUMN IF NOT EXISTS content_type TEXT;
+    """),
+    (5, "точка координат с GiST-индексом для поиска по местности", """
+        ALTER TABLE coords
+            ADD COLUMN IF NOT EXISTS geo point
+            GENERATED ALWAYS AS (point(longitude, latitude)) STORED;
+        CREATE INDEX IF NOT EXISTS coords_geo_idx ON coords USING gist (geo);
+        CREATE INDEX IF NOT EXISTS pereval_added_coord_id_idx ON pereval_added (coord_id);
+    """),
+    (6, "полнотекстовый поиск по названиям и словарь слов для исправления опечаток", """
+        ALTER TABLE pereval_added
+            ADD COLUMN IF NOT EXISTS search_tsv tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('russian', coalesce(title, '')), 'A')
+                || setweight(to_tsvector('russian', coalesce(other_titles, '')), 'B')
+                || setweight(to_tsvector('russian', coalesce(beauty_title, '')), 'C')
+            ) STORED;
+        CREATE INDEX IF NOT EXISTS pereval_added_search_idx ON pereval_added USING gin (search_tsv);
+
+        -- словарь слов из названий и их триграммы (как в pg_trgm, но без расширения)
+        CREATE TABLE IF NOT EXISTS search_words (
+            word TEXT PRIMARY KEY,
+            trigram_count INTEGER NOT NULL
+        );
+        -- trigram_count в ключе: похожие слова ищутся только среди слов подходящей длины
+        CREATE TABLE IF NOT EXISTS search_word_trigrams (
+            trigram TEXT NOT NULL,
+            trigram_count INTEGER NOT NULL,
+            word TEXT NOT NULL REFERENCES search_words (word) ON DELETE CASCADE,
+            PRIMARY KEY (trigram, trigram_count, word)
+        );
+
+        CREATE OR REPLACE FUNCTION search_trigrams(word TEXT) RETURNS SETOF TEXT
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT DISTINCT substr('  ' || word || ' ', i, 3) FROM generate_series(1, length(word) + 1) i
+        $$;
+
+        CREATE OR REPLACE FUNCTION search_words_of(source TEXT) RETURNS SETOF TEXT
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT DISTINCT w
+            FROM regexp_split_to_table(translate(lower(coalesce(source, '')), 'ё', 'е'), '[^[:alnum:]]+') w
+            WHERE length(w) >= 3 AND w !~ '^[0-9]+$'
+        $$;
+
+        CREATE OR REPLACE FUNCTION search_words_add(source TEXT) RETURNS void
+        LANGUAGE sql AS $$
+            WITH added AS (
+                INSERT INTO search_words (word, trigram_count)
+                SELECT w, (SELECT count(*) FROM search_trigrams(w)) FROM search_words_of(source) w
+                ON CONFLICT (word) DO NOTHING
+                RETURNING word, trigram_count
+            )
+            INSERT INTO search_word_trigrams (trigram, trigram_count, word)
+            SELECT t, added.trigram_count, added.word FROM added, LATERAL search_trigrams(added.word) t
+        $$;
+
+        -- вставка (в том числе пакетная) — один вызов на оператор
+        CREATE OR REPLACE FUNCTION pereval_added_search_words_insert() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM search_words_add(string_agg(concat_ws(' ', beauty_title, title, other_titles), ' '))
+            FROM new_rows;
+            RETURN NULL;
+        END $$;
+
+        CREATE OR REPLACE FUNCTION pereval_added_search_words_update() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM search_words_add(concat_ws(' ', NEW.beauty_title, NEW.title, NEW.other_titles));
+            RETURN NULL;
+        END $$;
+
+        DROP TRIGGER IF EXISTS search_words_insert ON pereval_added;
+        CREATE TRIGGER search_words_insert AFTER INSERT ON pereval_added
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION pereval_added_search_words_insert();
+
+        DROP TRIGGER IF EXISTS search_words_update ON pereval_added;
+        CREATE TRIGGER search_words_update AFTER UPDATE OF beauty_title, title, other_titles ON pereval_added
+            FOR EACH ROW EXECUTE FUNCTION pereval_added_search_words_update();
+
+        SELECT search_words_add(string_agg(concat_ws(' ', beauty_title, title, other_titles), ' '))
+        FROM pereval_added;
+    """),
+    (7, "версия перевала для оптимистичной блокировки при правке", """
+        ALTER TABLE pereval_added ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+    """),
+    (8, "очередь модерации: кто и когда взял перевал, частичные индексы очереди", """
+        ALTER TABLE pereval_added
+            ADD COLUMN IF NOT EXISTS claimed_by TEXT,
+            ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ;
+        CREATE INDEX IF NOT EXISTS pereval_added_new_idx ON pereval_added (id) WHERE status = 'new';
+        CREATE INDEX IF NOT EXISTS pereval_added_pending_idx ON pereval_added (claimed_at) WHERE status = 'pending';
+    """),
+    (9, "очередь отложенной записи POST /submitData", """
+        CREATE TABLE IF NOT EXISTS submissions (
+            id TEXT PRIMARY KEY,
+            payload JSONB,
+            state TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            pereval_id INTEGER,
+            message TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            claimed_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ
+        );
+        CREATE INDEX IF NOT EXISTS submissions_queued_idx ON submissions (created_at) WHERE state = 'queued';
+        CREATE INDEX IF NOT EXISTS submissions_processing_idx ON submissions (claimed_at) WHERE state = 'processing';
+    """),
+    (10, "ключи идемпотентности POST /submitData", """
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            pereval_id INTEGER,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS idempotency_keys_created_idx ON idempotency_keys (created_at);
+    """),
+    (11, "время изменения и журнал удалений для синхронизации мобильных клиентов", """
+        ALTER TABLE coords ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+        ALTER TABLE images ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+        -- change_xid — транзакция последнего изменения: по ней синхронизация не пропускает
+        -- изменения транзакций, зафиксированных позже начатых после них
+        ALTER TABLE pereval_added
+            ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+        CREATE INDEX IF NOT EXISTS pereval_added_user_changes_idx ON pereval_added (user_id, change_xid, id);
+
+        CREATE TABLE IF NOT EXISTS pereval_tombstones (
+            pereval_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            change_xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+            deleted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS pereval_tombstones_user_changes_idx
+            ON pereval_tombstones (user_id, change_xid, pereval_id);
+
+        -- удаление любым путём оставляет запись для клиентов, которые уже получили перевал
+        CREATE OR REPLACE FUNCTION pereval_added_tombstones() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO pereval_tombstones (pereval_id, user_id)
+            SELECT id, user_id FROM old_rows WHERE user_id IS NOT NULL
+            ON CONFLICT (pereval_id) DO NOTHING;
+            RETURN NULL;
+        END $$;
+
+        DROP TRIGGER IF EXISTS tombstones_delete ON pereval_added;
+        CREATE TRIGGER tombstones_delete AFTER DELETE ON pereval_added
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION pereval_added_tombstones();
+    """),
+    (12, "сводная статистика, обновляемая триггерами", """
+        -- счётчики по статусу (status), уровню сложности за сезон (level_*) и дню add_time (day).
+        -- Строка счётчика делится на 16 частей по соединению: параллельные вставки не ждут блокировку
+        -- одной строки; значение — сумма частей
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            metric TEXT NOT NULL,
+            key TEXT NOT NULL,
+            shard SMALLINT NOT NULL,
+            n BIGINT NOT NULL,
+            PRIMARY KEY (metric, key, shard)
+        );
+
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id),
+            perevals INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS user_stats_top_idx ON user_stats (perevals DESC, user_id);
+
+        -- счётчики, в которые входит перевал (пустой уровень и add_time не считаются)
+        CREATE OR REPLACE FUNCTION pereval_stats_keys(p pereval_added) RETURNS TABLE (metric TEXT, key TEXT)
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT * FROM (VALUES ('status', p.status),
+                                  ('level_winter', p.level_winter), ('level_summer', p.level_summer),
+                                  ('level_autumn', p.level_autumn), ('level_spring', p.level_spring),
+                                  ('day', p.add_time::date::text)) AS k(metric, key)
+            WHERE k.key <> ''
+        $$;
+
+        -- добавленные строки считаются с +1, удалённые с -1; при правке без изменения счётчиков
+        -- суммы нулевые и ничего не пишется. Строки счётчиков обновляются в порядке ключа — без взаимоблокировок
+        CREATE OR REPLACE FUNCTION pereval_stats_apply(added pereval_added[], removed pereval_added[]) RETURNS void
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            WITH changed AS (
+                SELECT r AS p, 1 AS d FROM unnest(added) r
+                UNION ALL
+                SELECT r AS p, -1 AS d FROM unnest(removed) r
+            )
+            INSERT INTO stats_counters AS s (metric, key, shard, n)
+            SELECT k.metric, k.key, pg_backend_pid() % 16, sum(c.d)
+            FROM changed c, pereval_stats_keys(c.p) k
+            GROUP BY k.metric, k.key
+            HAVING sum(c.d) <> 0
+            ORDER BY k.metric, k.key
+            ON CONFLICT (metric, key, shard) DO UPDATE SET n = s.n + EXCLUDED.n;
+
+            INSERT INTO user_stats AS s (user_id, perevals)
+            SELECT r.user_id, sum(r.d)
+            FROM (SELECT user_id, 1 AS d FROM unnest(added)
+                  UNION ALL
+                  SELECT user_id, -1 AS d FROM unnest(removed)) r
+            WHERE r.user_id IS NOT NULL
+            GROUP BY r.user_id
+            HAVING sum(r.d) <> 0
+            ORDER BY r.user_id
+            ON CONFLICT (user_id) DO UPDATE SET perevals = s.perevals + EXCLUDED.perevals;
+        END $$;
+
+        CREATE OR REPLACE FUNCTION pereval_added_stats() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM pereval_stats_apply(ARRAY(SELECT r::pereval_added FROM new_rows r), '{}');
+            ELSIF TG_OP = 'UPDATE' THEN
+                PERFORM pereval_stats_apply(ARRAY(SELECT r::pereval_added FROM new_rows r),
+                                            ARRAY(SELECT r::pereval_added FROM old_rows r));
+            ELSE
+                PERFORM pereval_stats_apply('{}', ARRAY(SELECT r::pereval_added FROM old_rows r));
+            END IF;
+            RETURN NULL;
+        END $$;
+
+        -- триггеры создаются до подсчёта: блокировка таблицы до конца миграции, параллельные записи не теряются
+        DROP TRIGGER IF EXISTS stats_insert ON pereval_added;
+        CREATE TRIGGER stats_insert AFTER INSERT ON pereval_added
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION pereval_added_stats();
+        DROP TRIGGER IF EXISTS stats_update ON pereval_added;
+        CREATE TRIGGER stats_update AFTER UPDATE ON pereval_added
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION pereval_added_stats();
+        DROP TRIGGER IF EXISTS stats_delete ON pereval_added;
+        CREATE TRIGGER stats_delete AFTER DELETE ON pereval_added
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION pereval_added_stats();
+
+        TRUNCATE stats_counters, user_stats;
+        INSERT INTO stats_counters (metric, key, shard, n)
+        SELECT k.metric, k.key, 0, count(*) FROM pereval_added p, pereval_stats_keys(p) k GROUP BY k.metric, k.key;
+        INSERT INTO user_stats (user_id, perevals)
+        SELECT user_id, count(*) FROM pereval_added WHERE user_id IS NOT NULL GROUP BY user_id;
+    """),
+    (13, "сетка кластеров для карты по уровням масштаба", """
+        -- число перевалов и сумма координат (для центра) в ячейке сетки уровня zoom; части (shard) — как у
+        -- stats_counters: параллельные вставки в одной местности не ждут друг друга на крупных уровнях
+        CREATE TABLE IF NOT EXISTS cluster_cells (
+            zoom SMALLINT NOT NULL,
+            cx INTEGER NOT NULL,
+            cy INTEGER NOT NULL,
+            shard SMALLINT NOT NULL,
+            n INTEGER NOT NULL,
+            sum_lat DOUBLE PRECISION NOT NULL,
+            sum_lon DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (zoom, cx, cy, shard)
+        );
+
+        -- ячейки точки на уровнях 0..14: тайл Web Mercator уровня zoom делится на 8 x 8 ячеек
+        CREATE OR REPLACE FUNCTION cluster_cells_of(latitude DOUBLE PRECISION, longitude DOUBLE PRECISION)
+        RETURNS TABLE (zoom INTEGER, cx INTEGER, cy INTEGER)
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT z,
+                   least(greatest(floor(m.x * 2 ^ (z + 3)), 0), 2 ^ (z + 3) - 1)::int,
+                   least(greatest(floor(m.y * 2 ^ (z + 3)), 0), 2 ^ (z + 3) - 1)::int
+            FROM (SELECT (longitude + 180) / 360 AS x,
+                         (1 - ln(tan(radians(l.lat)) + 1 / cos(radians(l.lat))) / pi()) / 2 AS y
+                  FROM (SELECT least(greatest(latitude, -85.0511), 85.0511) AS lat) l) m,
+                 generate_series(0, 14) z
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        $$;
+
+        DO $$ BEGIN
+            CREATE TYPE cluster_point AS (latitude DOUBLE PRECISION, longitude DOUBLE PRECISION);
+        EXCEPTION WHEN duplicate_object THEN NULL;
+        END $$;
+
+        -- добавленные точки считаются с +1, убранные с -1; строки обновляются в порядке ключа.
+        -- Общий план: иначе запрос с массивами-параметрами планируется заново при каждой вставке
+        CREATE OR REPLACE FUNCTION cluster_cells_apply(added cluster_point[], removed cluster_point[]) RETURNS void
+        LANGUAGE plpgsql SET plan_cache_mode = force_generic_plan AS $$
+        BEGIN
+            INSERT INTO cluster_cells AS s (zoom, cx, cy, shard, n, sum_lat, sum_lon)
+            SELECT k.zoom, k.cx, k.cy, pg_backend_pid() % 16, sum(p.d), sum(p.d * p.latitude), sum(p.d * p.longitude)
+            FROM (SELECT a.latitude, a.longitude, 1 AS d FROM unnest(added) a
+                  UNION ALL
+                  SELECT r.latitude, r.longitude, -1 AS d FROM unnest(removed) r) p,
+                 cluster_cells_of(p.latitude, p.longitude) k
+            GROUP BY k.zoom, k.cx, k.cy
+            HAVING sum(p.d) <> 0 OR sum(p.d * p.latitude) <> 0 OR sum(p.d * p.longitude) <> 0
+            ORDER BY k.zoom, k.cx, k.cy
+            ON CONFLICT (zoom, cx, cy, shard) DO UPDATE
+            SET n = s.n + EXCLUDED.n, sum_lat = s.sum_lat + EXCLUDED.sum_lat, sum_lon = s.sum_lon + EXCLUDED.sum_lon;
+        END $$;
+
+        -- добавление и удаление перевала (coord_id перевала не меняется)
+        CREATE OR REPLACE FUNCTION pereval_added_clusters() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM cluster_cells_apply(ARRAY(
+                    SELECT ROW(c.latitude, c.longitude)::cluster_point
+                    FROM new_rows p JOIN coords c ON c.id = p.coord_id
+                ), '{}');
+            ELSE
+                PERFORM cluster_cells_apply('{}', ARRAY(
+                    SELECT ROW(c.latitude, c.longitude)::cluster_point
+                    FROM old_rows p JOIN coords c ON c.id = p.coord_id
+                ));
+            END IF;
+            RETURN NULL;
+        END $$;
+
+        -- новые координаты перевала (правка через PATCH)
+        CREATE OR REPLACE FUNCTION coords_clusters() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM cluster_cells_apply(
+                ARRAY(SELECT ROW(n.latitude, n.longitude)::cluster_point
+                      FROM new_rows n JOIN old_rows o ON o.id = n.id JOIN pereval_added p ON p.coord_id = n.id
+                      WHERE (n.latitude, n.longitude) IS DISTINCT FROM (o.latitude, o.longitude)),
+                ARRAY(SELECT ROW(o.latitude, o.longitude)::cluster_point
+                      FROM new_rows n JOIN old_rows o ON o.id = n.id JOIN pereval_added p ON p.coord_id = n.id
+                      WHERE (n.latitude, n.longitude) IS DISTINCT FROM (o.latitude, o.longitude))
+            );
+            RETURN NULL;
+        END $$;
+
+        DROP TRIGGER IF EXISTS clusters_insert ON pereval_added;
+        CREATE TRIGGER clusters_insert AFTER INSERT ON pereval_added
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION pereval_added_clusters();
+        DROP TRIGGER IF EXISTS clusters_delete ON pereval_added;
+        CREATE TRIGGER clusters_delete AFTER DELETE ON pereval_added
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION pereval_added_clusters();
+        DROP TRIGGER IF EXISTS clusters_update ON coords;
+        CREATE TRIGGER clusters_update AFTER UPDATE ON coords
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION coords_clusters();
+
+        TRUNCATE cluster_cells;
+        INSERT INTO cluster_cells (zoom, cx, cy, shard, n, sum_lat, sum_lon)
+        SELECT k.zoom, k.cx, k.cy, 0, count(*), sum(c.latitude), sum(c.longitude)
+        FROM pereval_added p
+        JOIN coords c ON c.id = p.coord_id,
+        LATERAL cluster_cells_of(c.latitude, c.longitude) k
+        GROUP BY k.zoom, k.cx, k.cy;
+    """),
+]
+
+
+# версии, уже применённые к базе
+def applied_versions(cursor) -> List[int]:
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations ORDER BY version")
+    return [r[0] for r in cursor.fetchall()]
+
+
+# применение новых миграций, каждая в своей транзакции; возвращает применённые версии
+def migrate(connection) -> List[int]:
+    cursor = connection.cursor()
+    applied = []
+    try:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+        done = set(applied_versions(cursor))
+        connection.commit()
+
+        for version, name, sql in MIGRATIONS:
+            if version in done:
+                continue
+            try:
+                cursor.execute(sql)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                    (version, name)
+                )
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            applied.append(version)
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+        connection.commit()
+        cursor.close()
+
+    return applied
+
+
+# применение миграций на отдельном соединении (старт приложения, CLI)
+def migrate_database() -> List[int]:
+    connection = psycopg2.connect(**db_params())
+    try:
+        return migrate(connection)
+    finally:
+        connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Миграции схемы БД перевалов")
+    parser.add_argument("--status", action="store_true", help="показать состояние миграций")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        connection = psycopg2.connect(**db_params())
+        try:
+            with connection.cursor() as cursor:
+                done = set(applied_versions(cursor))
+            connection.commit()
+        finally:
+            connection.close()
+        for version, name, _ in MIGRATIONS:
+            mark = "x" if version in done else " "
+            print(f"[{mark}] {version:04d} {name}")
+        return 0
+
+    applied = migrate_database()
+    if applied:
+        print("Применены миграции: " + ", ".join(str(v) for v in applied))
+    else:
+        print("Схема БД актуальна")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
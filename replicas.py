@@ -0,0 +1,190 @@
+"""
+Чтение с реплик.
+
+FSTR_DB_REPLICA_HOSTS — реплики через запятую (host или host:port; логин, пароль и имя БД — как у основной).
+Запросы, которые только читают (список перевалов пользователя, поиск, выборка полей перевала), уходят на
+реплику; запись и всё, что должно видеть последние изменения (синхронизация, модерация, заполнение кэша),
+— на основную БД.
+
+Каждые FSTR_DB_REPLICA_CHECK секунд (по умолчанию 2) проверяется отставание реплик: реплика, которая
+не отвечает, не в режиме восстановления или отстала больше FSTR_DB_REPLICA_MAX_LAG секунд (по умолчанию 5),
+не используется, пока не догонит. Нет здоровых реплик — чтение идёт на основную БД.
+
+Клиент должен видеть свою запись: ответ на POST/PATCH/PUT/DELETE ставит cookie на время MAX_LAG + CHECK,
+и пока она есть, чтения клиента идут на основную БД. Любая используемая реплика отстаёт меньше этого времени.
+"""
+import os
+import asyncio
+import logging
+import itertools
+from typing import Any, Dict, List, Optional
+
+from psycopg_pool import AsyncConnectionPool
+
+from async_database import create_async_pool
+from database import replica_params
+
+logger = logging.getLogger("pereval.replicas")
+
+REPLICA_MAX_LAG = float(os.getenv("FSTR_DB_REPLICA_MAX_LAG", "5"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("FSTR_DB_REPLICA_CHECK", "2"))
+# сколько ждать соединение с репликой, прежде чем уйти на основную БД
+REPLICA_TIMEOUT = float(os.getenv("FSTR_DB_REPLICA_TIMEOUT", "1"))
+
+PRIMARY_COOKIE = "fstr_primary"
+WRITE_METHODS = ("POST", "PATCH", "PUT", "DELETE")
+
+PRIMARY_LSN_SQL = "SELECT pg_current_wal_lsn()"
+
+# отставание реплики в секундах: 0 — проиграно всё, что было на основной к началу проверки; иначе —
+# время с последней проигранной транзакции (оценка сверху). Вне восстановления реплика не используется.
+REPLICA_LAG_SQL = """
+    SELECT
+        pg_is_in_recovery(),
+        CASE WHEN pg_last_wal_replay_lsn() >= %s::pg_lsn THEN 0
+             ELSE COALESCE(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 'Infinity')
+        END::float8
+"""
+
+
+class Replica:
+    """Пул соединений с репликой и результат последней проверки"""
+
+    def __init__(self, name: str, pool: AsyncConnectionPool):
+        self.name = name
+        self.pool = pool
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.failures = 0
+
+
+class ReplicaSet:
+    """Реплики для чтения: проверка отставания в фоне и выбор реплики на запрос"""
+
+    def __init__(self, primary: AsyncConnectionPool, replicas: List[Replica],
+                 max_lag: float = REPLICA_MAX_LAG, check_interval: float = REPLICA_CHECK_INTERVAL):
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._next = itertools.cycle(range(len(replicas)))
+        self._task: Optional[asyncio.Task] = None
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.pinned_reads = 0
+
+    # время, на которое чтения клиента после записи закрепляются за основной БД
+    @property
+    def pin_seconds(self) -> int:
+        return int(self.max_lag + self.check_interval) + 1
+
+    async def start(self):
+        # соединения открываются в фоне: недоступная реплика не задерживает старт
+        for replica in self.replicas:
+            await replica.pool.open(wait=False)
+        await self.check()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for replica in self.replicas:
+            await replica.pool.close()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check()
+
+    # одна проверка всех реплик
+    async def check(self):
+        try:
+            async with self.primary.connection() as conn:
+                primary_lsn = (await (await conn.execute(PRIMARY_LSN_SQL)).fetchone())[0]
+        except Exception:
+            logger.exception("Ошибка проверки реплик: основная БД недоступна")
+            return
+        await asyncio.gather(*(self._check_replica(replica, primary_lsn) for replica in self.replicas))
+
+    async def _check_replica(self, replica: Replica, primary_lsn: str):
+        try:
+            async with replica.pool.connection(timeout=self.check_interval) as conn:
+                cursor = await asyncio.wait_for(conn.execute(REPLICA_LAG_SQL, (primary_lsn,)), self.check_interval)
+                in_recovery, lag = await cursor.fetchone()
+        except Exception as e:
+            if replica.healthy:
+                logger.warning("Реплика %s недоступна: %s", replica.name, e)
+            replica.healthy, replica.lag = False, None
+            replica.failures += 1
+            return
+
+        healthy = bool(in_recovery) and lag <= self.max_lag
+        if healthy != replica.healthy:
+            logger.info("Реплика %s %s (отставание %.1f с)", replica.name,
+                        "используется" if healthy else "исключена", lag)
+        replica.healthy, replica.lag = healthy, lag
+
+    # пул для чтения: здоровая реплика по кругу или None — читать с основной БД
+    def read_pool(self, cookies: Dict[str, str]) -> Optional[AsyncConnectionPool]:
+        if PRIMARY_COOKIE in cookies:
+            self.pinned_reads += 1
+            return None
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._next)]
+            if replica.healthy:
+                self.replica_reads += 1
+                return replica.pool
+        self.primary_reads += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "replicas": len(self.replicas),
+            "healthy": sum(r.healthy for r in self.replicas),
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "pinned_reads": self.pinned_reads,
+        }
+        for i, replica in enumerate(self.replicas):
+            stats[f"replica{i}_healthy"] = int(replica.healthy)
+            stats[f"replica{i}_lag_seconds"] = replica.lag if replica.lag is not None else -1
+            stats[f"replica{i}_check_failures"] = replica.failures
+        return stats
+
+
+class PrimaryAfterWriteMiddleware:
+    """ASGI-middleware: после успешной записи чтения клиента на время закрепляются за основной БД"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in WRITE_METHODS:
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                replicas = getattr(scope["app"].state, "replicas", None)
+                if replicas is not None:
+                    cookie = f"{PRIMARY_COOKIE}=1; Max-Age={replicas.pin_seconds}; Path=/; HttpOnly; SameSite=Lax"
+                    headers = [*message.get("headers", ()), (b"set-cookie", cookie.encode("latin-1"))]
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+# реплики по настройкам из .env; None — реплики не заданы
+def create_replica_set(primary: AsyncConnectionPool) -> Optional[ReplicaSet]:
+    params = replica_params()
+    if not params:
+        return None
+    replicas = [
+        Replica(f"{p['host']}:{p['port']}", create_async_pool(p, timeout=REPLICA_TIMEOUT))
+        for p in params
+    ]
+    return ReplicaSet(primary, replicas)
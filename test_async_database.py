@@ -0,0 +1,233 @@
+import os
+import csv
+import json
+import uuid
+import asyncio
+import httpx
+from async_database import AsyncDatabaseManager, create_async_pool
+from database import USER_IDS
+
+# Всегда используем тестовую БД
+os.environ["FSTR_DB_NAME"] = "pereval_test"
+
+import main
+
+
+PEREVAL = {
+    'beauty_title': 'тест перевал',
+    'title': 'тест асинхронный',
+    'other_titles': 'тест',
+    'connect': 'соединяет',
+    'add_time': '2023-12-07 12:00:00',
+    'user': {
+        'email': 'async@example.com',
+        'fam': 'тестфамилия',
+        'name': 'тестимя',
+        'otc': 'тестотчество',
+        'phone': '123'
+    },
+    'coords': {
+        'latitude': '55.1234',
+        'longitude': '37.5678',
+        'height': '1000'
+    },
+    'level': {
+        'winter': '1А',
+        'summer': '1Б',
+        'autumn': '1А',
+        'spring': ''
+    },
+    'images': [
+        {'data': 'test_image_data', 'title': 'тестфото'}
+    ]
+}
+
+
+def run_with_db(func):
+    """Запускает корутину func(db) на соединении из нового пула"""
+    async def runner():
+        pool = create_async_pool()
+        await pool.open()
+        db = AsyncDatabaseManager(pool)
+        try:
+            assert await db.connect()
+            return await func(db)
+        finally:
+            await db.disconnect()
+            await pool.close()
+
+    return asyncio.run(runner())
+
+
+class TestAsyncDatabaseManager:
+    """Тесты для класса AsyncDatabaseManager"""
+
+    # Добавление и получение перевала
+    def test_add_and_get_pereval(self):
+        async def scenario(db):
+            pereval_id = await db.add_pereval(PEREVAL)
+            return pereval_id, await db.get_pereval(pereval_id)
+
+        pereval_id, pereval = run_with_db(scenario)
+        assert pereval["id"] == pereval_id
+        assert pereval["user"]["email"] == "async@example.com"
+        assert pereval["images"][0]["title"] == "тестфото"
+
+    # Обновление перевала со статусом "new"
+    def test_update_pereval(self):
+        async def scenario(db):
+            pereval_id = await db.add_pereval(PEREVAL)
+            result = await db.update_pereval(pereval_id, {'title': 'новый', 'coords': {
+                'latitude': '56.1', 'longitude': '38.5', 'height': '1500'
+            }})
+            return result, await db.get_pereval(pereval_id)
+
+        result, updated = run_with_db(scenario)
+        assert result['state'] == 1
+        assert updated["title"] == "новый"
+        assert updated["coords"]["height"] == 1500
+
+    # Ошибка БД при обновлении — state 0 с сообщением, соединение пригодно для следующего запроса
+    def test_update_pereval_db_error(self):
+        async def scenario(db):
+            pereval_id = await db.add_pereval(PEREVAL)
+            result = await db.update_pereval(pereval_id, {'add_time': 'не дата'})
+            return result, await db.get_pereval(pereval_id)
+
+        result, pereval = run_with_db(scenario)
+        assert result['state'] == 0 and result['message']
+        assert pereval["title"] == "тест асинхронный"
+
+    # Список перевалов пользователя
+    def test_get_user_perevals(self):
+        async def scenario(db):
+            await db.add_pereval(PEREVAL)
+            return await db.get_user_perevals("async@example.com")
+
+        perevals = run_with_db(scenario)
+        assert len(perevals) >= 1
+        assert all(p["user"]["email"] == "async@example.com" for p in perevals)
+
+    # Первые отправки нового пользователя параллельно на разных соединениях: один пользователь, все перевалы
+    def test_concurrent_new_user(self):
+        email = f"async-{uuid.uuid4().hex}@example.com"
+        data = dict(PEREVAL, user=dict(PEREVAL["user"], email=email))
+
+        async def add(pool):
+            db = AsyncDatabaseManager(pool)
+            assert await db.connect()
+            try:
+                return await db.add_pereval(data)
+            finally:
+                await db.disconnect()
+
+        async def scenario():
+            pool = create_async_pool()
+            await pool.open()
+            try:
+                return await asyncio.gather(*(add(pool) for _ in range(4)))
+            finally:
+                await pool.close()
+
+        ids = asyncio.run(scenario())
+        assert None not in ids and len(set(ids)) == 4
+
+        async def users(db):
+            await db.cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
+            return await db.cursor.fetchall()
+
+        assert run_with_db(users) == [(USER_IDS.get(email),)]
+
+    # Потоковая выгрузка: GeoJSON — точки из coords, CSV — картинки ссылками
+    def test_export_perevals(self):
+        async def scenario(db):
+            pereval_id = await db.add_pereval(PEREVAL)
+            chunks = {}
+            for fmt in ("geojson", "csv"):
+                chunks[fmt] = [chunk async for chunk in db.export_perevals(fmt, ("id", "title", "images"))]
+            return pereval_id, chunks
+
+        pereval_id, chunks = run_with_db(scenario)
+        features = json.loads(b"".join(chunks["geojson"]))["features"]
+        feature = next(f for f in features if f["id"] == pereval_id)
+        assert feature["geometry"] == {"type": "Point", "coordinates": [37.5678, 55.1234]}
+        assert list(feature["properties"]) == ["id", "title", "images"]
+
+        rows = list(csv.DictReader(b"".join(chunks["csv"]).decode("utf-8").splitlines()))
+        row = next(r for r in rows if r["id"] == str(pereval_id))
+        assert row["title"] == "тест асинхронный" and row["images"].startswith("/images/")
+
+    # Лимит выгрузок держится и для одновременных запросов, место освобождается по окончании потока
+    def test_export_limit(self, monkeypatch):
+        monkeypatch.setattr(main, "EXPORT_MAX_RUNNING", 1)
+
+        async def scenario():
+            async with main.lifespan(main.app):
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    responses = await asyncio.gather(*(client.get("/export?format=csv") for _ in range(3)))
+                    after = await client.get("/export?format=csv")
+                    return [r.status_code for r in responses], after.status_code, main.app.state.exports
+
+        statuses, after, running = asyncio.run(scenario())
+        assert sorted(statuses) == [200, 503, 503]
+        assert after == 200 and running == 0
+
+    # If-Match с ETag из GET: изменение проходит, повтор с устаревшим ETag — 412
+    def test_update_with_etag(self):
+        async def scenario():
+            async with main.lifespan(main.app):
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    pereval_id = (await client.post("/submitData", json=PEREVAL)).json()["id"]
+                    etag = (await client.get(f"/submitData/{pereval_id}")).headers["ETag"]
+                    headers = {"If-Match": etag}
+                    updated = await client.patch(f"/submitData/{pereval_id}", json={"title": "по ETag"}, headers=headers)
+                    stale = await client.patch(f"/submitData/{pereval_id}", json={"title": "ещё раз"}, headers=headers)
+                    return updated, stale, (await client.get(f"/submitData/{pereval_id}")).json()
+
+        updated, stale, pereval = asyncio.run(scenario())
+        assert updated.status_code == 200 and updated.json()["state"] == 1
+        assert stale.status_code == 412 and stale.json()["version"] == updated.json()["version"]
+        assert pereval["title"] == "по ETag"
+
+    # Клиент ушёл посреди выгрузки: место и соединение освобождаются сразу, без сборки мусора
+    def test_export_abandoned(self, monkeypatch):
+        import async_database
+        monkeypatch.setattr(async_database, "EXPORT_BATCH", 1)
+
+        async def scenario():
+            async with main.lifespan(main.app):
+                sent, disconnected = [], asyncio.Event()
+                requested = False
+
+                async def receive():
+                    nonlocal requested
+                    if not requested:
+                        requested = True
+                        return {"type": "http.request", "body": b"", "more_body": False}
+                    await disconnected.wait()
+                    return {"type": "http.disconnect"}
+
+                async def send(message):
+                    sent.append(message)
+                    if message["type"] == "http.response.body":
+                        disconnected.set()
+
+                scope = {"type": "http", "http_version": "1.1", "method": "GET", "path": "/export",
+                         "raw_path": b"/export", "query_string": b"format=ndjson", "headers": [],
+                         "scheme": "http", "server": ("test", 80), "client": ("test", 1), "root_path": ""}
+                await main.app(scope, receive, send)
+                running = main.app.state.exports
+                # соединение с прерванным запросом пул закрывает и открывает взамен новое — ждём его
+                for _ in range(100):
+                    stats = main.app.state.pool.get_stats()
+                    if stats["pool_size"] == stats["pool_available"]:
+                        break
+                    await asyncio.sleep(0.02)
+                return sent, running, stats["pool_size"] - stats["pool_available"]
+
+        sent, running, in_use = asyncio.run(scenario())
+        assert sent[0]["status"] == 200
+        assert len([m for m in sent if m["type"] == "http.response.body"]) < 10
+        assert running == 0 and in_use == 0
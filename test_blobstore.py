@@ -0,0 +1,93 @@
+import base64
+import tempfile
+import psycopg2
+import pytest
+from blobstore import LocalBlobStore, backfill, image_bytes, is_blob_key, sniff_content_type
+from database import db_params
+from fastapi import HTTPException
+from main import _etag_matches, _parse_range
+
+
+class TestLocalBlobStore:
+    """Тесты для локального хранилища картинок"""
+
+    def setup_method(self):
+        self.store = LocalBlobStore(tempfile.mkdtemp())
+
+    # Одинаковое содержимое хранится один раз под одним ключом
+    def test_put_deduplicates(self):
+        first = self.store.put(b"photo")
+        second = self.store.put(b"photo")
+
+        assert first == second
+        assert is_blob_key(first)
+        assert self.store.size(first) == 5
+
+    # Чтение диапазона байт
+    def test_iter_range(self):
+        key = self.store.put(b"0123456789")
+        assert b"".join(self.store.iter_range(key, 2, 5, chunk_size=2)) == b"2345"
+
+    # Несуществующий или кривой ключ
+    def test_missing(self):
+        assert self.store.size("0" * 64) is None
+        with pytest.raises(ValueError):
+            self.store.open("../etc/passwd")
+
+
+    # Перенос старых картинок из images.data в хранилище
+    def test_backfill(self):
+        connection = psycopg2.connect(**db_params())
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO images (data, title) VALUES ('legacy', 'старое') RETURNING id")
+                image_id = cursor.fetchone()[0]
+            connection.commit()
+
+            assert backfill(connection, self.store) >= 1
+
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT data, blob_key, size FROM images WHERE id=%s", (image_id,))
+                data, key, size = cursor.fetchone()
+            assert data is None
+            assert size == 6
+            with self.store.open(key) as f:
+                assert f.read() == b"legacy"
+        finally:
+            connection.close()
+
+
+# base64 декодируется, прочие строки сохраняются как есть
+def test_image_bytes():
+    assert image_bytes(base64.b64encode(b"\x89PNG").decode()) == b"\x89PNG"
+    assert image_bytes("тестфото") == "тестфото".encode("utf-8")
+
+
+def test_sniff_content_type():
+    assert sniff_content_type(b"\xff\xd8\xff\xe0") == "image/jpeg"
+    assert sniff_content_type(b"\x89PNG\r\n\x1a\n") == "image/png"
+    assert sniff_content_type(b"text") == "application/octet-stream"
+
+
+# Range для GET /images: один диапазон, суффикс, выход за файл — 416
+def test_parse_range():
+    assert _parse_range("bytes=2-5", 100) == (2, 5)
+    assert _parse_range("bytes=90-", 100) == (90, 99)
+    assert _parse_range("bytes=-10", 100) == (90, 99)
+    # суффикс длиннее файла — весь файл
+    assert _parse_range("bytes=-500", 100) == (0, 99)
+    assert _parse_range("bytes=0-1000", 100) == (0, 99)
+    assert _parse_range("items=0-1", 100) is None
+    for header, size in (("bytes=-0", 100), ("bytes=100-", 100), ("bytes=-5", 0), ("bytes=5-2", 100)):
+        with pytest.raises(HTTPException) as e:
+            _parse_range(header, size)
+        assert e.value.status_code == 416
+
+
+# If-None-Match сравнивается слабо: W/ от сжатого ответа не мешает 304
+def test_etag_matches():
+    assert _etag_matches('W/"abc"', '"abc"')
+    assert _etag_matches('"x", "abc"', '"abc"')
+    assert _etag_matches("*", '"abc"')
+    assert not _etag_matches('"abd"', '"abc"')
+    assert not _etag_matches(None, '"abc"')
@@ -0,0 +1,68 @@
+import time
+import asyncio
+from cache import LRUCache, MemorySharedBackend, PerevalCache, encode_json
+
+
+class TestLRUCache:
+    """Тесты для LRU-кэша процесса"""
+
+    # Вытесняется давно не использованная запись
+    def test_eviction(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set(1, "a")
+        cache.set(2, "b")
+        cache.get(1)
+        cache.set(3, "c")
+
+        assert cache.get(2) is None
+        assert cache.get(1) == "a"
+        assert cache.stats()["evictions"] == 1
+
+    # Запись устаревает по TTL
+    def test_ttl(self):
+        cache = LRUCache(max_size=2, ttl=0.01)
+        cache.set(1, "a")
+        time.sleep(0.02)
+
+        assert cache.get(1) is None
+
+
+class TestPerevalCache:
+    """Тесты для кэша перевалов с общим бэкендом"""
+
+    PEREVAL = {"id": 1, "title": "Пхия", "status": "accepted"}
+
+    # Второй процесс берёт запись из общего кэша с тем же ETag
+    def test_shared_backend(self):
+        async def scenario():
+            shared = MemorySharedBackend()
+            first = PerevalCache(LRUCache(), shared)
+            second = PerevalCache(LRUCache(), shared)
+
+            stored = await first.set(1, self.PEREVAL)
+            return stored, await second.get(1)
+
+        stored, loaded = asyncio.run(scenario())
+        assert loaded.body == encode_json(self.PEREVAL)
+        assert loaded.etag == stored.etag
+
+    # Сброс удаляет запись на обоих уровнях
+    def test_invalidate(self):
+        async def scenario():
+            cache = PerevalCache(LRUCache(), MemorySharedBackend())
+            await cache.set(1, self.PEREVAL)
+            await cache.invalidate(1)
+            return await cache.get(1)
+
+        assert asyncio.run(scenario()) is None
+
+    # ETag меняется вместе с содержимым
+    def test_etag_changes(self):
+        async def scenario():
+            cache = PerevalCache(LRUCache())
+            before = await cache.set(1, self.PEREVAL)
+            after = await cache.set(1, dict(self.PEREVAL, title="Новое"))
+            return before.etag, after.etag
+
+        before, after = asyncio.run(scenario())
+        assert before != after
@@ -0,0 +1,96 @@
+import gzip
+import asyncio
+import httpx
+import pytest
+from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
+from compression import CompressionMiddleware, choose_encoding
+
+brotli = pytest.importorskip("brotli")
+
+BODY = b'{"title": "' + "перевал ".encode("utf-8") * 500 + b'"}'
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, min_size=1024)
+
+
+@app.get("/json")
+async def get_json():
+    return Response(content=BODY, media_type="application/json")
+
+
+@app.get("/tagged")
+async def get_tagged():
+    return Response(content=BODY, media_type="application/json", headers={"ETag": '"abc"', "Vary": "Origin"})
+
+
+@app.get("/small")
+async def get_small():
+    return Response(content=b'{"id": 1}', media_type="application/json")
+
+
+@app.get("/image")
+async def get_image():
+    return Response(content=b"\xff\xd8\xff" + b"\0" * 4096, media_type="image/jpeg")
+
+
+@app.get("/stream")
+async def get_stream():
+    async def lines():
+        for i in range(3):
+            yield b'{"id": %d, "title": "%s"}\n' % (i, b"x" * 600)
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def fetch(path: str, accept_encoding: str) -> httpx.Response:
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(path, headers={"Accept-Encoding": accept_encoding})
+    return asyncio.run(scenario())
+
+
+class TestCompression:
+    """Тесты для сжатия ответов"""
+
+    # br предпочтительнее gzip; q=0 и identity — без сжатия
+    def test_choose_encoding(self):
+        assert choose_encoding("gzip, deflate, br") == "br"
+        assert choose_encoding("gzip, br;q=0") == "gzip"
+        assert choose_encoding("*") == "br"
+        assert choose_encoding("identity") is None
+        assert choose_encoding(None) is None
+
+    # JSON сжимается, Content-Length — размер сжатого тела
+    def test_json_compressed(self):
+        for encoding, decompress in (("gzip", gzip.decompress), ("br", brotli.decompress)):
+            response = fetch("/json", encoding)
+            assert response.headers["content-encoding"] == encoding
+            assert response.headers["vary"] == "Accept-Encoding"
+            assert int(response.headers["content-length"]) < len(BODY) // 10
+            # httpx распаковывает сам
+            assert response.content == BODY
+
+    # Маленькие ответы, картинки и клиенты без Accept-Encoding — как есть
+    def test_not_compressed(self):
+        for path, encoding in (("/small", "gzip"), ("/image", "gzip"), ("/json", "identity")):
+            response = fetch(path, encoding)
+            assert "content-encoding" not in response.headers
+            # JSON отдан без сжатия, но ответ всё равно зависит от Accept-Encoding
+            assert response.headers.get("vary") == (None if path == "/image" else "Accept-Encoding")
+
+    # Потоковый ответ сжимается по частям, без Content-Length
+    def test_streaming(self):
+        response = fetch("/stream", "gzip")
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        assert [line[:8] for line in response.content.splitlines()] == [b'{"id": 0', b'{"id": 1', b'{"id": 2']
+
+    # ETag сжатого ответа — слабый; Vary дополняется, а не заменяется
+    def test_etag_weakened(self):
+        response = fetch("/tagged", "gzip")
+        assert response.headers["etag"] == 'W/"abc"'
+        assert response.headers["vary"] == "Origin, Accept-Encoding"
+        response = fetch("/tagged", "identity")
+        assert response.headers["etag"] == '"abc"'
+        assert response.headers["vary"] == "Origin, Accept-Encoding"
@@ -1,22 +1,60 @@
+import io
 import os
+import csv
+import json
+import uuid
+import asyncio
+import inspect
 import pytest
-from database import DatabaseManager
+from datetime import date
+from async_database import AsyncDatabaseManager, create_async_pool
+from database import DatabaseManager, CLAIM_PEREVALS_SQL, USER_IDS, cluster_tiles, parse_fields
 
 # Всегда используем тестовую БД
 os.environ["FSTR_DB_NAME"] = "pereval_test"
 
 
+class Blocking:
+    """Синхронный вид асинхронного менеджера для пошаговых тестов: корутины выполняются в цикле теста"""
+
+    def __init__(self, target, loop: asyncio.AbstractEventLoop):
+        self._target = target
+        self._loop = loop
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name in ("cursor", "connection"):
+            return Blocking(value, self._loop)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            result = value(*args, **kwargs)
+            return self._loop.run_until_complete(result) if inspect.isawaitable(result) else result
+        return call
+
+
 class TestDatabaseManager:
-    """Тесты для класса DatabaseManager"""
+    """Тесты запросов слоя БД (через AsyncDatabaseManager, которым пользуется приложение)"""
 
     def setup_method(self):
         """Настройка перед каждым тестом"""
-        self.db = DatabaseManager()
-        self.db.connect()
+        self.loop = asyncio.new_event_loop()
+        self.pool = create_async_pool()
+        self.loop.run_until_complete(self.pool.open())
+        self.db = self.connect()
 
     def teardown_method(self):
         """Очистка после каждого теста"""
         self.db.disconnect()
+        self.loop.run_until_complete(self.pool.close())
+        self.loop.close()
+
+    # ещё одно соединение — для параллельной транзакции
+    def connect(self) -> Blocking:
+        db = Blocking(AsyncDatabaseManager(self.pool), self.loop)
+        assert db.connect()
+        return db
 
     # Тест подключения к базе
     def test_connection(self):
@@ -37,27 +75,34 @@ class TestDatabaseManager:
         assert "pereval_added" in tables
         assert "images" in tables
 
-    # Тест добавления/получения пользователя
-    def test_add_and_get_user(self):
-        user_data = {
-            'email': 'test@example.com',
-            'fam': 'тестфамилия',
-            'name': 'тестимя',
-            'otc': 'тестотчество',
-            'phone': '123'
-        }
-
-        user_id = self.db._add_or_get_user(user_data)
+    # Пользователь создаётся вместе с первым перевалом, повторные отправки берут его id из кэша
+    def test_add_pereval_user(self):
+        email = f"user-{uuid.uuid4().hex}@example.com"
+        ids = [self.create_test_pereval(email)]
+        user_id = USER_IDS.get(email)
         assert user_id is not None
 
-        self.db.cursor.execute("SELECT email FROM users WHERE id = %s", (user_id,))
-        result = self.db.cursor.fetchone()
+        ids.append(self.create_test_pereval(email))
+        USER_IDS.delete(email)
+        ids.append(self.create_test_pereval(email))
+        assert USER_IDS.get(email) == user_id
+
+        self.db.cursor.execute("SELECT id, fam FROM users WHERE email = %s", (email,))
+        assert self.db.cursor.fetchall() == [(user_id, "тестфамилия")]
+        self.db.cursor.execute("SELECT DISTINCT user_id FROM pereval_added WHERE id = ANY(%s)", (ids,))
+        assert self.db.cursor.fetchall() == [(user_id,)]
 
-        assert result is not None
-        assert result[0] == user_data["email"]
+    # Ошибка вставки перевала откатывает и нового пользователя
+    def test_add_pereval_rollback(self):
+        email = f"user-{uuid.uuid4().hex}@example.com"
+        assert self.create_test_pereval(email, height="99999999999") is None
+
+        self.db.cursor.execute("SELECT count(*) FROM users WHERE email = %s", (email,))
+        assert self.db.cursor.fetchone()[0] == 0
+        assert USER_IDS.get(email) is None
 
     # Тест добавления перевала
-    def create_test_pereval(self):
+    def create_test_pereval(self, email: str = "test@example.com", height: str = "1000"):
         """Вспомогательная функция — создаёт тестовый перевал"""
         data = {
             'beauty_title': 'тест перевал',
@@ -66,7 +111,7 @@ class TestDatabaseManager:
             'connect': 'соединяет',
             'add_time': '2023-12-07 12:00:00',
             'user': {
-                'email': 'test@example.com',
+                'email': email,
                 'fam': 'тестфамилия',
                 'name': 'тестимя',
                 'otc': 'тестотчество',
@@ -75,7 +120,7 @@ class TestDatabaseManager:
             'coords': {
                 'latitude': '55.1234',
                 'longitude': '37.5678',
-                'height': '1000'
+                'height': height
             },
             'level': {
                 'winter': '1А',
@@ -140,6 +185,58 @@ class TestDatabaseManager:
         assert result['state'] == 0
         assert "Редактирование запрещено" in result['message']
 
+    # Ошибка БД при обновлении (высота вне int4) — state 0 с сообщением, перевал не меняется
+    def test_update_pereval_db_error(self):
+        pereval_id = self.create_test_pereval()
+
+        result = self.db.update_pereval(pereval_id, {
+            'title': 'не сохранится',
+            'coords': {'latitude': '56.1', 'longitude': '38.5', 'height': '99999999999'}
+        })
+
+        assert result['state'] == 0
+        assert result['message']
+        assert self.db.get_pereval(pereval_id)["title"] == "тест горный"
+
+    # Тест обновления уровней, даты и картинок одним запросом
+    def test_update_pereval_levels_and_images(self):
+        pereval_id = self.create_test_pereval()
+
+        result = self.db.update_pereval(pereval_id, {
+            'add_time': '2024-01-02 03:04:05',
+            'level': {'winter': '2А', 'spring': '1Б'},
+            'images': [{'data': 'новое фото', 'title': 'новое'}]
+        })
+        assert result['state'] == 1
+        assert result['version'] == 2
+
+        updated = self.db.get_pereval(pereval_id)
+        assert updated["add_time"].startswith("2024-01-02")
+        assert updated["level"]["winter"] == "2А"
+        assert updated["level"]["spring"] == "1Б"
+        assert updated["level"]["summer"] == "1Б"  # не передан — не меняется
+        assert [i["title"] for i in updated["images"]] == ["новое"]
+        assert updated["version"] == 2
+
+    # Тест конфликта версий при одновременной правке
+    def test_update_pereval_version_conflict(self):
+        pereval_id = self.create_test_pereval()
+
+        first = self.db.update_pereval(pereval_id, {'title': 'первая правка'}, version=1)
+        assert first['state'] == 1
+
+        second = self.db.update_pereval(pereval_id, {'title': 'вторая правка'}, version=1)
+        assert second['state'] == 0
+        assert second['conflict'] is True
+        assert second['version'] == 2
+        assert self.db.get_pereval(pereval_id)["title"] == "первая правка"
+
+    # Тест обновления несуществующего перевала
+    def test_update_pereval_not_found(self):
+        result = self.db.update_pereval(2_000_000_000, {'title': 'нет такого'})
+        assert result['state'] == 0
+        assert result['message'] == "Перевал не найден"
+
     # Тест списка перевалов пользователя
     def test_get_user_perevals(self):
         self.create_test_pereval()
@@ -148,3 +245,361 @@ class TestDatabaseManager:
         assert isinstance(perevals, list)
         assert len(perevals) >= 1
 
+
+    # Индексы из миграций на месте
+    def test_indexes(self):
+        self.db.cursor.execute("SELECT indexname FROM pg_indexes WHERE schemaname = 'public'")
+        indexes = [r[0] for r in self.db.cursor.fetchall()]
+
+        assert "pereval_added_user_id_id_idx" in indexes
+        assert "images_pereval_id_idx" in indexes
+        assert "pereval_added_status_idx" in indexes
+
+    # Постраничный список перевалов пользователя по курсору
+    def test_get_user_perevals_pages(self):
+        created = {self.create_test_pereval() for _ in range(3)}
+
+        first = self.db.get_user_perevals("test@example.com", limit=2)
+        assert len(first) == 2
+        assert first[0]["id"] < first[1]["id"]
+
+        rest = self.db.get_user_perevals("test@example.com", limit=1000, after_id=first[-1]["id"])
+        ids = [p["id"] for p in first + rest]
+        assert created <= set(ids)
+        assert len(ids) == len(set(ids))
+        assert [i["title"] for i in rest[-1]["images"]] == ["тестфото"]
+        assert rest[-1]["images"] == self.db.get_pereval(rest[-1]["id"])["images"]
+
+    # JSON, собранный в Postgres, совпадает с документом из Python
+    def test_get_pereval_json(self):
+        pereval_id = self.create_test_pereval()
+
+        assert json.loads(self.db.get_pereval_json(pereval_id)) == self.db.get_pereval(pereval_id)
+        assert self.db.get_pereval_json(2_000_000_000) is None
+
+    # Страница списка готовым JSON и курсор следующей страницы
+    def test_get_user_perevals_json(self):
+        self.create_test_pereval()
+        self.create_test_pereval()
+
+        body, next_id = self.db.get_user_perevals_json("test@example.com", limit=1)
+        page = json.loads(body)
+        assert next_id == page[0]["id"]
+        assert page == self.db.get_user_perevals("test@example.com", limit=1)
+
+        body, next_id = self.db.get_user_perevals_json("test@example.com", limit=1000, after_id=next_id)
+        assert next_id is None or len(json.loads(body)) == 1000
+        assert json.loads(self.db.get_user_perevals_json("nobody@example.com")[0]) == []
+
+    # Только запрошенные поля (id — всегда), в порядке полного документа
+    def test_fields_projection(self):
+        pereval_id = self.create_test_pereval()
+        full = self.db.get_pereval(pereval_id)
+
+        fields = parse_fields("coords, title")
+        assert fields == ("id", "title", "coords")
+        assert json.loads(self.db.get_pereval_json(pereval_id, fields)) == {k: full[k] for k in fields}
+
+        body, _ = self.db.get_user_perevals_json("test@example.com", limit=1000, fields=parse_fields("status"))
+        assert {tuple(p) for p in json.loads(body)} == {("id", "status")}
+
+        with pytest.raises(ValueError):
+            parse_fields("title,password")
+
+    # Счётчики статистики после вставки, правки, смены статуса и удаления совпадают с подсчётом по всей таблице
+    def test_stats_counters(self):
+        ids = [self.create_test_pereval() for _ in range(3)]
+        assert self.db.update_pereval(ids[0], {"level": {"summer": "3А"}, "title": "правка"})["state"] == 1
+        self.db.cursor.execute("UPDATE pereval_added SET status = 'accepted' WHERE id = %s", (ids[1],))
+        self.db.cursor.execute("DELETE FROM pereval_added WHERE id = %s", (ids[2],))
+        self.db.connection.commit()
+
+        self.db.cursor.execute("""
+            SELECT metric, key, sum(n) FROM stats_counters GROUP BY metric, key HAVING sum(n) <> 0
+            ORDER BY metric, key
+        """)
+        counters = self.db.cursor.fetchall()
+        self.db.cursor.execute("""
+            SELECT k.metric, k.key, count(*) FROM pereval_added p, pereval_stats_keys(p) k
+            GROUP BY k.metric, k.key ORDER BY k.metric, k.key
+        """)
+        assert counters == self.db.cursor.fetchall()
+
+        self.db.cursor.execute("SELECT user_id, perevals FROM user_stats WHERE perevals <> 0 ORDER BY user_id")
+        users = self.db.cursor.fetchall()
+        self.db.cursor.execute("""
+            SELECT user_id, count(*) FROM pereval_added WHERE user_id IS NOT NULL GROUP BY user_id ORDER BY user_id
+        """)
+        assert users == self.db.cursor.fetchall()
+
+        stats = json.loads(self.db.get_stats_json(days=3660, top=1))
+        assert stats["by_status"] == {key: n for metric, key, n in counters if metric == "status"}
+        assert stats["by_level"]["summer"]["3А"] >= 1
+        assert {"day": "2023-12-07", "count": dict(((m, k), n) for m, k, n in counters)[("day", "2023-12-07")]} \
+            in stats["per_day"]
+        assert stats["top_contributors"][0]["perevals"] == max(n for _, n in users)
+
+    # Ячейки кластеров после вставки, переноса координат и удаления совпадают с подсчётом по всей таблице
+    def test_cluster_cells(self):
+        ids = [self.create_test_pereval() for _ in range(3)]
+        lat, lon = -70 - uuid.uuid4().int % 1000 / 100, -60 - uuid.uuid4().int % 1000 / 100
+        coords = {"latitude": lat, "longitude": lon, "height": 1000}
+        assert self.db.update_pereval(ids[0], {"coords": coords})["state"] == 1
+        self.db.cursor.execute("DELETE FROM pereval_added WHERE id = %s", (ids[1],))
+        self.db.connection.commit()
+
+        self.db.cursor.execute("""
+            SELECT zoom, cx, cy, sum(n), round(sum(sum_lat)::numeric, 6) FROM cluster_cells
+            GROUP BY zoom, cx, cy HAVING sum(n) <> 0 ORDER BY zoom, cx, cy
+        """)
+        cells = self.db.cursor.fetchall()
+        self.db.cursor.execute("""
+            SELECT k.zoom, k.cx, k.cy, count(*), round(sum(c.latitude)::numeric, 6)
+            FROM pereval_added p JOIN coords c ON c.id = p.coord_id, cluster_cells_of(c.latitude, c.longitude) k
+            GROUP BY k.zoom, k.cx, k.cy ORDER BY k.zoom, k.cx, k.cy
+        """)
+        assert cells == self.db.cursor.fetchall()
+
+        [tile] = cluster_tiles(lat, lon, lat, lon, 14)
+        clusters = json.loads(b"[" + self.db.get_cluster_tiles(14, [tile])[tile] + b"]")
+        assert [(c["count"], c["sample_ids"]) for c in clusters] == [(1, [ids[0]])]
+        assert clusters[0]["lat"] == pytest.approx(lat) and clusters[0]["lon"] == pytest.approx(lon)
+
+    # Тайлы области: y растёт к югу, через 180-й меридиан — с переходом
+    def test_cluster_tiles(self):
+        assert cluster_tiles(-80, -180, 80, 180, 0) == [(0, 0)]
+        assert cluster_tiles(10, 0, 70, 90, 2) == [(2, 0), (3, 0), (2, 1), (3, 1)]
+        assert cluster_tiles(-10, 170, 10, -170, 3) == [(7, 3), (0, 3), (7, 4), (0, 4)]
+
+    # Выгрузка каталога: фильтр по дате и статусу, поля, картинки ссылками, без них и содержимым
+    def test_export_perevals(self):
+        n = uuid.uuid4().int
+        day = date(1900 + n % 100, 1 + n % 12, 1 + n % 28)
+        ids = [self.create_test_pereval() for _ in range(3)]
+        self.db.cursor.execute("UPDATE pereval_added SET add_time = %s WHERE id = ANY(%s)", (day, ids))
+        self.db.cursor.execute("UPDATE pereval_added SET status = 'accepted' WHERE id = %s", (ids[2],))
+        self.db.connection.commit()
+
+        # выгрузка в файл — синхронный DatabaseManager (export.py)
+        def export(fmt, **kwargs):
+            db = DatabaseManager()
+            assert db.connect()
+            try:
+                out = io.BytesIO()
+                return db.export_perevals(out, fmt, since=day, until=day, **kwargs), out.getvalue()
+            finally:
+                db.disconnect()
+
+        count, body = export("ndjson", images="inline")
+        assert count == 3
+        docs = [json.loads(line) for line in body.decode("utf-8").splitlines()]
+        assert [d["id"] for d in docs] == ids
+        assert docs[0]["images"][0]["data"] == "dGVzdF9pbWFnZV9kYXRh"
+
+        count, body = export("csv", fields=("id", "coords", "images"), status="new", images="none")
+        assert count == 2
+        rows = list(csv.DictReader(io.StringIO(body.decode("utf-8"))))
+        assert [int(r["id"]) for r in rows] == ids[:2]
+        assert list(rows[0]) == ["id", "latitude", "longitude", "height"]
+
+        count, body = export("geojson", status="rejected")
+        assert count == 0
+        assert json.loads(body) == {"type": "FeatureCollection", "features": []}
+
+    # Курсор синхронизации после всех уже существующих изменений
+    def sync_to_end(self):
+        cursor, more = (0, 0), True
+        while more:
+            _, _, cursor, more = self.db.get_changes("test@example.com", cursor, limit=1000)
+        return cursor
+
+    # Синхронизация: только изменённые после курсора перевалы и удалённые
+    def test_get_changes(self):
+        cursor = self.sync_to_end()
+        first, second = self.create_test_pereval(), self.create_test_pereval()
+
+        docs, deleted, cursor, more = self.db.get_changes("test@example.com", cursor)
+        assert [p["id"] for p in json.loads(docs)] == [first, second]
+        assert (deleted, more) == ([], False)
+        assert self.db.get_changes("test@example.com", cursor)[:2] == (b"[]", [])
+
+        self.db.update_pereval(second, {"title": "изменён"})
+        self.db.cursor.execute("DELETE FROM pereval_added WHERE id = %s", (first,))
+        self.db.connection.commit()
+
+        docs, deleted, _, _ = self.db.get_changes("test@example.com", cursor)
+        assert json.loads(docs) == [self.db.get_pereval(second)]
+        assert deleted == [first]
+
+    # Изменение, зафиксированное раньше начатой до него транзакции, ждёт её и не теряется
+    def test_get_changes_waits_for_older_transactions(self):
+        older, newer = self.create_test_pereval(), self.create_test_pereval()
+        cursor = self.sync_to_end()
+
+        other = self.connect()
+        try:
+            other.cursor.execute(
+                "UPDATE pereval_added SET title = 'раньше', change_xid = pg_current_xact_id() WHERE id = %s", (older,)
+            )
+            self.db.update_pereval(newer, {"title": "позже"})
+            docs, _, cursor, _ = self.db.get_changes("test@example.com", cursor)
+            assert json.loads(docs) == []
+
+            other.connection.commit()
+            docs, _, _, _ = self.db.get_changes("test@example.com", cursor)
+            assert [p["title"] for p in json.loads(docs)] == ["раньше", "позже"]
+        finally:
+            other.disconnect()
+
+    def drain_queue(self):
+        while self.db.claim_perevals("очистка", 10000)[1]:
+            pass
+
+    # Модератор берёт перевалы, принимает один и возвращает другой в очередь
+    def test_claim_and_set_status(self):
+        self.drain_queue()
+        created = sorted(self.create_test_pereval() for _ in range(2))
+
+        body, ids = self.db.claim_perevals("модератор-1", 10)
+        assert sorted(ids) == created
+        assert [p["status"] for p in json.loads(body)] == ["pending", "pending"]
+
+        # чужие перевалы модератор не меняет
+        assert self.db.set_status(created, "accepted", "модератор-2") == {"updated": [], "skipped": created}
+
+        assert self.db.set_status(created[:1], "accepted", "модератор-1")["updated"] == created[:1]
+        assert self.db.set_status(created[1:], "new", "модератор-1")["updated"] == created[1:]
+        assert self.db.get_pereval(created[0])["status"] == "accepted"
+
+        queue, _ = self.db.get_moderation_queue(limit=1000, after_id=created[0])
+        assert [p["id"] for p in json.loads(queue)] == created[1:]
+
+    # Параллельные модераторы не ждут друг друга и получают разные перевалы
+    def test_claim_skips_locked(self):
+        self.drain_queue()
+        created = sorted(self.create_test_pereval() for _ in range(3))
+
+        other = self.connect()
+        try:
+            # транзакция другого модератора ещё не завершена — её строка заблокирована
+            other.cursor.execute(CLAIM_PEREVALS_SQL, {"moderator": "модератор-2", "limit": 1, "claim_ttl": 1800})
+            self.db.cursor.execute("SET lock_timeout = '1s'")
+            _, ids = self.db.claim_perevals("модератор-1", 10)
+            assert sorted(ids) == created[1:]
+        finally:
+            other.connection.rollback()
+            other.disconnect()
+
+    # Картинка сохраняется в хранилище, в ответе — только ссылка
+    def test_image_stored_as_blob(self):
+        pereval = self.db.get_pereval(self.create_test_pereval())
+        image = pereval["images"][0]
+
+        assert "data" not in image
+        assert image["size"] == len(b"test_image_data")
+        key = image["url"].rsplit("/", 1)[1]
+        with self.db.blob_store.open(key) as f:
+            assert f.read() == b"test_image_data"
+
+    # Пакетное добавление: корректные элементы вставляются, ошибочные получают статус
+    def test_add_perevals_batch(self):
+        good = {
+            'beauty_title': 'пакет', 'title': 'пакетный', 'other_titles': '', 'connect': '',
+            'add_time': '2023-12-07 12:00:00',
+            'user': {'email': 'batch@example.com', 'fam': 'ф', 'name': 'и', 'otc': 'о', 'phone': '1'},
+            'coords': {'latitude': 43.1, 'longitude': 42.5, 'height': 3000},
+            'level': {'winter': '2А', 'summer': '1Б', 'autumn': '', 'spring': ''},
+            'images': [{'data': 'a', 'title': 'один'}, {'data': 'b', 'title': 'два'}]
+        }
+        bad_time = dict(good, add_time='вчера')
+        no_title = dict(good, title='')
+
+        results = self.db.add_perevals([good, bad_time, good, no_title])
+
+        assert [r['status'] for r in results] == [200, 400, 200, 400]
+        assert [r['index'] for r in results] == [0, 1, 2, 3]
+
+        pereval = self.db.get_pereval(results[2]['id'])
+        assert pereval['title'] == 'пакетный'
+        assert pereval['coords']['height'] == 3000
+        assert pereval['level']['winter'] == '2А'
+        assert [i['title'] for i in pereval['images']] == ['один', 'два']
+        assert self.db.get_pereval(results[0]['id'])['user']['email'] == 'batch@example.com'
+
+        # строка проходит проверку, но её отвергает БД (высота вне int4) — ошибка только у неё
+        too_high = dict(good, coords={'latitude': 43.1, 'longitude': 42.5, 'height': 99999999999})
+        results = self.db.add_perevals([good, too_high, no_title, good])
+
+        assert [r['status'] for r in results] == [200, 400, 400, 200]
+        assert "Данные отклонены БД" in results[1]['message'] and results[1]['id'] is None
+        assert [i['title'] for i in self.db.get_pereval(results[3]['id'])['images']] == ['один', 'два']
+
+    # Поиск перевалов рядом с точкой: по расстоянию, с радиусом и страницами
+    def test_get_perevals_near(self):
+        base = {
+            'beauty_title': 'гео', 'title': 'гео', 'other_titles': '', 'connect': '', 'add_time': None,
+            'user': {'email': 'geo@example.com', 'fam': '', 'name': '', 'otc': '', 'phone': ''},
+            'level': {'winter': '', 'summer': '', 'autumn': '', 'spring': ''}, 'images': []
+        }
+        # точки к северу от (-60, 100) на ~1, 5 и 50 км
+        points = [(-59.991, 100.0), (-59.955, 100.0), (-59.55, 100.0)]
+        results = self.db.add_perevals([
+            dict(base, coords={'latitude': lat, 'longitude': lon, 'height': 100}) for lat, lon in points
+        ])
+        ids = [r['id'] for r in results]
+
+        # в тестовой БД могут остаться точки от прошлых запусков — смотрим только свои
+        near = [p for p in self.db.get_perevals_near(-60.0, 100.0, 10) if p['id'] in ids]
+        assert [p['id'] for p in near] == ids[:2]
+        assert 0.9 < near[0]['distance_km'] < 1.1
+
+        first = self.db.get_perevals_near(-60.0, 100.0, 100, limit=1)
+        after = (first[0]['distance_km'], first[0]['id'])
+        rest = self.db.get_perevals_near(-60.0, 100.0, 100, limit=1000, after=after)
+        found = [p['id'] for p in first + rest]
+        assert len(found) == len(set(found))
+        assert [i for i in found if i in ids] == ids
+
+    # Область просмотра, в том числе через 180-й меридиан
+    def test_get_perevals_in_bbox(self):
+        base = {
+            'beauty_title': 'гео', 'title': 'гео', 'other_titles': '', 'connect': '', 'add_time': None,
+            'user': {'email': 'geo@example.com', 'fam': '', 'name': '', 'otc': '', 'phone': ''},
+            'level': {'winter': '', 'summer': '', 'autumn': '', 'spring': ''}, 'images': []
+        }
+        points = [(-65.0, 179.5), (-65.0, -179.5), (-65.0, 170.0)]
+        results = self.db.add_perevals([
+            dict(base, coords={'latitude': lat, 'longitude': lon, 'height': 100}) for lat, lon in points
+        ])
+        ids = [r['id'] for r in results]
+
+        found = self.db.get_perevals_in_bbox(-66.0, 179.0, -64.0, -179.0, -65.0, 179.6)
+        assert [p['id'] for p in found if p['id'] in ids] == ids[:2]
+
+    # Поиск по названиям: морфология, опечатки, обновление индекса при правке
+    def test_search_perevals(self):
+        pereval_id = self.create_test_pereval()
+        self.db.update_pereval(pereval_id, {'title': 'Чимтаргинский', 'other_titles': 'Чимтарга седловина'})
+
+        def found(query):
+            return [p['id'] for p in self.db.search_perevals(query, limit=1000)]
+
+        assert pereval_id in found('чимтаргинский')
+        assert pereval_id in found('Чимтарг')  # префикс
+        assert pereval_id in found('чимтаргинскй')  # опечатка
+        assert pereval_id in found('седловины')  # другая форма слова
+        assert pereval_id not in found('тест горный')  # старое название больше не ищется
+
+    # Страницы поиска идут по убыванию релевантности без повторов
+    def test_search_perevals_pages(self):
+        for _ in range(3):
+            self.create_test_pereval()
+
+        first = self.db.search_perevals('тест', limit=2)
+        rest = self.db.search_perevals('тест', limit=1000, after=(first[-1]['rank'], first[-1]['id']))
+        ranks = [p['rank'] for p in first + rest]
+        ids = [p['id'] for p in first + rest]
+
+        assert len(ids) >= 3
+        assert ranks == sorted(ranks, reverse=True)
+        assert len(ids) == len(set(ids))
@@ -0,0 +1,91 @@
+import os
+import uuid
+import asyncio
+import httpx
+from async_database import AsyncDatabaseManager, create_async_pool
+from idempotency import request_fingerprint
+
+# Всегда используем тестовую БД
+os.environ["FSTR_DB_NAME"] = "pereval_test"
+
+import main
+
+
+PEREVAL = {
+    'beauty_title': 'тест перевал',
+    'title': 'тест идемпотентный',
+    'other_titles': 'тест',
+    'connect': '',
+    'add_time': '2023-12-07 12:00:00',
+    'user': {'email': 'idempotency@example.com', 'fam': '', 'name': '', 'otc': '', 'phone': ''},
+    'coords': {'latitude': 43.1, 'longitude': 42.2, 'height': 3000},
+    'level': {'winter': '', 'summer': '1А', 'autumn': '', 'spring': ''},
+    'images': [{'data': 'фото', 'title': 'фото'}]
+}
+
+
+async def add_once(pool, key, data):
+    db = AsyncDatabaseManager(pool)
+    assert await db.connect()
+    try:
+        return await db.add_pereval_once(key, request_fingerprint(data), data)
+    finally:
+        await db.disconnect()
+
+
+class TestIdempotency:
+    """Тесты для Idempotency-Key в POST /submitData"""
+
+    # Параллельные запросы с одним ключом на разных соединениях: один перевал, второй — повтор
+    def test_concurrent_duplicates(self):
+        key = uuid.uuid4().hex
+
+        async def scenario():
+            pool = create_async_pool()
+            await pool.open()
+            try:
+                return await asyncio.gather(*(add_once(pool, key, PEREVAL) for _ in range(4)))
+            finally:
+                await pool.close()
+
+        results = asyncio.run(scenario())
+        assert len({pereval_id for pereval_id, _, _ in results}) == 1
+        assert sorted(replayed for _, _, replayed in results) == [False, True, True, True]
+
+    # Тот же ключ с другими данными: возвращается отпечаток первого запроса, новый перевал не создаётся
+    def test_key_reused_with_other_data(self):
+        key = uuid.uuid4().hex
+
+        async def scenario():
+            pool = create_async_pool()
+            await pool.open()
+            try:
+                first = await add_once(pool, key, PEREVAL)
+                return first, await add_once(pool, key, dict(PEREVAL, title='другой'))
+            finally:
+                await pool.close()
+
+        first, second = asyncio.run(scenario())
+        assert second == (first[0], request_fingerprint(PEREVAL), True)
+
+    # Повтор через API: тот же ответ с Idempotency-Key и заголовком Idempotent-Replayed
+    def test_endpoint_replay(self):
+        key = uuid.uuid4().hex
+
+        async def scenario():
+            async with main.lifespan(main.app):
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    headers = {"Idempotency-Key": key}
+                    first, second = await asyncio.gather(
+                        client.post("/submitData", json=PEREVAL, headers=headers),
+                        client.post("/submitData", json=PEREVAL, headers=headers),
+                    )
+                    other = await client.post("/submitData", json=dict(PEREVAL, title='другой'), headers=headers)
+                    return first, second, other
+
+        first, second, other = asyncio.run(scenario())
+        assert first.json()["status"] == 200
+        assert second.json() == first.json()
+        assert {first.headers.get("Idempotent-Replayed"), second.headers.get("Idempotent-Replayed")} == {None, "true"}
+        assert other.status_code == 422
@@ -0,0 +1,148 @@
+import os
+import time
+import asyncio
+from async_database import AsyncDatabaseManager, create_async_pool
+from ingest import IngestWorkers, LocalSubmissionQueue, PostgresSubmissionQueue
+
+# Всегда используем тестовую БД
+os.environ["FSTR_DB_NAME"] = "pereval_test"
+
+
+PEREVAL = {
+    'beauty_title': 'тест перевал',
+    'title': 'тест отложенный',
+    'other_titles': 'тест',
+    'connect': '',
+    'add_time': '2023-12-07 12:00:00',
+    'user': {'email': 'ingest@example.com', 'fam': '', 'name': '', 'otc': '', 'phone': ''},
+    'coords': {'latitude': 43.1, 'longitude': 42.2, 'height': 3000},
+    'level': {'winter': '', 'summer': '1А', 'autumn': '', 'spring': ''},
+    'images': [{'data': 'фото', 'title': 'фото'}]
+}
+
+
+def run_with_queue(make_queue, func):
+    """Запускает корутину func(queue, workers) на очереди из make_queue(pool)"""
+    async def runner():
+        pool = create_async_pool()
+        await pool.open()
+        try:
+            queue = make_queue(pool)
+            return await func(queue, IngestWorkers(queue, workers=1, batch_size=100))
+        finally:
+            await pool.close()
+
+    return asyncio.run(runner())
+
+
+async def submit_and_drain(queue, workers):
+    good = await queue.enqueue(PEREVAL)
+    bad = await queue.enqueue(dict(PEREVAL, add_time='не дата'))
+    # проходит проверку, но её отвергает БД (высота вне int4) — остальные заявки пачки записываются
+    rejected = await queue.enqueue(dict(PEREVAL, coords={'latitude': 43.1, 'longitude': 42.2, 'height': 99999999999}))
+    last = await queue.enqueue(PEREVAL)
+    assert (await queue.status(good))["state"] == "queued"
+
+    while await workers.drain_once():
+        pass
+
+    db = AsyncDatabaseManager(queue.pool)
+    await db.connect()
+    try:
+        done = await queue.status(good)
+        assert (await queue.status(rejected))["state"] == "failed"
+        assert (await queue.status(last))["state"] == "done"
+        return done, await queue.status(bad), await db.get_pereval(done["id"])
+    finally:
+        await db.disconnect()
+
+
+class TestIngest:
+    """Тесты для очереди отложенной записи"""
+
+    # Заявка из таблицы submissions записывается воркером; неверная — failed
+    def test_postgres_queue(self):
+        done, failed, pereval = run_with_queue(PostgresSubmissionQueue, submit_and_drain)
+
+        assert done["state"] == "done"
+        assert pereval["title"] == "тест отложенный"
+        assert failed["state"] == "failed"
+        assert failed["message"]
+
+    # Сбой записи отдельного перевала (не отказ БД) — заявка возвращается в очередь с данными
+    def test_postgres_queue_item_retry(self, monkeypatch):
+        insert_pereval = AsyncDatabaseManager._insert_pereval
+        failures = []
+
+        async def flaky_insert(self, data):
+            if data["title"] == "тест сбой" and not failures:
+                failures.append(data["title"])
+                raise OSError("хранилище картинок недоступно")
+            return await insert_pereval(self, data)
+
+        monkeypatch.setattr(AsyncDatabaseManager, "_insert_pereval", flaky_insert)
+
+        async def scenario(queue, workers):
+            flaky = await queue.enqueue(dict(PEREVAL, title='тест сбой'))
+            # отказ БД переводит пачку на запись по одному
+            await queue.enqueue(dict(PEREVAL, coords={'latitude': 43.1, 'longitude': 42.2, 'height': 99999999999}))
+
+            await workers.drain_once()
+            db = AsyncDatabaseManager(queue.pool)
+            await db.connect()
+            try:
+                await db.cursor.execute("SELECT state, attempts, payload IS NOT NULL FROM submissions WHERE id = %s",
+                                        (flaky,))
+                after_failure = await db.cursor.fetchone()
+            finally:
+                await db.disconnect()
+
+            while await workers.drain_once():
+                pass
+            return after_failure, await queue.status(flaky)
+
+        after_failure, finished = run_with_queue(PostgresSubmissionQueue, scenario)
+        assert after_failure == ("queued", 1, True)
+        assert finished["state"] == "done" and finished["id"]
+
+    # То же для очереди в локальном каталоге
+    def test_local_queue(self, tmp_path):
+        done, failed, pereval = run_with_queue(
+            lambda pool: LocalSubmissionQueue(pool, str(tmp_path)), submit_and_drain
+        )
+
+        assert done["state"] == "done"
+        assert pereval["images"][0]["title"] == "фото"
+        assert failed["state"] == "failed"
+        assert os.listdir(tmp_path / "queued") == []
+
+    # Взятая заявка не возвращается в очередь по старому mtime файла; пропавшая заявка не роняет воркер
+    def test_local_claim_keeps_fresh_mtime(self, tmp_path):
+        async def scenario(queue, workers):
+            first, second = await queue.enqueue(PEREVAL), await queue.enqueue(PEREVAL)
+            stale = time.time() - 3600
+            for tracking_id in (first, second):
+                os.utime(queue._path("queued", tracking_id), (stale, stale))
+
+            claimed = queue._claim(10)
+            queue._requeue_expired()
+            in_processing = sorted(name[:-5] for name in os.listdir(tmp_path / "processing"))
+
+            os.unlink(queue._path("processing", second))
+            failed = {"status": 500, "id": None, "message": "ошибка"}
+            queue._finish(claimed, [failed, failed])
+            return [t for t, _ in claimed], in_processing, os.listdir(tmp_path / "queued")
+
+        claimed, in_processing, queued = run_with_queue(
+            lambda pool: LocalSubmissionQueue(pool, str(tmp_path)), scenario
+        )
+        assert claimed == in_processing and len(claimed) == 2
+        assert queued == [claimed[0] + ".json"]
+
+    # Неизвестная заявка
+    def test_unknown_tracking_id(self, tmp_path):
+        async def scenario(queue, workers):
+            return await queue.status("0123abc"), await queue.status("../etc")
+
+        assert run_with_queue(lambda pool: LocalSubmissionQueue(pool, str(tmp_path)), scenario) == (None, None)
+        assert run_with_queue(PostgresSubmissionQueue, lambda q, w: q.status("нет")) is None
@@ -0,0 +1,94 @@
+import os
+import json
+import asyncio
+import logging
+import logs
+from logs import JsonFormatter, REQUEST_ID, redact, is_read_only
+from async_database import AsyncDatabaseManager, create_async_pool
+from database import DatabaseManager
+
+# Всегда используем тестовую БД
+os.environ["FSTR_DB_NAME"] = "pereval_test"
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestLogs:
+    """Тесты для JSON-логов и журнала медленных запросов"""
+
+    # Запись — одна JSON-строка с ID запроса и дополнительными полями
+    def test_json_formatter(self):
+        record = logging.LogRecord("pereval.db", logging.ERROR, __file__, 1, "Ошибка %s", ("БД",), None)
+        record.fields = {"method": "get_pereval"}
+        token = REQUEST_ID.set("req-1")
+        try:
+            entry = json.loads(JsonFormatter().format(record))
+        finally:
+            REQUEST_ID.reset(token)
+
+        assert entry["message"] == "Ошибка БД"
+        assert entry["level"] == "error"
+        assert entry["request_id"] == "req-1"
+        assert entry["method"] == "get_pereval"
+
+    # Значения строк в параметрах не попадают в лог
+    def test_redact(self):
+        assert redact(("test@example.com", 5, None)) == ["<str len=16>", 5, None]
+        assert redact({"email": "a@b.c", "ids": list(range(100))}) == {"email": "<str len=5>", "ids": "<list n=100>"}
+
+    # EXPLAIN ANALYZE — только для операторов чтения
+    def test_is_read_only(self):
+        assert is_read_only("SELECT * FROM pereval_added WHERE id=%s")
+        assert is_read_only("  WITH x AS (SELECT 1) SELECT * FROM x")
+        assert not is_read_only("WITH u AS (UPDATE pereval_added SET title='x' RETURNING id) SELECT * FROM u")
+        assert not is_read_only("SELECT nextval('coords_id_seq')")
+        assert not is_read_only("INSERT INTO users (email) VALUES (%s)")
+
+    # Медленный оператор пишется с методом, параметрами без значений и планом
+    def test_slow_query_logged(self, monkeypatch):
+        monkeypatch.setattr(logs, "SLOW_QUERY_MS", 0)
+        monkeypatch.setattr(logs, "SLOW_QUERY_EXPLAIN_SAMPLE", 1)
+        handler = ListHandler()
+        logs.sql_logger.addHandler(handler)
+
+        async def scenario():
+            pool = create_async_pool()
+            await pool.open()
+            db = AsyncDatabaseManager(pool)
+            try:
+                assert await db.connect()
+                await db.get_user_perevals("test@example.com", limit=1)
+            finally:
+                await db.disconnect()
+                await pool.close()
+
+        try:
+            asyncio.run(scenario())
+        finally:
+            logs.sql_logger.removeHandler(handler)
+
+        fields = handler.records[0].fields
+        assert fields["method"] == "get_user_perevals"
+        assert fields["params"][0] == "<str len=16>"
+        assert fields["plan"][0]["Plan"]["Node Type"]
+
+    # Ошибка EXPLAIN не прерывает транзакцию вызывающего
+    def test_explain_error_keeps_transaction(self, monkeypatch):
+        monkeypatch.setattr(logs, "SLOW_QUERY_EXPLAIN_SAMPLE", 1)
+
+        db = DatabaseManager()
+        try:
+            assert db.connect()
+            db.cursor.execute("SELECT 1")
+            assert db.cursor._explain("SELECT * FROM no_such_table", None) is None
+            db.cursor.execute("SELECT 2")
+            assert db.cursor.fetchone()[0] == 2
+        finally:
+            db.disconnect()
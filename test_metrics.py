@@ -0,0 +1,103 @@
+import asyncio
+import httpx
+from fastapi import FastAPI
+from metrics import Histogram, Registry, MetricsMiddleware, instrument_db
+
+
+class TestRegistry:
+    """Тесты для хранилища метрик"""
+
+    # Гистограмма раскладывает значения по корзинам «не больше границы»
+    def test_histogram_buckets(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+
+        assert histogram.counts == [2, 1, 1]
+        assert histogram.count == 4
+
+    # Текстовый формат: накопительные корзины, сумма и число наблюдений
+    def test_render(self):
+        registry = Registry()
+        registry.observe_db("sync", "get_pereval", 0.002)
+        registry.collectors.append(lambda: {"pereval_db_pool_size": 4})
+
+        text = registry.render()
+        assert 'pereval_db_calls_total{manager="sync",method="get_pereval"} 1' in text
+        assert 'pereval_db_call_duration_seconds_bucket{manager="sync",method="get_pereval",le="+Inf"} 1' in text
+        assert 'pereval_db_call_duration_seconds_bucket{manager="sync",method="get_pereval",le="0.001"} 0' in text
+        assert "pereval_db_pool_size 4" in text
+
+
+class TestInstrumentation:
+    """Тесты для middleware и замера методов слоя БД"""
+
+    # Запросы учитываются по шаблону маршрута и статусу
+    def test_middleware(self):
+        registry = Registry()
+        app = FastAPI()
+        app.add_middleware(MetricsMiddleware, registry=registry)
+
+        @app.get("/items/{item_id}")
+        async def item(item_id: int):
+            return {"id": item_id}
+
+        async def scenario():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                await client.get("/items/1")
+                await client.get("/items/2")
+                await client.get("/items/x")
+
+        asyncio.run(scenario())
+        assert registry.requests[("GET", "/items/{item_id}", 200)] == 2
+        assert registry.requests[("GET", "/items/{item_id}", 422)] == 1
+        assert registry.response_bytes[("GET", "/items/{item_id}")].count == 3
+
+    # Некорректный Content-Length не роняет запрос, размер тела просто не учитывается
+    def test_middleware_bad_content_length(self):
+        registry = Registry()
+
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"ok"})
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            pass
+
+        scope = {"type": "http", "method": "POST", "headers": [(b"content-length", b"abc")]}
+        asyncio.run(MetricsMiddleware(app, registry=registry)(scope, receive, send))
+        assert registry.requests[("POST", "<unmatched>", 200)] == 1
+        assert not registry.request_bytes
+
+    # Замеряются публичные методы: синхронные, асинхронные и потоковые (до конца потока)
+    def test_instrument_db(self):
+        registry = Registry()
+
+        @instrument_db("test", registry)
+        class Manager:
+            def get(self):
+                return 1
+
+            async def fetch(self):
+                return 2
+
+            async def stream(self):
+                yield 4
+                yield 5
+
+            def _private(self):
+                return 3
+
+        async def collect():
+            return [item async for item in manager.stream()]
+
+        manager = Manager()
+        assert manager.get() == 1
+        assert asyncio.run(manager.fetch()) == 2
+        assert asyncio.run(collect()) == [4, 5]
+        assert manager._private() == 3
+        assert set(registry.db_calls) == {("test", "get"), ("test", "fetch"), ("test", "stream")}
@@ -0,0 +1,31 @@
+import os
+import psycopg2
+from database import db_params
+from migrations import MIGRATIONS, applied_versions, migrate
+
+# Всегда используем тестовую БД
+os.environ["FSTR_DB_NAME"] = "pereval_test"
+
+
+class TestMigrations:
+    """Тесты для миграций схемы"""
+
+    def setup_method(self):
+        self.connection = psycopg2.connect(**db_params())
+
+    def teardown_method(self):
+        self.connection.close()
+
+    # Все миграции записаны в schema_migrations
+    def test_all_applied(self):
+        with self.connection.cursor() as cursor:
+            assert applied_versions(cursor) == [m[0] for m in MIGRATIONS]
+
+    # Повторный запуск ничего не применяет
+    def test_idempotent(self):
+        assert migrate(self.connection) == []
+
+    # Версии уникальны и идут по возрастанию
+    def test_versions_ordered(self):
+        versions = [m[0] for m in MIGRATIONS]
+        assert versions == sorted(set(versions))
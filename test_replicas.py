@@ -0,0 +1,157 @@
+import os
+import time
+import asyncio
+import httpx
+import pytest
+from async_database import AsyncDatabaseManager, create_async_pool
+from database import db_params
+from replicas import PRIMARY_COOKIE, Replica, ReplicaSet
+
+# Всегда используем тестовую БД
+os.environ["FSTR_DB_NAME"] = "pereval_test"
+
+import main
+
+# вторая локальная БД — реплика основной (pg_basebackup -R), например FSTR_TEST_REPLICA_HOST=/tmp/pgreplica
+REPLICA_HOST = os.getenv("FSTR_TEST_REPLICA_HOST")
+
+PEREVAL = {
+    'beauty_title': 'тест перевал',
+    'title': 'тест реплика',
+    'other_titles': 'тест',
+    'connect': '',
+    'add_time': '2023-12-07 12:00:00',
+    'user': {'email': 'replica@example.com', 'fam': '', 'name': '', 'otc': '', 'phone': ''},
+    'coords': {'latitude': 43.1, 'longitude': 42.2, 'height': 3000},
+    'level': {'winter': '', 'summer': '1А', 'autumn': '', 'spring': ''},
+    'images': []
+}
+
+
+def run_with_replicas(host: str, func):
+    """Запускает корутину func(replicas) с одной репликой host"""
+    async def runner():
+        primary = create_async_pool()
+        await primary.open()
+        replica = Replica(host, create_async_pool(dict(db_params(), host=host), timeout=0.5))
+        replicas = ReplicaSet(primary, [replica], max_lag=5, check_interval=0.5)
+        await replicas.start()
+        try:
+            return await func(replicas)
+        finally:
+            await replicas.close()
+            await primary.close()
+
+    return asyncio.run(runner())
+
+
+async def in_recovery(db: AsyncDatabaseManager) -> bool:
+    assert await db.connect()
+    try:
+        await db.cursor.execute("SELECT pg_is_in_recovery()")
+        return (await db.cursor.fetchone())[0]
+    finally:
+        await db.disconnect()
+
+
+class TestReplicas:
+    """Тесты для чтения с реплик"""
+
+    # Недоступная реплика не используется, а запрос, уже выбравший её, уходит на основную БД
+    def test_unreachable_replica(self, tmp_path):
+        async def scenario(replicas):
+            replica = replicas.replicas[0]
+            db = AsyncDatabaseManager(replica.pool, fallback=replicas.primary)
+            return replica.healthy, replicas.read_pool({}), await in_recovery(db)
+
+        healthy, pool, recovery = run_with_replicas(str(tmp_path), scenario)
+        assert not healthy and pool is None
+        assert recovery is False
+
+    # Сервер не в режиме восстановления (например, основная БД) репликой не считается
+    def test_not_in_recovery(self):
+        async def scenario(replicas):
+            return replicas.replicas[0].healthy, replicas.read_pool({})
+
+        healthy, pool = run_with_replicas(db_params()["host"], scenario)
+        assert not healthy and pool is None
+
+    # После записи чтения клиента закрепляются за основной БД
+    def test_primary_after_write(self, monkeypatch):
+        monkeypatch.setenv("FSTR_DB_REPLICA_HOSTS", REPLICA_HOST or db_params()["host"])
+
+        async def scenario():
+            async with main.lifespan(main.app):
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    read = await client.get("/submitData/", params={"user__email": "replica@example.com"})
+                    write = await client.post("/submitData", json=PEREVAL)
+                    pinned = await client.get("/submitData/", params={"user__email": "replica@example.com"})
+                    return read, write, pinned, main.app.state.replicas.stats()
+
+        read, write, pinned, stats = asyncio.run(scenario())
+        assert PRIMARY_COOKIE not in read.cookies
+        assert write.cookies[PRIMARY_COOKIE] == "1"
+        assert write.json()["id"] in [p["id"] for p in pinned.json()]
+        assert stats["pinned_reads"] == 1
+        assert stats["replica_reads"] + stats["primary_reads"] == 1
+
+    # Настоящая реплика: чтение идёт на неё, записанное видно после догоняющей проверки
+    @pytest.mark.skipif(REPLICA_HOST is None, reason="FSTR_TEST_REPLICA_HOST не задан")
+    def test_streaming_replica(self):
+        async def scenario(replicas):
+            db = AsyncDatabaseManager(replicas.primary)
+            assert await db.connect()
+            pereval_id = await db.add_pereval(PEREVAL)
+            await db.disconnect()
+
+            deadline = time.monotonic() + 10
+            while True:
+                await replicas.check()
+                if replicas.replicas[0].lag == 0 or time.monotonic() > deadline:
+                    break
+                await asyncio.sleep(0.1)
+
+            pool = replicas.read_pool({})
+            assert pool is replicas.replicas[0].pool
+            db = AsyncDatabaseManager(pool, fallback=replicas.primary)
+            assert await db.connect()
+            found = await db.get_pereval(pereval_id)
+            await db.disconnect()
+            return found, await in_recovery(AsyncDatabaseManager(pool)), replicas.read_pool({PRIMARY_COOKIE: "1"})
+
+        found, recovery, pinned = run_with_replicas(REPLICA_HOST, scenario)
+        assert found["title"] == "тест реплика"
+        assert recovery is True
+        assert pinned is None
+
+    # Реплика, отставшая больше max_lag, исключается и возвращается, когда догонит
+    @pytest.mark.skipif(REPLICA_HOST is None, reason="FSTR_TEST_REPLICA_HOST не задан")
+    def test_lagging_replica(self):
+        async def replay(replicas, action: str):
+            async with replicas.replicas[0].pool.connection() as conn:
+                await conn.execute(f"SELECT pg_wal_replay_{action}()")
+
+        async def scenario(replicas):
+            replicas.max_lag = 0.2
+            await replay(replicas, "pause")
+            try:
+                db = AsyncDatabaseManager(replicas.primary)
+                assert await db.connect()
+                await db.add_pereval(PEREVAL)
+                await db.disconnect()
+                await asyncio.sleep(0.3)
+                await replicas.check()
+                lagging = replicas.replicas[0].healthy, replicas.read_pool({})
+            finally:
+                await replay(replicas, "resume")
+
+            deadline = time.monotonic() + 10
+            while not replicas.replicas[0].healthy and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+                await replicas.check()
+            return lagging, replicas.replicas[0].healthy
+
+        (healthy, pool), recovered = run_with_replicas(REPLICA_HOST, scenario)
+        assert not healthy and pool is None
+        assert recovered
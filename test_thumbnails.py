@@ -0,0 +1,94 @@
+import io
+import time
+import asyncio
+import threading
+import pytest
+from blobstore import LocalBlobStore
+from thumbnails import SIZES, ThumbnailGenerator, make_derivatives
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def jpeg(width: int, height: int) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 120, 40)).save(out, "JPEG", quality=95)
+    return out.getvalue()
+
+
+class TestThumbnails:
+    """Тесты для уменьшенных копий картинок"""
+
+    def setup_method(self):
+        self.generator = None
+
+    def teardown_method(self):
+        if self.generator is not None:
+            self.generator.close()
+
+    def start(self, root) -> LocalBlobStore:
+        store = LocalBlobStore(str(root))
+        self.generator = ThumbnailGenerator(store, workers=1)
+        asyncio.run(self.generator.start())
+        return store
+
+    # Новая картинка в хранилище — копии делаются в пуле процессов, запись не ждёт их
+    def test_generated_after_put(self, tmp_path):
+        store = self.start(tmp_path)
+        key = store.put(jpeg(3000, 1500))
+
+        deadline = time.monotonic() + 30
+        while self.generator.stats()["pending"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        assert self.generator.stats()["generated"] == 1
+        with store.derived("thumb").open(key) as f, Image.open(f) as thumb:
+            assert thumb.format == "WEBP"
+            assert thumb.size == (SIZES["thumb"], SIZES["thumb"] // 2)
+        assert store.derived("medium").size(key) < store.size(key)
+
+    # Копии нет (картинка загружена раньше) — делается по запросу
+    def test_ensure_missing(self, tmp_path):
+        key = LocalBlobStore(str(tmp_path)).put(jpeg(800, 800))
+        store = self.start(tmp_path)
+
+        assert asyncio.run(self.generator.ensure(key, "thumb"))
+        with store.derived("thumb").open(key) as f, Image.open(f) as thumb:
+            assert thumb.size == (SIZES["thumb"], SIZES["thumb"])
+
+    # Хранилище читается не в потоке event loop
+    def test_ensure_off_loop(self, tmp_path):
+        key = LocalBlobStore(str(tmp_path)).put(jpeg(300, 300))
+        store = self.start(tmp_path)
+        threads = []
+        open_blob = store.open
+
+        def tracked_open(key):
+            threads.append(threading.get_ident())
+            return open_blob(key)
+
+        store.open = tracked_open
+        assert asyncio.run(self.generator.ensure(key, "thumb"))
+        assert threads and threading.get_ident() not in threads
+
+    # Не картинка — копий нет, отдаётся оригинал
+    def test_not_an_image(self, tmp_path):
+        store = self.start(tmp_path)
+        key = store.put("тестфото".encode("utf-8"))
+
+        assert not asyncio.run(self.generator.ensure(key, "thumb"))
+        assert self.generator.stats()["pending"] == 0
+
+    # Файл оригинала закрывается и после копий, и когда содержимое не картинка
+    def test_source_closed(self, tmp_path):
+        store = LocalBlobStore(str(tmp_path))
+        opened = []
+        open_blob = store.open
+
+        def tracked_open(key):
+            opened.append(open_blob(key))
+            return opened[-1]
+
+        store.open = tracked_open
+        assert make_derivatives(store, store.put(jpeg(400, 300)))
+        assert not make_derivatives(store, store.put("тестфото".encode("utf-8")))
+        assert len(opened) == 2 and all(f.closed for f in opened)
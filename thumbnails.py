@@ -0,0 +1,187 @@
+"""
+Уменьшенные копии картинок для списков перевалов.
+
+Размеры — SIZES (по большей стороне), формат WebP. Копии делает пул процессов (Pillow, CPU) сразу после
+записи новой картинки в хранилище, не задерживая ответ; хранятся они под ключом оригинала в
+derived("thumb") и derived("medium"). GET /images/{key}?size=thumb отдаёт копию, а если её ещё нет
+(картинка загружена раньше или очередь была полна) — делает её в том же пуле.
+Без Pillow (или при FSTR_THUMBNAILS=0) копии не делаются и отдаётся оригинал.
+"""
+import io
+import os
+import queue
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
+from blobstore import BlobStore, sniff_content_type
+from cache import LRUCache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger("pereval.thumbnails")
+
+SIZES = {
+    "medium": int(os.getenv("FSTR_THUMB_MEDIUM", "1024")),
+    "thumb": int(os.getenv("FSTR_THUMB_SMALL", "256")),
+}
+THUMB_QUALITY = int(os.getenv("FSTR_THUMB_QUALITY", "75"))
+THUMB_CONTENT_TYPE = "image/webp"
+
+
+THUMB_NICE = int(os.getenv("FSTR_THUMB_NICE", "10"))
+
+
+# процессы пула уступают процессор обработке запросов
+def _lower_priority():
+    if hasattr(os, "nice"):
+        os.nice(THUMB_NICE)
+
+
+def is_image(head: bytes) -> bool:
+    return sniff_content_type(head).startswith("image/")
+
+
+# выполняется в процессе пула: все копии оригинала key; False — содержимое не удалось прочитать как картинку
+def make_derivatives(store: BlobStore, key: str) -> bool:
+    try:
+        # Pillow закрывает только файлы, открытые им самим, — файл хранилища закрываем сами
+        with store.open(key) as f, Image.open(f) as source:
+            # JPEG декодируется сразу в уменьшенном масштабе
+            source.draft("RGB", (max(SIZES.values()),) * 2)
+            image = ImageOps.exif_transpose(source)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "transparency" in image.info or "A" in image.mode else "RGB")
+            # от большей копии к меньшей: каждая следующая уменьшается из предыдущей
+            for name, side in sorted(SIZES.items(), key=lambda item: -item[1]):
+                image.thumbnail((side, side), Image.LANCZOS)
+                out = io.BytesIO()
+                image.save(out, "WEBP", quality=THUMB_QUALITY, method=4)
+                store.derived(name).put_at(key, out.getvalue())
+        return True
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return False
+
+
+class ThumbnailGenerator:
+    """Пул процессов для копий: после записи новой картинки и по запросу отсутствующей копии"""
+
+    def __init__(self, store: BlobStore, workers: int = 2, max_pending: int = 256):
+        self.store = store
+        self.max_pending = max_pending
+        # spawn: в процессы пула не копируется состояние event loop и пулов соединений
+        self.executor = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn"), initializer=_lower_priority
+        )
+        self.failed_keys = LRUCache(max_size=10000, ttl=3600)  # не картинки — не пытаемся снова
+        # задачи передаёт в пул отдельный поток: запуск процессов и передача данных не задерживают запись
+        self._queue: "queue.Queue" = queue.Queue()
+        self._feeder = threading.Thread(target=self._feed, name="thumbnails", daemon=True)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.generated = 0
+        self.failed = 0
+        self.dropped = 0
+
+    async def start(self):
+        # первый процесс пула запускается при старте приложения, а не рядом с первым запросом
+        await asyncio.get_running_loop().run_in_executor(self.executor, int)
+        self._feeder.start()
+        self.store.listeners.append(self.submit)
+
+    def close(self):
+        if self.submit in self.store.listeners:
+            self.store.listeners.remove(self.submit)
+        self._queue.put(None)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    # слушатель BlobStore.put (вызывается в потоке записи): только ставит картинку в очередь
+    def submit(self, key: str, content: bytes):
+        if not is_image(content[:16]):
+            return
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.dropped += 1  # копии сделает первый запрос с size
+                return
+            self.pending += 1
+        self._queue.put(key)
+
+    def _feed(self):
+        while True:
+            key = self._queue.get()
+            if key is None:
+                return
+            # оригинал уже записан — процесс пула читает его сам, данные не передаются через канал
+            try:
+                future = self.executor.submit(make_derivatives, self.store, key)
+            except Exception:
+                logger.exception("Ошибка постановки картинки в пул копий")
+                self._finish(key, None)
+                continue
+            future.add_done_callback(lambda f, key=key: self._finish(key, f))
+
+    def _finish(self, key: str, future: Optional[Future]):
+        ok = False
+        if future is not None and not future.cancelled():
+            try:
+                ok = future.result()
+            except Exception:
+                logger.exception("Ошибка создания копий картинки")
+        with self._lock:
+            self.pending -= 1
+            if ok:
+                self.generated += 1
+            else:
+                self.failed += 1
+        if not ok:
+            self.failed_keys.set(key, True)
+
+    def _is_image_blob(self, key: str) -> bool:
+        with self.store.open(key) as f:
+            return is_image(f.read(16))
+
+    # копия size готова (сделана сейчас, если её не было); False — отдавать оригинал.
+    # Обращения к хранилищу — в потоке: хранилище может быть сетевым, event loop их не ждёт
+    async def ensure(self, key: str, size: str) -> bool:
+        derived = self.store.derived(size)
+        if await asyncio.to_thread(derived.size, key) is not None:
+            return True
+        if self.failed_keys.get(key) is not None:
+            return False
+
+        if not await asyncio.to_thread(self._is_image_blob, key):
+            return False
+        loop = asyncio.get_running_loop()
+        try:
+            ok = await loop.run_in_executor(self.executor, make_derivatives, self.store, key)
+        except Exception:
+            logger.exception("Ошибка создания копий картинки")
+            ok = False
+        if not ok:
+            self.failed_keys.set(key, True)
+        return ok and await asyncio.to_thread(derived.size, key) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"pending": self.pending, "generated": self.generated,
+                    "failed": self.failed, "dropped": self.dropped}
+
+
+# генератор по настройкам из .env; None — копии выключены или нет Pillow
+def create_thumbnail_generator(store: BlobStore) -> Optional[ThumbnailGenerator]:
+    if os.getenv("FSTR_THUMBNAILS", "1") != "1":
+        return None
+    if Image is None:
+        logger.warning("Pillow не установлен: уменьшенные копии картинок выключены")
+        return None
+    return ThumbnailGenerator(
+        store,
+        workers=int(os.getenv("FSTR_THUMB_WORKERS", "2")),
+        max_pending=int(os.getenv("FSTR_THUMB_QUEUE", "256")),
+    )